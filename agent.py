@@ -1,9 +1,26 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import requests
 import json
+import csv
+import io
 import logging
 import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from analytics import ANALYTICS_CURVE_POINTS, portfolio_analytics
+from history_store import DEAL_FIELDS, get_history_store
+from idempotency import executed_orders, idempotency_comment
+from metrics import PROMETHEUS_CONTENT_TYPE, Timings, registry
+from mt5_executor import PRIORITY_HISTORY, PRIORITY_READ, PRIORITY_TRADE, mt5_executor
+from position_index import PositionIndex
+from execution_policy import EXEC_DEVIATION, TRADE_RETCODE_INVALID_FILL, ExecutionPolicy
+from position_watcher import PositionWatcher
+from symbol_cache import normalize_volume, symbol_cache
+from terminal_workers import terminal_workers
+from wire_format import FORMAT_ROWS, negotiate_format, unsupported_format_response, wire_response
 
 # Configurazione del logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -15,6 +32,43 @@ CORS(app)
 # Configurazione dell'agente
 MT5_PATH = os.environ.get('MT5_PATH', "C:\\Program Files\\MetaTrader 5\\terminal64.exe")
 CONFIG_FILE = 'agent_config.json'
+WATCH_INTERVAL_MS = float(os.environ.get('WATCH_INTERVAL_MS', 50))
+EVENTS_KEEPALIVE_SECONDS = 15
+HISTORY_MAX_PAGE_SIZE = 5000
+# Giorni massimi di cronologia restituiti in un'unica risposta da /api/history?days=
+# (per intervalli più lunghi si usa l'esportazione in streaming)
+HISTORY_MAX_DAYS = int(os.environ.get('HISTORY_MAX_DAYS', 90))
+# Deal letti dall'archivio per ogni pagina dell'esportazione in streaming
+HISTORY_EXPORT_PAGE_SIZE = int(os.environ.get('HISTORY_EXPORT_PAGE_SIZE', 5000))
+ORDER_BATCH_MAX_SIZE = int(os.environ.get('ORDER_BATCH_MAX_SIZE', 100))
+AGENT_PORT = int(os.environ.get('AGENT_PORT', 5001))
+# Validità delle letture in cache (conto e posizioni), in millisecondi; mentre il terminale
+# esegue un ordine le letture sono servite dalla cache fino a READ_CACHE_MAX_AGE_MS
+READ_CACHE_TTL_MS = float(os.environ.get('READ_CACHE_TTL_MS', 100))
+READ_CACHE_MAX_AGE_MS = float(os.environ.get('READ_CACHE_MAX_AGE_MS', 2000))
+# Ampiezza dei blocchi in cui viene scaricata la cronologia dal terminale, in giorni
+HISTORY_FETCH_CHUNK_DAYS = float(os.environ.get('HISTORY_FETCH_CHUNK_DAYS', 7))
+# Giorni di cronologia scaricati per le statistiche di portafoglio
+ANALYTICS_HISTORY_DAYS = float(os.environ.get('ANALYTICS_HISTORY_DAYS', 365))
+
+# Funzioni eseguite sul terminale con la priorità degli ordini
+TRADE_FUNCTIONS = {'open_position', 'close_position', 'modify_position', 'execute_batch'}
+# Funzioni della cronologia: non occupano il thread del terminale per tutta la durata,
+# ma solo per i singoli blocchi di deal scaricati
+HISTORY_FUNCTIONS = {'query_history', 'get_history', 'get_analytics', 'export_history_page'}
+# Letture servite dalla cache quando sono recenti o il terminale sta eseguendo un ordine
+CACHED_READS = {'get_account_info', 'get_positions'}
+
+# Metriche del percorso degli ordini, esposte su /metrics
+order_span_ms = registry.histogram(
+    'mrc_agent_order_span_ms', "Durata delle fasi di un'operazione sull'agente, in millisecondi", ('operation', 'span')
+)
+order_retcodes = registry.counter(
+    'mrc_agent_order_retcodes_total', 'Retcode restituiti da order_send', ('operation', 'retcode')
+)
+order_results = registry.counter(
+    'mrc_agent_orders_total', "Operazioni eseguite dall'agente per esito", ('operation', 'result')
+)
 
 # Carica la configurazione se esiste
 def load_config():
@@ -38,19 +92,39 @@ def save_config(config):
         logger.error(f"Errore nel salvataggio della configurazione: {e}")
 
 # Inizializza MetaTrader 5
-def initialize_mt5(account_number, password, server):
+def initialize_mt5(account_number, password, server, path=None):
     try:
         import MetaTrader5 as mt5
         
+        previous_account = mt5.account_info() if mt5.terminal_info() else None
+        
         # Chiudi eventuali istanze aperte
         mt5.shutdown()
         
+        # Senza password il terminale usa le credenziali salvate
+        credentials = {'login': int(account_number), 'server': server}
+        if password:
+            credentials['password'] = password
+        
         # Inizializza con i parametri specificati
-        if not mt5.initialize(login=account_number, password=password, server=server, path=config['mt5_path']):
+        if not mt5.initialize(path=path or config['mt5_path'], **credentials):
             logger.error(f"Inizializzazione MT5 fallita: {mt5.last_error()}")
             return False, f"Errore: {mt5.last_error()}"
         
         logger.info(f"MT5 inizializzato con successo per l'account {account_number}")
+        
+        # Preseleziona i simboli configurati e quelli delle posizioni aperte
+        symbol_cache.clear()
+        executed_orders.clear()
+        read_cache.clear()
+        # Con un account diverso le posizioni dell'account precedente non vanno
+        # notificate come chiuse, né quelle del nuovo come aperte
+        if previous_account is None or previous_account.login != int(account_number):
+            position_watcher.reset()
+            position_index.reset()
+        symbols = config.get('symbols', []) + [p.symbol for p in mt5.positions_get() or ()]
+        symbol_cache.preload(symbols)
+        
         return True, "Inizializzazione riuscita"
     except Exception as e:
         logger.error(f"Errore durante l'inizializzazione di MT5: {e}")
@@ -85,6 +159,26 @@ def get_account_info():
         logger.error(f"Errore durante il recupero delle informazioni dell'account: {e}")
         return False, f"Errore: {e}", None
 
+# Converti una posizione (namedtuple) in dizionario
+def position_to_dict(position):
+    return {
+        'ticket': position.ticket,
+        'time': position.time,
+        'type': position.type,
+        'magic': position.magic,
+        'symbol': position.symbol,
+        'volume': position.volume,
+        'price_open': position.price_open,
+        'price_current': position.price_current,
+        'sl': position.sl,
+        'tp': position.tp,
+        'profit': position.profit,
+        'comment': position.comment
+    }
+
+# Indice delle posizioni aperte per ticket: solo le posizioni cambiate vengono riconvertite
+position_index = PositionIndex(position_to_dict)
+
 # Ottieni posizioni aperte
 def get_positions():
     try:
@@ -97,165 +191,304 @@ def get_positions():
         if positions is None:
             return False, f"Errore nel recupero delle posizioni: {mt5.last_error()}", None
         
-        # Converti gli oggetti namedtuple in dizionari
-        positions_list = []
-        for position in positions:
-            position_dict = {
-                'ticket': position.ticket,
-                'time': position.time,
-                'type': position.type,
-                'magic': position.magic,
-                'symbol': position.symbol,
-                'volume': position.volume,
-                'price_open': position.price_open,
-                'price_current': position.price_current,
-                'sl': position.sl,
-                'tp': position.tp,
-                'profit': position.profit
-            }
-            positions_list.append(position_dict)
+        positions_list = position_index.update(positions)
         
         return True, "Posizioni recuperate con successo", positions_list
     except Exception as e:
         logger.error(f"Errore durante il recupero delle posizioni: {e}")
         return False, f"Errore: {e}", None
 
-# Ottieni cronologia delle operazioni
-def get_history(days=7):
+# Ottieni le posizioni cambiate dopo una versione dell'indice
+def get_position_changes(since):
+    # Se il watcher ha aggiornato l'indice da poco non serve interrogare il terminale
+    if not position_index.is_fresh(2 * WATCH_INTERVAL_MS / 1000):
+        success, message, data = get_positions()
+        if not success:
+            return False, message, None
+    
+    return True, "Posizioni recuperate con successo", position_index.changes_since(since)
+
+# Scarica dal terminale i deal di un intervallo (timestamp in secondi)
+def fetch_deals_range(date_from, date_to):
+    import MetaTrader5 as mt5
+    from datetime import datetime
+    
+    history = mt5.history_deals_get(datetime.fromtimestamp(date_from), datetime.fromtimestamp(date_to))
+    if history is None:
+        logger.error(f"Errore nel recupero della cronologia: {mt5.last_error()}")
+    return history
+
+# Scarica i deal di un blocco dell'intervallo da sincronizzare (l'archivio li richiede a
+# blocchi di HISTORY_FETCH_CHUNK_DAYS giorni), in coda sul thread del terminale con la
+# priorità più bassa: una cronologia lunga non blocca gli ordini, che vengono eseguiti
+# tra un blocco e l'altro, e ogni blocco viene archiviato prima di scaricare il successivo
+def fetch_deals(date_from, date_to):
+    return mt5_executor.call(PRIORITY_HISTORY, fetch_deals_range, date_from, date_to)
+
+# Aggiorna l'archivio locale della cronologia dell'account connesso a partire da
+# date_from, scaricando dal terminale solo i deal mancanti. Restituisce
+# (login, archivio, None) oppure (None, None, messaggio di errore).
+def sync_history(date_from):
+    import MetaTrader5 as mt5
+    
+    if not mt5_executor.call(PRIORITY_READ, mt5.terminal_info):
+        return None, None, "MT5 non inizializzato"
+    
+    login = mt5_executor.call(PRIORITY_READ, get_login)
+    if login is None:
+        return None, None, f"Errore nel recupero delle informazioni dell'account: {mt5.last_error()}"
+    
+    store = get_history_store(login)
+    if not store.sync(fetch_deals, date_from, chunk_seconds=HISTORY_FETCH_CHUNK_DAYS * 24 * 3600):
+        return None, None, f"Errore nel recupero della cronologia: {mt5.last_error()}"
+    
+    return login, store, None
+
+# Interroga l'archivio locale della cronologia dell'account connesso, scaricando prima
+# dal terminale solo i deal mancanti (con columnar=True i deal sono restituiti per colonne)
+def query_history(date_from=None, date_to=None, limit=None, offset=0, columnar=False):
     try:
-        import MetaTrader5 as mt5
-        from datetime import datetime, timedelta
+        if date_from is None:
+            date_from = int(time.time()) - 7 * 24 * 3600
         
-        if not mt5.terminal_info():
-            return False, "MT5 non inizializzato", None
+        login, store, error = sync_history(date_from)
+        if error is not None:
+            return False, error, None
         
-        # Calcola l'intervallo di tempo
-        now = datetime.now()
-        from_date = now - timedelta(days=days)
-        
-        # Ottieni la cronologia
-        history = mt5.history_deals_get(from_date, now)
-        if history is None:
-            return False, f"Errore nel recupero della cronologia: {mt5.last_error()}", None
-        
-        # Converti gli oggetti namedtuple in dizionari
-        history_list = []
-        for deal in history:
-            deal_dict = {
-                'ticket': deal.ticket,
-                'time': deal.time,
-                'type': deal.type,
-                'entry': deal.entry,
-                'magic': deal.magic,
-                'symbol': deal.symbol,
-                'volume': deal.volume,
-                'price': deal.price,
-                'profit': deal.profit,
-                'commission': deal.commission,
-                'swap': deal.swap,
-                'fee': deal.fee
-            }
-            history_list.append(deal_dict)
+        deals, total = store.query(date_from, date_to, limit, offset, columnar)
         
-        return True, "Cronologia recuperata con successo", history_list
+        return True, "Cronologia recuperata con successo", {
+            'deals': deals,
+            'total': total,
+            'limit': limit,
+            'offset': offset
+        }
     except Exception as e:
         logger.error(f"Errore durante il recupero della cronologia: {e}")
         return False, f"Errore: {e}", None
 
-# Apri una posizione (market o limite)
-def open_position(symbol, order_type, volume, sl=0.0, tp=0.0, limit_price=None, fallback_to_market=False):
+# Ottieni cronologia delle operazioni
+def get_history(days=7, columnar=False):
+    success, message, data = query_history(date_from=int(time.time()) - days * 24 * 3600, columnar=columnar)
+    return success, message, data['deals'] if success else None
+
+# Pagina dell'esportazione della cronologia: deal dell'intervallo successivi al cursore
+# (time, ticket) e cursore dell'ultimo deal restituito, None alla fine dell'intervallo.
+# L'archivio viene sincronizzato con il terminale solo se richiesto (prima pagina).
+def export_history_page(date_from, date_to, cursor=None, sync=True, limit=HISTORY_EXPORT_PAGE_SIZE):
+    try:
+        if sync:
+            login, store, error = sync_history(date_from)
+            if error is not None:
+                return False, error, None
+        else:
+            login = mt5_executor.call(PRIORITY_READ, get_login)
+            if login is None:
+                return False, "Errore nel recupero delle informazioni dell'account", None
+            store = get_history_store(login)
+        
+        rows = store.page(date_from, date_to, cursor, limit)
+        # Le prime colonne di DEAL_FIELDS sono ticket e time
+        next_cursor = (rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+        return True, "Cronologia recuperata con successo", {'rows': rows, 'cursor': next_cursor}
+    except Exception as e:
+        logger.error(f"Errore durante l'esportazione della cronologia: {e}")
+        return False, f"Errore: {e}", None
+
+# Statistiche di portafoglio dell'account connesso (curva dei profitti, drawdown, win
+# rate, profit factor, profitti per simbolo e magic number), aggiornate con i soli deal
+# archiviati dopo la richiesta precedente
+def get_analytics(curve_points=ANALYTICS_CURVE_POINTS):
+    try:
+        login, store, error = sync_history(int(time.time()) - int(ANALYTICS_HISTORY_DAYS * 24 * 3600))
+        if error is not None:
+            return False, error, None
+        
+        analytics = portfolio_analytics.refresh(login, store)
+        with analytics.lock:
+            data = analytics.to_dict(curve_points)
+        return True, "Statistiche calcolate con successo", dict(data, login=login)
+    except Exception as e:
+        logger.error(f"Errore durante il calcolo delle statistiche: {e}")
+        return False, f"Errore: {e}", None
+
+# Invia una richiesta al terminale provando le modalità di riempimento supportate dal
+# simbolo, e registra retcode e latenza di ogni tentativo
+def send_order(request, kind, attempts):
+    import MetaTrader5 as mt5
+    
+    filling_modes = symbol_cache.filling_modes(request['symbol'])
+    for i, filling_mode in enumerate(filling_modes):
+        request['type_filling'] = filling_mode
+        
+        start = time.perf_counter()
+        result = mt5.order_send(request)
+        retcode = result.retcode if result is not None else None
+        attempts.append({
+            'type': kind,
+            'retcode': retcode,
+            'price': request['price'],
+            'type_filling': filling_mode,
+            'latency_ms': round((time.perf_counter() - start) * 1000, 2)
+        })
+        
+        if retcode == mt5.TRADE_RETCODE_DONE:
+            symbol_cache.prefer_filling_mode(request['symbol'], filling_mode)
+        if retcode != TRADE_RETCODE_INVALID_FILL:
+            return result
+        symbol_cache.reject_filling_mode(request['symbol'], filling_mode)
+    
+    return result
+
+# Invia un ordine market secondo la politica di esecuzione: dopo un requote o un cambio
+# di prezzo ritenta con un tick aggiornato finché restano tempo e tentativi e lo
+# slippage rispetto al prezzo di riferimento resta entro il limite
+def send_market_order(request, is_buy, point, reference_price, policy, attempts, start):
+    fresh = False
+    while True:
+        tick = symbol_cache.tick(request['symbol'], fresh=fresh)
+        if tick is None:
+            return None, "Prezzo non disponibile"
+        
+        request['price'] = tick.ask if is_buy else tick.bid
+        slippage = ExecutionPolicy.slippage_points(is_buy, request['price'], reference_price, point)
+        if policy.slippage_exceeded(slippage):
+            return None, f"Slippage di {slippage} punti oltre il limite di {policy.max_slippage_points}"
+        
+        result = send_order(request, 'market', attempts)
+        retcode = result.retcode if result is not None else None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if not policy.can_retry(retcode, len(attempts), elapsed_ms):
+            return result, None
+        fresh = True
+
+# Sposta SL e TP (se impostati) di offset_points punti, allontanandoli dal prezzo di una
+# posizione buy o sell (avvicinandoli se offset_points è negativo), arrotondati alle
+# cifre decimali del simbolo
+def offset_sl_tp(sl, tp, is_buy, offset_points, symbol_info):
+    offset = offset_points * symbol_info.point * (1 if is_buy else -1)
+    return (
+        round(sl - offset, symbol_info.digits) if sl else sl,
+        round(tp + offset, symbol_info.digits) if tp else tp
+    )
+
+# Apri una posizione (market o limite). reference_price è il prezzo di riferimento per
+# lo slippage (es. il prezzo di esecuzione del master), execution le eventuali modifiche
+# alla politica di esecuzione predefinita. Un ordine con idempotency_key già eseguito non
+# viene ripetuto; delivery_attempt > 1 indica un nuovo tentativo del server centrale.
+# sl_tp_offset_points sposta SL e TP di un numero di punti del simbolo (regole degli slave).
+def open_position(symbol, order_type, volume, sl=0.0, tp=0.0, limit_price=None, fallback_to_market=False,
+                  reference_price=None, execution=None, idempotency_key=None, delivery_attempt=1,
+                  sl_tp_offset_points=0):
     try:
         import MetaTrader5 as mt5
         
         if not mt5.terminal_info():
             return False, "MT5 non inizializzato", None
         
+        timings = Timings()
+        if idempotency_key:
+            with timings.span('idempotency_check'):
+                previous = executed_orders.find(idempotency_key, search_terminal=delivery_attempt > 1)
+            if previous is not None:
+                logger.info(f"Ordine {idempotency_key} già eseguito, duplicato ignorato")
+                return True, "Ordine già eseguito, duplicato ignorato", dict(previous, duplicate=True, timings=timings.to_dict())
+        
         # Mappa il tipo di ordine
         if order_type.lower() == 'buy':
-            mt5_order_type = mt5.ORDER_TYPE_BUY if limit_price is None else mt5.ORDER_TYPE_BUY_LIMIT
+            is_buy = True
         elif order_type.lower() == 'sell':
-            mt5_order_type = mt5.ORDER_TYPE_SELL if limit_price is None else mt5.ORDER_TYPE_SELL_LIMIT
+            is_buy = False
         else:
             return False, f"Tipo di ordine non valido: {order_type}", None
         
-        # Ottieni il prezzo corrente
-        symbol_info = mt5.symbol_info(symbol)
+        # Informazioni del simbolo dalla cache (selezionato nel Market Watch se necessario)
+        with timings.span('symbol_lookup'):
+            symbol_info = symbol_cache.info(symbol)
         if symbol_info is None:
             return False, f"Simbolo non trovato: {symbol}", None
         
-        if not symbol_info.visible:
-            mt5.symbol_select(symbol, True)
+        if sl_tp_offset_points:
+            sl, tp = offset_sl_tp(sl, tp, is_buy, sl_tp_offset_points, symbol_info)
+        
+        # Arrotonda il volume al passo e ai limiti del simbolo
+        volume = normalize_volume(volume, symbol_info)
+        if volume is None:
+            return False, f"Volume inferiore al minimo del simbolo {symbol} ({symbol_info.volume_min})", None
+        
+        policy = ExecutionPolicy.from_overrides(execution)
+        start = time.perf_counter()
+        attempts = []
+        result = None
+        error = None
         
         # Prepara la richiesta
-        if limit_price is None:
-            # Ordine market
-            price = mt5.symbol_info_tick(symbol).ask if mt5_order_type == mt5.ORDER_TYPE_BUY else mt5.symbol_info_tick(symbol).bid
-            
-            request = {
-                "action": mt5.TRADE_ACTION_DEAL,
-                "symbol": symbol,
-                "volume": float(volume),
-                "type": mt5_order_type,
-                "price": price,
-                "sl": float(sl) if sl else 0.0,
-                "tp": float(tp) if tp else 0.0,
-                "deviation": 10,
-                "magic": 234000,
-                "comment": "Aperto da MetaTrader Remote Control",
-                "type_time": mt5.ORDER_TIME_GTC,
-                "type_filling": mt5.ORDER_FILLING_IOC,
-            }
-        else:
+        request = {
+            "symbol": symbol,
+            "volume": float(volume),
+            "sl": float(sl) if sl else 0.0,
+            "tp": float(tp) if tp else 0.0,
+            "deviation": policy.deviation,
+            "magic": 234000,
+            "type_time": mt5.ORDER_TIME_GTC,
+        }
+        
+        if limit_price is not None:
             # Ordine limite
-            request = {
+            request.update({
                 "action": mt5.TRADE_ACTION_PENDING,
-                "symbol": symbol,
-                "volume": float(volume),
-                "type": mt5_order_type,
+                "type": mt5.ORDER_TYPE_BUY_LIMIT if is_buy else mt5.ORDER_TYPE_SELL_LIMIT,
                 "price": float(limit_price),
-                "sl": float(sl) if sl else 0.0,
-                "tp": float(tp) if tp else 0.0,
-                "deviation": 10,
-                "magic": 234000,
-                "comment": "Ordine limite aperto da MetaTrader Remote Control",
-                "type_time": mt5.ORDER_TIME_GTC,
-                "type_filling": mt5.ORDER_FILLING_IOC,
-            }
-        
-        # Invia l'ordine
-        result = mt5.order_send(request)
+                "comment": idempotency_comment(idempotency_key) if idempotency_key else "Ordine limite aperto da MetaTrader Remote Control",
+            })
+            with timings.span('limit_order'):
+                result = send_order(request, 'limit', attempts)
+            if reference_price is None:
+                reference_price = float(limit_price)
         
-        # Se l'ordine limite fallisce e fallback_to_market è True, prova con un ordine market
-        if result.retcode != mt5.TRADE_RETCODE_DONE and limit_price is not None and fallback_to_market:
-            logger.info(f"Ordine limite fallito, tentativo con ordine market: {result.retcode}")
+        # Ordine market, oppure fallback a market se l'ordine limite fallisce
+        is_market_fallback = False
+        if limit_price is None or (fallback_to_market and (result is None or result.retcode != mt5.TRADE_RETCODE_DONE)):
+            if limit_price is not None:
+                logger.info(f"Ordine limite fallito, tentativo con ordine market: {result.retcode if result is not None else None}")
+                is_market_fallback = True
             
-            # Converti in ordine market
-            if order_type.lower() == 'buy':
-                mt5_order_type = mt5.ORDER_TYPE_BUY
+            if idempotency_key:
+                comment = idempotency_comment(idempotency_key)
+            elif is_market_fallback:
+                comment = "Fallback a ordine market da MetaTrader Remote Control"
             else:
-                mt5_order_type = mt5.ORDER_TYPE_SELL
-            
-            price = mt5.symbol_info_tick(symbol).ask if mt5_order_type == mt5.ORDER_TYPE_BUY else mt5.symbol_info_tick(symbol).bid
-            
-            request = {
+                comment = "Aperto da MetaTrader Remote Control"
+            request = dict(request, **{
                 "action": mt5.TRADE_ACTION_DEAL,
-                "symbol": symbol,
-                "volume": float(volume),
-                "type": mt5_order_type,
-                "price": price,
-                "sl": float(sl) if sl else 0.0,
-                "tp": float(tp) if tp else 0.0,
-                "deviation": 10,
-                "magic": 234000,
-                "comment": "Fallback a ordine market da MetaTrader Remote Control",
-                "type_time": mt5.ORDER_TIME_GTC,
-                "type_filling": mt5.ORDER_FILLING_IOC,
-            }
-            
-            result = mt5.order_send(request)
+                "type": mt5.ORDER_TYPE_BUY if is_buy else mt5.ORDER_TYPE_SELL,
+                "comment": comment,
+            })
+            # Senza un prezzo di riferimento (es. ordine market dall'interfaccia web) lo
+            # slippage dei tentativi successivi si misura dalla prima quotazione
+            if reference_price is None:
+                tick = symbol_cache.tick(symbol)
+                if tick is not None:
+                    reference_price = tick.ask if is_buy else tick.bid
+            with timings.span('fallback' if is_market_fallback else 'market_order'):
+                result, error = send_market_order(request, is_buy, symbol_info.point, reference_price, policy, attempts, start)
         
-        if result.retcode != mt5.TRADE_RETCODE_DONE:
-            return False, f"Errore nell'apertura della posizione: {result.retcode}", None
+        # Tempo passato dentro mt5.order_send, sommando tutti i tentativi
+        timings.add('order_send', sum(attempt['latency_ms'] for attempt in attempts))
+        
+        execution_dict = {
+            'policy': policy.to_dict(),
+            'attempts': attempts,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2),
+            'reference_price': reference_price
+        }
+        
+        if result is None or result.retcode != mt5.TRADE_RETCODE_DONE:
+            message = error or f"Errore nell'apertura della posizione: {result.retcode if result is not None else mt5.last_error()}"
+            return False, message, {'request': request, 'execution': execution_dict, 'timings': timings.to_dict()}
+        
+        if request['action'] == mt5.TRADE_ACTION_DEAL:
+            execution_dict['slippage_points'] = ExecutionPolicy.slippage_points(is_buy, result.price, reference_price, symbol_info.point)
         
         # Converti il risultato in dizionario
         result_dict = {
@@ -268,24 +501,37 @@ def open_position(symbol, order_type, volume, sl=0.0, tp=0.0, limit_price=None,
             'ask': result.ask,
             'comment': result.comment,
             'request': request,
-            'is_market_fallback': limit_price is not None and fallback_to_market and result.retcode == mt5.TRADE_RETCODE_DONE
+            'is_market_fallback': is_market_fallback,
+            'execution': execution_dict,
+            'timings': timings.to_dict()
         }
         
+        if idempotency_key:
+            executed_orders.remember(idempotency_key, {
+                'order': result.order,
+                'deal': result.deal,
+                'volume': result.volume,
+                'price': result.price
+            })
+        
         return True, "Posizione aperta con successo", result_dict
     except Exception as e:
         logger.error(f"Errore durante l'apertura della posizione: {e}")
         return False, f"Errore: {e}", None
 
-# Chiudi una posizione
-def close_position(position_id):
+# Chiudi una posizione (parzialmente se volume è indicato)
+def close_position(position_id, volume=None):
     try:
         import MetaTrader5 as mt5
         
         if not mt5.terminal_info():
             return False, "MT5 non inizializzato", None
         
+        timings = Timings()
+        
         # Ottieni la posizione
-        position = mt5.positions_get(ticket=position_id)
+        with timings.span('position_lookup'):
+            position = mt5.positions_get(ticket=position_id)
         if position is None or len(position) == 0:
             return False, f"Posizione non trovata: {position_id}", None
         
@@ -294,28 +540,43 @@ def close_position(position_id):
         # Determina il tipo di ordine per la chiusura
         close_type = mt5.ORDER_TYPE_SELL if position.type == mt5.ORDER_TYPE_BUY else mt5.ORDER_TYPE_BUY
         
-        # Ottieni il prezzo corrente
-        price = mt5.symbol_info_tick(position.symbol).bid if position.type == mt5.ORDER_TYPE_BUY else mt5.symbol_info_tick(position.symbol).ask
+        with timings.span('symbol_lookup'):
+            # Ottieni il prezzo corrente
+            tick = symbol_cache.tick(position.symbol)
+            price = tick.bid if position.type == mt5.ORDER_TYPE_BUY else tick.ask
+            
+            # Volume da chiudere, arrotondato al passo del simbolo per le chiusure parziali
+            close_volume = position.volume
+            if volume:
+                close_volume = normalize_volume(min(float(volume), position.volume), symbol_cache.info(position.symbol))
+        if close_volume is None:
+            return False, f"Volume da chiudere inferiore al minimo del simbolo {position.symbol}", None
         
         # Prepara la richiesta
         request = {
             "action": mt5.TRADE_ACTION_DEAL,
             "symbol": position.symbol,
-            "volume": position.volume,
+            "volume": close_volume,
             "type": close_type,
             "position": position.ticket,
             "price": price,
-            "deviation": 10,
+            "deviation": EXEC_DEVIATION,
             "magic": 234000,
             "comment": "Chiuso da MetaTrader Remote Control",
             "type_time": mt5.ORDER_TIME_GTC,
-            "type_filling": mt5.ORDER_FILLING_IOC,
         }
         
-        # Invia l'ordine
-        result = mt5.order_send(request)
-        if result.retcode != mt5.TRADE_RETCODE_DONE:
-            return False, f"Errore nella chiusura della posizione: {result.retcode}", None
+        # Invia l'ordine con la modalità di riempimento supportata dal simbolo
+        attempts = []
+        with timings.span('order_send'):
+            result = send_order(request, 'close', attempts)
+        if result is None or result.retcode != mt5.TRADE_RETCODE_DONE:
+            retcode = result.retcode if result is not None else mt5.last_error()
+            return False, f"Errore nella chiusura della posizione: {retcode}", {
+                'request': request,
+                'attempts': attempts,
+                'timings': timings.to_dict()
+            }
         
         # Converti il risultato in dizionario
         result_dict = {
@@ -327,7 +588,9 @@ def close_position(position_id):
             'bid': result.bid,
             'ask': result.ask,
             'comment': result.comment,
-            'request': request
+            'request': request,
+            'attempts': attempts,
+            'timings': timings.to_dict()
         }
         
         return True, "Posizione chiusa con successo", result_dict
@@ -335,6 +598,251 @@ def close_position(position_id):
         logger.error(f"Errore durante la chiusura della posizione: {e}")
         return False, f"Errore: {e}", None
 
+# Modifica stop loss e take profit di una posizione (None mantiene il valore attuale)
+def modify_position(position_id, sl=None, tp=None, sl_tp_offset_points=0):
+    try:
+        import MetaTrader5 as mt5
+        
+        if not mt5.terminal_info():
+            return False, "MT5 non inizializzato", None
+        
+        timings = Timings()
+        with timings.span('position_lookup'):
+            position = mt5.positions_get(ticket=position_id)
+        if position is None or len(position) == 0:
+            return False, f"Posizione non trovata: {position_id}", None
+        
+        position = position[0]
+        if sl_tp_offset_points:
+            symbol_info = symbol_cache.info(position.symbol)
+            if symbol_info is None:
+                return False, f"Simbolo non trovato: {position.symbol}", None
+            sl, tp = offset_sl_tp(sl, tp, position.type == mt5.POSITION_TYPE_BUY, sl_tp_offset_points, symbol_info)
+        
+        request = {
+            "action": mt5.TRADE_ACTION_SLTP,
+            "symbol": position.symbol,
+            "position": position.ticket,
+            "sl": float(sl) if sl is not None else position.sl,
+            "tp": float(tp) if tp is not None else position.tp,
+            "magic": 234000,
+        }
+        
+        with timings.span('order_send'):
+            result = mt5.order_send(request)
+        if result.retcode != mt5.TRADE_RETCODE_DONE:
+            return False, f"Errore nella modifica della posizione: {result.retcode}", {
+                'retcode': result.retcode,
+                'request': request,
+                'timings': timings.to_dict()
+            }
+        
+        return True, "Posizione modificata con successo", {
+            'retcode': result.retcode,
+            'order': result.order,
+            'comment': result.comment,
+            'request': request,
+            'timings': timings.to_dict()
+        }
+    except Exception as e:
+        logger.error(f"Errore durante la modifica della posizione: {e}")
+        return False, f"Errore: {e}", None
+
+# Esegue una singola operazione di un batch: open, close o modify
+def execute_order(order):
+    action = order.get('action', 'open')
+    try:
+        if action == 'open':
+            return open_position(
+                order['symbol'],
+                order['type'],
+                order['volume'],
+                order.get('sl', 0.0),
+                order.get('tp', 0.0),
+                order.get('limit_price'),
+                order.get('fallback_to_market', False),
+                order.get('reference_price'),
+                order.get('execution'),
+                order.get('idempotency_key'),
+                int(order.get('delivery_attempt', 1)),
+                int(order.get('sl_tp_offset_points') or 0)
+            )
+        if action == 'close':
+            return close_position(int(order['position_id']), order.get('volume'))
+        if action == 'modify':
+            return modify_position(
+                int(order['position_id']), order.get('sl'), order.get('tp'), int(order.get('sl_tp_offset_points') or 0)
+            )
+    except KeyError as e:
+        return False, f"Campo mancante: {e}", None
+    except (TypeError, ValueError) as e:
+        return False, f"Dati non validi: {e}", None
+    return False, f"Azione non valida: {action}", None
+
+# Esegue in sequenza una lista di operazioni sul terminale connesso, con il risultato
+# e la durata di ognuna
+def execute_batch(orders):
+    results = []
+    for order in orders:
+        start = time.perf_counter()
+        success, message, data = execute_order(order)
+        results.append({
+            'success': success,
+            'message': message,
+            'data': data,
+            'latency_ms': round((time.perf_counter() - start) * 1000, 2)
+        })
+    
+    succeeded = sum(1 for r in results if r['success'])
+    return True, f"Operazioni eseguite con successo: {succeeded}/{len(results)}", results
+
+# Informazioni di un simbolo usate dal server centrale per calcolare i volumi
+def get_symbol_info(symbol):
+    try:
+        import MetaTrader5 as mt5
+        
+        if not mt5.terminal_info():
+            return False, "MT5 non inizializzato", None
+        
+        symbol_info = symbol_cache.info(symbol)
+        if symbol_info is None:
+            return False, f"Simbolo non trovato: {symbol}", None
+        
+        return True, "Informazioni simbolo recuperate con successo", {
+            'symbol': symbol,
+            'digits': symbol_info.digits,
+            'point': symbol_info.point,
+            'volume_min': symbol_info.volume_min,
+            'volume_max': symbol_info.volume_max,
+            'volume_step': symbol_info.volume_step,
+            'filling_mode': symbol_info.filling_mode
+        }
+    except Exception as e:
+        logger.error(f"Errore durante il recupero delle informazioni del simbolo: {e}")
+        return False, f"Errore: {e}", None
+
+# Restituisce il numero dell'account connesso al terminale
+def get_login():
+    success, message, account_info = get_account_info()
+    return account_info['login'] if success else None
+
+# Ultimi risultati delle letture in CACHED_READS: {nome: (istante, risultato)}
+read_cache = {}
+
+# Letture del watcher, eseguite sul thread del terminale come tutte le altre chiamate.
+# Le posizioni lette aggiornano anche la cache delle letture.
+def watch_positions():
+    result = mt5_executor.call(PRIORITY_READ, get_positions)
+    if result[0]:
+        read_cache['get_positions'] = (time.monotonic(), result)
+    return result
+
+def watch_login():
+    return mt5_executor.call(PRIORITY_READ, get_login)
+
+# Watcher che rileva aperture, chiusure e modifiche delle posizioni, anche quelle fatte
+# direttamente dal terminale
+position_watcher = PositionWatcher(watch_positions, watch_login, WATCH_INTERVAL_MS / 1000)
+
+# Priorità di una funzione sul thread del terminale
+def call_priority(name):
+    return PRIORITY_TRADE if name in TRADE_FUNCTIONS else PRIORITY_READ
+
+# Esegue una funzione sul terminale inizializzato in questo processo (agente principale
+# o worker), passando dal thread del terminale con la priorità della funzione
+def run_local(name, *args):
+    function = globals()[name]
+    if name in HISTORY_FUNCTIONS:
+        return function(*args)
+    
+    if name in CACHED_READS:
+        cached = read_cache.get(name)
+        if cached is not None:
+            age_ms = (time.monotonic() - cached[0]) * 1000
+            if age_ms <= READ_CACHE_TTL_MS or (mt5_executor.is_trading() and age_ms <= READ_CACHE_MAX_AGE_MS):
+                return cached[1]
+    
+    try:
+        result = mt5_executor.call(call_priority(name), function, *args)
+    except TimeoutError:
+        return False, "Timeout nella comunicazione con il terminale", None
+    
+    if name in TRADE_FUNCTIONS:
+        # Conto e posizioni sono cambiati: le letture successive vanno al terminale
+        read_cache.clear()
+    elif name in CACHED_READS and result[0]:
+        read_cache[name] = (time.monotonic(), result)
+    return result
+
+# Esegue una funzione sul terminale dell'account indicato: nel suo worker dedicato se
+# configurato, altrimenti sul terminale inizializzato nel processo principale
+def run_for_account(account_number, name, *args):
+    if terminal_workers.has(account_number):
+        return terminal_workers.call(account_number, name, *args, priority=call_priority(name))
+    return run_local(name, *args)
+
+# Registra fasi, retcode ed esito di un'operazione e restituisce i dati del risultato con
+# la suddivisione completa dei tempi: le fasi eseguite sul terminale (anche in un worker,
+# con il loro totale in 'terminal') e quelle della richiesta HTTP indicate in timings
+def record_order_metrics(operation, success, data, timings=None):
+    order_results.inc(operation=operation, result='success' if success else 'failed')
+    if not isinstance(data, dict):
+        return data
+    
+    attempts = data.get('attempts') or (data.get('execution') or {}).get('attempts') or []
+    retcodes = [attempt['retcode'] for attempt in attempts]
+    if not retcodes and data.get('retcode') is not None:
+        retcodes = [data['retcode']]
+    for retcode in retcodes:
+        order_retcodes.inc(operation=operation, retcode=retcode)
+    
+    spans = dict(data.get('timings') or {})
+    if 'total' in spans:
+        spans['terminal'] = spans.pop('total')
+    if timings is not None:
+        spans.update(timings.to_dict())
+    for span, value in spans.items():
+        order_span_ms.observe(value, operation=operation, span=span)
+    
+    return dict(data, timings=spans)
+
+# Esegue un batch di operazioni raggruppandole per account: le operazioni di un account
+# vengono eseguite una dopo l'altra sul suo terminale, gli account diversi in parallelo
+def run_batch(default_account_number, orders):
+    groups = {}
+    for i, order in enumerate(orders):
+        account_number = order.get('account_number', default_account_number)
+        key = str(account_number) if account_number is not None else None
+        groups.setdefault(key, []).append(i)
+    
+    results = [None] * len(orders)
+    
+    def run_group(account_number, indexes):
+        success, message, data = run_for_account(account_number, 'execute_batch', [orders[i] for i in indexes])
+        for j, i in enumerate(indexes):
+            results[i] = data[j] if success else {'success': False, 'message': message, 'data': None, 'latency_ms': None}
+    
+    if len(groups) == 1:
+        run_group(*next(iter(groups.items())))
+    else:
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            list(executor.map(lambda group: run_group(*group), groups.items()))
+    
+    for order, result in zip(orders, results):
+        result['data'] = record_order_metrics(order.get('action', 'open'), result['success'], result['data'])
+    
+    return results
+
+# Risposta comune degli endpoint batch
+def batch_response(results, start):
+    succeeded = sum(1 for r in results if r['success'])
+    return jsonify({
+        "success": True,
+        "message": f"Operazioni eseguite con successo: {succeeded}/{len(results)}",
+        "data": results,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 2)
+    })
+
 # Rotta principale
 @app.route('/')
 def index():
@@ -351,7 +859,19 @@ def api_initialize():
     if not data or not all(k in data for k in ['account_number', 'password', 'server']):
         return jsonify({"error": "Dati mancanti"}), 400
     
-    success, message = initialize_mt5(data['account_number'], data['password'], data['server'])
+    mt5_path = data.get('mt5_path')
+    if mt5_path:
+        # Account con un terminale dedicato: viene servito da un proprio worker
+        success, message = terminal_workers.start_worker({
+            'account_number': data['account_number'],
+            'password': data['password'],
+            'server': data['server'],
+            'mt5_path': mt5_path
+        })
+    else:
+        success, message = mt5_executor.call(
+            PRIORITY_TRADE, initialize_mt5, data['account_number'], data['password'], data['server']
+        )
     
     if success:
         # Aggiorna la configurazione
@@ -367,6 +887,8 @@ def api_initialize():
                     'server': data['server'],
                     'description': data.get('description', f"Account {data['account_number']}")
                 }
+                if mt5_path:
+                    config['accounts'][i]['mt5_path'] = mt5_path
                 break
         
         if not account_exists:
@@ -378,6 +900,8 @@ def api_initialize():
                 'server': data['server'],
                 'description': data.get('description', f"Account {data['account_number']}")
             })
+            if mt5_path:
+                config['accounts'][-1]['mt5_path'] = mt5_path
         
         save_config(config)
         
@@ -388,7 +912,8 @@ def api_initialize():
 # API per ottenere informazioni sull'account
 @app.route('/api/account', methods=['GET'])
 def api_account():
-    success, message, data = get_account_info()
+    account_number = request.args.get('account')
+    success, message, data = run_for_account(account_number, 'get_account_info')
     
     if success:
         return jsonify({"success": True, "data": data})
@@ -396,20 +921,127 @@ def api_account():
         return jsonify({"success": False, "message": message}), 500
 
 # API per ottenere posizioni aperte
+# Con il parametro since=<versione> restituisce solo le posizioni aggiunte, modificate
+# o chiuse dopo quella versione. Formato della risposta negoziato con il parametro
+# format o l'header Accept (vedi wire_format).
 @app.route('/api/positions', methods=['GET'])
 def api_positions():
-    success, message, data = get_positions()
+    account_number = request.args.get('account')
+    wire_format = negotiate_format(request.args, request.headers)
+    if wire_format is None:
+        return unsupported_format_response()
+    
+    if 'since' in request.args:
+        since = request.args.get('since', type=int)
+        success, message, data = run_for_account(account_number, 'get_position_changes', since)
+        rows_key = 'changed'
+    else:
+        success, message, data = run_for_account(account_number, 'get_positions')
+        rows_key = None
     
     if success:
-        return jsonify({"success": True, "data": data})
+        return wire_response(data, rows_key, wire_format)
     else:
         return jsonify({"success": False, "message": message}), 500
 
 # API per ottenere cronologia delle operazioni
+# Con i parametri from/to (timestamp in secondi) e limit/offset restituisce una pagina
+# della cronologia archiviata localmente, insieme al numero totale di deal.
+# Nei formati colonnari i deal vengono letti dall'archivio direttamente per colonne.
 @app.route('/api/history', methods=['GET'])
 def api_history():
-    days = request.args.get('days', default=7, type=int)
-    success, message, data = get_history(days)
+    account_number = request.args.get('account')
+    wire_format = negotiate_format(request.args, request.headers)
+    if wire_format is None:
+        return unsupported_format_response()
+    columnar = wire_format != FORMAT_ROWS
+    
+    if any(k in request.args for k in ['from', 'to', 'limit', 'offset']):
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+        success, message, data = run_for_account(
+            account_number,
+            'query_history',
+            request.args.get('from', type=int),
+            request.args.get('to', type=int),
+            limit,
+            max(0, request.args.get('offset', default=0, type=int)),
+            columnar
+        )
+        rows_key = 'deals'
+    else:
+        days = max(1, min(request.args.get('days', default=7, type=int), HISTORY_MAX_DAYS))
+        success, message, data = run_for_account(account_number, 'get_history', days, columnar)
+        rows_key = None
+    
+    if success:
+        return wire_response(data, rows_key, wire_format)
+    else:
+        return jsonify({"success": False, "message": message}), 500
+
+# Righe di una pagina dell'esportazione nel formato richiesto (NDJSON o CSV)
+def format_export_rows(rows, export_format):
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        return buffer.getvalue()
+    return ''.join(json.dumps(dict(zip(DEAL_FIELDS, row)), separators=(',', ':')) + '\n' for row in rows)
+
+# API per esportare in streaming la cronologia di un intervallo lungo (from/to, timestamp
+# in secondi), in NDJSON (un deal per riga) o CSV. I deal vengono letti dall'archivio a
+# pagine e inviati man mano, quindi la memoria usata non dipende dall'intervallo. Un
+# download interrotto riprende passando come cursor "<time>:<ticket>" dell'ultimo deal
+# ricevuto; se la lettura fallisce a metà la risposta viene interrotta, non chiusa
+# regolarmente, così il client sa che deve riprendere.
+@app.route('/api/history/export', methods=['GET'])
+def api_history_export():
+    account_number = request.args.get('account')
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "Formato non supportato (formati disponibili: ndjson, csv)"}), 400
+    
+    date_to = request.args.get('to', default=int(time.time()), type=int)
+    date_from = request.args.get('from', default=date_to - 7 * 24 * 3600, type=int)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_time, cursor_ticket = (int(value) for value in cursor.split(':'))
+        except ValueError:
+            return jsonify({"error": "Cursore non valido (formato: <time>:<ticket>)"}), 400
+        cursor = (cursor_time, cursor_ticket)
+    else:
+        cursor = None
+    
+    # La prima pagina viene letta prima di rispondere, per restituire subito gli errori
+    success, message, page = run_for_account(account_number, 'export_history_page', date_from, date_to, cursor, True)
+    if not success:
+        return jsonify({"success": False, "message": message}), 500
+    
+    def stream(page):
+        if export_format == 'csv':
+            yield ','.join(DEAL_FIELDS) + '\n'
+        while True:
+            if page['rows']:
+                yield format_export_rows(page['rows'], export_format)
+            if page['cursor'] is None:
+                return
+            success, message, page = run_for_account(
+                account_number, 'export_history_page', date_from, date_to, page['cursor'], False
+            )
+            if not success:
+                raise RuntimeError(f"Esportazione della cronologia interrotta: {message}")
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    filename = f"history_{account_number or 'default'}_{date_from}_{date_to}.{export_format}"
+    return Response(stream(page), mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+# API per le statistiche di portafoglio dell'account (curve_points=0 per omettere la curva)
+@app.route('/api/analytics', methods=['GET'])
+def api_analytics():
+    account_number = request.args.get('account')
+    curve_points = max(0, request.args.get('curve_points', default=ANALYTICS_CURVE_POINTS, type=int))
+    success, message, data = run_for_account(account_number, 'get_analytics', curve_points)
     
     if success:
         return jsonify({"success": True, "data": data})
@@ -419,18 +1051,141 @@ def api_history():
 # API per aprire una posizione (market o limite)
 @app.route('/api/positions', methods=['POST'])
 def api_open_position():
+    timings = Timings()
+    with timings.span('parse'):
+        data = request.json
+        if not data or not all(k in data for k in ['symbol', 'type', 'volume']):
+            return jsonify({"error": "Dati mancanti"}), 400
+        
+        # Verifica se è un ordine limite
+        limit_price = data.get('limit_price')
+        fallback_to_market = data.get('fallback_to_market', False)
+        
+        try:
+            delivery_attempt = int(data.get('delivery_attempt', 1))
+            sl_tp_offset_points = int(data.get('sl_tp_offset_points') or 0)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Dati non validi: {e}"}), 400
+    
+    with timings.span('dispatch'):
+        success, message, result = run_for_account(
+            data.get('account_number'),
+            'open_position',
+            data['symbol'],
+            data['type'],
+            data['volume'],
+            data.get('sl', 0.0),
+            data.get('tp', 0.0),
+            limit_price,
+            fallback_to_market,
+            data.get('reference_price'),
+            data.get('execution'),
+            data.get('idempotency_key'),
+            delivery_attempt,
+            sl_tp_offset_points
+        )
+    result = record_order_metrics('open', success, result, timings)
+    
+    if success:
+        return jsonify({"success": True, "message": message, "data": result})
+    else:
+        return jsonify({"success": False, "message": message, "data": result}), 500
+
+# API per chiudere una posizione
+@app.route('/api/positions/<int:position_id>', methods=['DELETE'])
+def api_close_position(position_id):
+    timings = Timings()
+    account_number = request.args.get('account')
+    with timings.span('dispatch'):
+        success, message, result = run_for_account(account_number, 'close_position', position_id)
+    result = record_order_metrics('close', success, result, timings)
+    
+    if success:
+        return jsonify({"success": True, "message": message, "data": result})
+    else:
+        return jsonify({"success": False, "message": message}), 500
+
+# API per eseguire più operazioni (open, close, modify) in un'unica richiesta
+@app.route('/api/orders/batch', methods=['POST'])
+def api_orders_batch():
+    start = time.perf_counter()
     data = request.json
-    if not data or not all(k in data for k in ['symbol', 'type', 'volume']):
+    if not data or not isinstance(data.get('orders'), list) or not data['orders']:
         return jsonify({"error": "Dati mancanti"}), 400
     
-    # Verifica se è un ordine limite
-    limit_price = data.get('limit_price')
-    fallback_to_market = data.get('fallback_to_market', False)
-    
-    success, message, result = open_position(
-        data['symbol'],
-        data['type'],
-        data['volume'],
-        data.get('sl', 0.0),
-        da
-(Content truncated due to size limit. Use line ranges to read in chunks)
\ No newline at end of file
+    if len(data['orders']) > ORDER_BATCH_MAX_SIZE:
+        return jsonify({"error": f"Troppe operazioni nel batch (massimo {ORDER_BATCH_MAX_SIZE})"}), 400
+    
+    return batch_response(run_batch(data.get('account_number'), data['orders']), start)
+
+# API per chiudere più posizioni in un'unica richiesta; ogni elemento di tickets è un
+# ticket oppure {'ticket': ..., 'volume': ...} per una chiusura parziale
+@app.route('/api/positions/close-batch', methods=['POST'])
+def api_close_positions_batch():
+    start = time.perf_counter()
+    data = request.json
+    if not data or not isinstance(data.get('tickets'), list) or not data['tickets']:
+        return jsonify({"error": "Dati mancanti"}), 400
+    
+    if len(data['tickets']) > ORDER_BATCH_MAX_SIZE:
+        return jsonify({"error": f"Troppe operazioni nel batch (massimo {ORDER_BATCH_MAX_SIZE})"}), 400
+    
+    orders = []
+    for ticket in data['tickets']:
+        if isinstance(ticket, dict):
+            orders.append({'action': 'close', 'position_id': ticket.get('ticket'), 'volume': ticket.get('volume')})
+        else:
+            orders.append({'action': 'close', 'position_id': ticket})
+    
+    return batch_response(run_batch(data.get('account_number'), orders), start)
+
+# Metriche dell'agente nel formato di Prometheus
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
+    return Response(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+# Stream (Server-Sent Events) degli eventi sulle posizioni
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    subscriber = position_watcher.subscribe()
+    
+    def stream():
+        try:
+            yield ": connesso\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            position_watcher.unsubscribe(subscriber)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+# API per ottenere lotto minimo, massimo e passo di un simbolo
+@app.route('/api/symbols/<symbol>', methods=['GET'])
+def api_symbol(symbol):
+    account_number = request.args.get('account')
+    success, message, data = run_for_account(account_number, 'get_symbol_info', symbol)
+    
+    if success:
+        return jsonify({"success": True, "data": data})
+    else:
+        return jsonify({"success": False, "message": message}), 500
+
+# API per lo stato dei worker dei terminali
+@app.route('/api/workers', methods=['GET'])
+def api_workers():
+    return jsonify({"success": True, "data": terminal_workers.info(), "executor": mt5_executor.stats()})
+
+# Carica la configurazione all'avvio
+config = load_config()
+
+if __name__ == '__main__':
+    # Un worker per ogni account con un terminale dedicato; i loro eventi confluiscono
+    # nello stream /api/events del processo principale
+    terminal_workers.start(config.get('accounts', []), position_watcher.publish)
+    position_watcher.start()
+    app.run(host='0.0.0.0', port=AGENT_PORT, threaded=True)
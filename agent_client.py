@@ -0,0 +1,312 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from wire_format import FORMAT_COLUMNS, to_columns
+
+logger = logging.getLogger(__name__)
+
+# Configurazione dei client verso gli agenti
+AGENT_POOL_SIZE = int(os.environ.get('AGENT_POOL_SIZE', 32))
+AGENT_CONNECT_TIMEOUT = float(os.environ.get('AGENT_CONNECT_TIMEOUT', 2.0))
+AGENT_READ_TIMEOUT = float(os.environ.get('AGENT_READ_TIMEOUT', 5.0))
+AGENT_MAX_RETRIES = int(os.environ.get('AGENT_MAX_RETRIES', 2))
+AGENT_RETRY_BACKOFF = float(os.environ.get('AGENT_RETRY_BACKOFF', 0.1))
+# Errori di comunicazione consecutivi dopo cui l'agente viene escluso (circuito aperto)
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 3))
+# Secondi dopo cui un circuito aperto lascia passare di nuovo le richieste di prova
+BREAKER_RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_TIMEOUT', 30.0))
+
+
+# Circuit breaker di un agente: dopo troppi errori di comunicazione consecutivi le
+# richieste falliscono subito invece di attendere il timeout. Il circuito si richiude al
+# primo successo (di norma un heartbeat); dopo BREAKER_RESET_TIMEOUT lascia comunque
+# passare le richieste (half_open), e un nuovo errore lo riapre.
+class CircuitBreaker:
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # Orario (time.time) dell'apertura, confrontabile con quello di altri processi
+        self.opened_wall = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        opened_at = self.opened_at
+        if opened_at is None:
+            return 'closed'
+        if time.monotonic() - opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow_request(self):
+        return self.state != 'open'
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.opened_wall = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.opened_wall = time.time()
+
+    # Allinea il circuito a quello del processo che esegue l'heartbeat dell'agente: se lì
+    # è aperto si apre anche qui, e si richiude con un heartbeat riuscito
+    # (last_success_at, time.time) successivo all'apertura locale
+    def apply_shared(self, state, last_success_at):
+        with self._lock:
+            if state == 'open':
+                if self.opened_at is None or time.monotonic() - self.opened_at >= self.reset_timeout:
+                    self.failures = max(self.failures, self.failure_threshold)
+                    self.opened_at = time.monotonic()
+                    self.opened_wall = time.time()
+            elif state == 'closed' and self.opened_wall is not None and last_success_at is not None \
+                    and last_success_at > self.opened_wall:
+                self.failures = 0
+                self.opened_at = None
+                self.opened_wall = None
+
+
+# Client HTTP verso un singolo agente, con una sessione keep-alive dedicata
+class AgentClient:
+    def __init__(self, base_url, pool_size=AGENT_POOL_SIZE, connect_timeout=AGENT_CONNECT_TIMEOUT,
+                 read_timeout=AGENT_READ_TIMEOUT, max_retries=AGENT_MAX_RETRIES, retry_backoff=AGENT_RETRY_BACKOFF):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+
+        # Gli errori di connessione vengono sempre ritentati (la richiesta non è partita),
+        # gli errori di lettura e di stato solo per le richieste idempotenti: un ordine
+        # ritentato alla cieca potrebbe essere eseguito due volte
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=retry_backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False
+        )
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self.breaker = CircuitBreaker()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'rejected': 0,
+            'total_latency_ms': 0.0,
+            'last_latency_ms': None,
+            'last_error': None,
+            'last_success_at': None
+        }
+
+    # Esegue una richiesta verso l'agente e restituisce (success, message, data). Con
+    # return_reached=True restituisce anche se la richiesta ha sicuramente raggiunto
+    # l'agente: dopo un errore di connessione o un timeout non è possibile saperlo.
+    # Con il circuito aperto la richiesta fallisce subito, senza contattare l'agente.
+    def request(self, method, path, params=None, json=None, timeout=None, return_reached=False):
+        if not self.breaker.allow_request():
+            with self._stats_lock:
+                self._stats['rejected'] += 1
+            message = "Agente non raggiungibile (circuit breaker aperto)"
+            return (False, message, None, False) if return_reached else (False, message, None)
+        
+        start = time.perf_counter()
+        error = None
+        reached = False
+        try:
+            response = self.session.request(
+                method,
+                f"{self.base_url}{path}",
+                params=params,
+                json=json,
+                timeout=timeout or self.timeout
+            )
+            reached = response.status_code not in (502, 503, 504)
+            self.breaker.record_success()
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+
+            success = response.ok and body.get('success', False)
+            message = body.get('message') or body.get('error') or f"HTTP {response.status_code}"
+            data = body.get('data')
+            if not success:
+                error = message
+        except requests.Timeout:
+            success, message, data = False, "Timeout nella comunicazione con l'agente", None
+            error = 'timeout'
+            self.breaker.record_failure()
+        except requests.RequestException as e:
+            success, message, data = False, f"Errore di comunicazione con l'agente: {e}", None
+            error = str(e)
+            self.breaker.record_failure()
+
+        self._record(time.perf_counter() - start, success, error)
+        if return_reached:
+            return success, message, data, reached
+        return success, message, data
+
+    # Aggiorna le statistiche del client
+    def _record(self, elapsed, success, error):
+        latency_ms = elapsed * 1000
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['total_latency_ms'] += latency_ms
+            self._stats['last_latency_ms'] = round(latency_ms, 2)
+            if success:
+                self._stats['last_success_at'] = time.time()
+            else:
+                self._stats['errors'] += 1
+                self._stats['last_error'] = error
+                if error == 'timeout':
+                    self._stats['timeouts'] += 1
+
+    # Ottieni informazioni sull'account
+    def get_account(self, account_number=None):
+        return self.request('GET', '/api/account', params={'account': account_number})
+
+    # Ottieni posizioni aperte
+    def get_positions(self, account_number=None):
+        return self.request('GET', '/api/positions', params={'account': account_number})
+
+    # Ottieni le posizioni cambiate dopo una versione dell'indice dell'agente
+    def get_position_changes(self, account_number=None, since=0):
+        return self.request('GET', '/api/positions', params={'account': account_number, 'since': since})
+
+    # Ottieni cronologia delle operazioni. Con columnar=True la cronologia viene richiesta
+    # e restituita per colonne ({campo: valori}), più compatta da trasferire.
+    def get_history(self, account_number=None, days=7, columnar=False):
+        params = {'account': account_number, 'days': days}
+        if columnar:
+            params['format'] = FORMAT_COLUMNS
+        success, message, data = self.request('GET', '/api/history', params=params)
+        if success and columnar:
+            data = to_columns(data)
+        return success, message, data
+
+    # Ottieni le statistiche di portafoglio di un account (la prima richiesta può dover
+    # scaricare molta cronologia: timeout indicato dal chiamante)
+    def get_analytics(self, account_number=None, curve_points=None, timeout=None):
+        return self.request(
+            'GET', '/api/analytics',
+            params={'account': account_number, 'curve_points': curve_points},
+            timeout=timeout
+        )
+
+    # Ottieni lotto minimo, massimo e passo di un simbolo
+    def get_symbol(self, symbol, account_number=None):
+        return self.request('GET', f'/api/symbols/{symbol}', params={'account': account_number})
+
+    # Apri una posizione (market o limite)
+    def open_position(self, payload, timeout=None, return_reached=False):
+        return self.request('POST', '/api/positions', json=payload, timeout=timeout, return_reached=return_reached)
+
+    # Chiudi una posizione
+    def close_position(self, position_id, account_number=None):
+        return self.request('DELETE', f'/api/positions/{position_id}', params={'account': account_number})
+
+    # Esegui più operazioni (open, close, modify) in un'unica richiesta
+    def execute_batch(self, orders, account_number=None, timeout=None, return_reached=False):
+        return self.request(
+            'POST', '/api/orders/batch',
+            json={'account_number': account_number, 'orders': orders},
+            timeout=timeout,
+            return_reached=return_reached
+        )
+
+    # Chiudi più posizioni in un'unica richiesta
+    def close_positions(self, tickets, account_number=None):
+        return self.request('POST', '/api/positions/close-batch', json={'account_number': account_number, 'tickets': tickets})
+
+    # Statistiche di utilizzo e stato del pool di connessioni
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        total_latency_ms = stats.pop('total_latency_ms')
+        stats['avg_latency_ms'] = round(total_latency_ms / stats['requests'], 2) if stats['requests'] else None
+        stats['url'] = self.base_url
+        stats['breaker'] = self.breaker.state
+
+        connections = 0
+        idle_connections = 0
+        for pool in list(self._adapter.poolmanager.pools._container.values()):
+            connections += pool.num_connections
+            if pool.pool is not None:
+                idle_connections += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        stats['pool'] = {
+            'max_size': self._adapter._pool_maxsize,
+            'connections_opened': connections,
+            'idle_connections': idle_connections
+        }
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+# Registro dei client, uno per ogni server registrato
+class AgentClientPool:
+    default_timeout = (AGENT_CONNECT_TIMEOUT, AGENT_READ_TIMEOUT)
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    # Restituisce il client di un server, ricreandolo se l'URL è cambiato
+    def get(self, server_id, url):
+        with self._lock:
+            client = self._clients.get(server_id)
+            if client is None or client.base_url != url.rstrip('/'):
+                if client is not None:
+                    client.close()
+                client = AgentClient(url)
+                self._clients[server_id] = client
+            return client
+
+    # Rimuove il client di un server eliminato
+    def remove(self, server_id):
+        with self._lock:
+            client = self._clients.pop(server_id, None)
+        if client is not None:
+            client.close()
+
+    # Stato del circuit breaker di un server (None se non ha ancora un client)
+    def breaker_state(self, server_id):
+        client = self._clients.get(server_id)
+        return client.breaker.state if client is not None else None
+
+    # Allinea i circuit breaker allo stato degli heartbeat eseguiti da un altro processo:
+    # {server_id: {'breaker', 'last_success_at'}}
+    def apply_shared_breakers(self, shared):
+        for server_id, state in shared.items():
+            client = self._clients.get(server_id)
+            if client is not None:
+                client.breaker.apply_shared(state['breaker'], state['last_success_at'])
+
+    def stats(self):
+        with self._lock:
+            clients = dict(self._clients)
+        return {server_id: client.stats() for server_id, client in clients.items()}
+
+
+agent_clients = AgentClientPool()
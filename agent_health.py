@@ -0,0 +1,145 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from agent_client import agent_clients
+
+logger = logging.getLogger(__name__)
+
+# Configurazione dell'heartbeat verso gli agenti
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', 2.0))
+HEARTBEAT_TIMEOUT = float(os.environ.get('HEARTBEAT_TIMEOUT', 1.0))
+HEARTBEAT_MAX_WORKERS = int(os.environ.get('HEARTBEAT_MAX_WORKERS', 16))
+# Numero di misure di latenza usate per i percentili
+HEARTBEAT_LATENCY_SAMPLES = int(os.environ.get('HEARTBEAT_LATENCY_SAMPLES', 300))
+
+
+# Verifica periodicamente, in parallelo, che ogni agente risponda sull'endpoint /,
+# misurandone la latenza. L'esito alimenta il circuit breaker del client dell'agente:
+# un agente che non risponde viene escluso subito da replica e polling, e riammesso
+# al primo heartbeat riuscito. Con più processi lo stato pubblicato (status) allinea
+# anche i circuit breaker degli altri processi (AgentClientPool.apply_shared_breakers).
+class AgentHealthMonitor:
+    def __init__(self, list_agents, on_status_change=None):
+        # list_agents() restituisce {server_id: url}; on_status_change(server_id, status)
+        # viene chiamata quando un agente passa da online a offline o viceversa
+        self.list_agents = list_agents
+        self.on_status_change = on_status_change
+
+        # Sessione dedicata senza nuovi tentativi: un heartbeat fallito è già un'informazione
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HEARTBEAT_MAX_WORKERS, pool_maxsize=2, max_retries=0)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=HEARTBEAT_MAX_WORKERS, thread_name_prefix='heartbeat')
+        self._health = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='agent-heartbeat', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        logger.info("Heartbeat degli agenti avviato")
+        while True:
+            started = time.monotonic()
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"Errore nell'heartbeat degli agenti: {e}")
+            time.sleep(max(0.0, HEARTBEAT_INTERVAL - (time.monotonic() - started)))
+
+    # Esegue un heartbeat su tutti gli agenti in parallelo
+    def check_all(self):
+        agents = self.list_agents()
+        with self._lock:
+            for server_id in [s for s in self._health if s not in agents]:
+                del self._health[server_id]
+
+        futures = [self._executor.submit(self._check, server_id, url) for server_id, url in agents.items()]
+        for future in futures:
+            future.result()
+
+    def _check(self, server_id, url):
+        start = time.perf_counter()
+        error = None
+        try:
+            response = self._session.get(f"{url.rstrip('/')}/", timeout=HEARTBEAT_TIMEOUT)
+            if response.status_code != 200:
+                error = f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            error = str(e)
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        breaker = agent_clients.get(server_id, url).breaker
+        if error is None:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+        with self._lock:
+            health = self._health.setdefault(server_id, {
+                'status': None,
+                'latencies': deque(maxlen=HEARTBEAT_LATENCY_SAMPLES),
+                'consecutive_failures': 0,
+                'last_error': None,
+                'last_heartbeat_at': None,
+                'last_success_at': None
+            })
+            previous_status = health['status']
+            health['last_heartbeat_at'] = time.time()
+            if error is None:
+                health['status'] = 'online'
+                health['last_success_at'] = health['last_heartbeat_at']
+                health['consecutive_failures'] = 0
+                health['latencies'].append(latency_ms)
+            else:
+                health['consecutive_failures'] += 1
+                health['last_error'] = error
+                # Offline solo quando il circuit breaker si apre, non al primo errore isolato
+                if breaker.state == 'open' or previous_status is None:
+                    health['status'] = 'offline'
+            status = health['status']
+
+        if status != previous_status:
+            logger.info(f"Agente {server_id} {status}")
+            if self.on_status_change is not None:
+                self.on_status_change(server_id, status)
+
+    # Ultimo stato noto di un agente ('online', 'offline' o None)
+    def current_status(self, server_id):
+        health = self._health.get(server_id)
+        return health['status'] if health is not None else None
+
+    # Stato di ogni agente con i percentili della latenza degli heartbeat
+    def status(self):
+        with self._lock:
+            health = {server_id: dict(h, latencies=list(h['latencies'])) for server_id, h in self._health.items()}
+
+        result = {}
+        for server_id, h in health.items():
+            latencies = h.pop('latencies')
+            if latencies:
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                h['latency_ms'] = {
+                    'last': round(latencies[-1], 2),
+                    'p50': round(float(p50), 2),
+                    'p95': round(float(p95), 2),
+                    'p99': round(float(p99), 2),
+                    'samples': len(latencies)
+                }
+            else:
+                h['latency_ms'] = None
+            h['breaker'] = agent_clients.breaker_state(server_id)
+            result[server_id] = h
+        return result
@@ -0,0 +1,236 @@
+import os
+import threading
+
+import numpy as np
+
+# Punti della curva dei profitti restituiti per default (la curva completa resta in memoria)
+ANALYTICS_CURVE_POINTS = int(os.environ.get('ANALYTICS_CURVE_POINTS', 500))
+
+# deal.type delle operazioni di trading e dei movimenti di saldo (depositi e prelievi)
+DEAL_TYPE_BUY = 0
+DEAL_TYPE_SELL = 1
+DEAL_TYPE_BALANCE = 2
+# deal.entry delle operazioni che chiudono (anche in parte) una posizione: OUT, INOUT, OUT_BY
+CLOSING_ENTRIES = (1, 2, 3)
+
+# Campi dei deal usati dalle statistiche, nell'ordine delle colonne
+ANALYTICS_FIELDS = ('ticket', 'time', 'type', 'entry', 'magic', 'symbol', 'profit', 'commission', 'swap', 'fee')
+
+# Totali sommati tra più account nell'aggregazione del server centrale
+SUMMED_FIELDS = ('deals', 'trades', 'wins', 'losses', 'net_pnl', 'gross_profit', 'gross_loss',
+                 'commission', 'swap', 'fee', 'deposits', 'balance')
+
+
+def _ratio(numerator, denominator, scale=1.0):
+    return round(numerator / denominator * scale, 4) if denominator else None
+
+
+# Aggiunge a un dizionario {chiave: [pnl, trade chiusi, trade vincenti]} i totali dei
+# deal di un aggiornamento, raggruppati con np.unique/np.bincount
+def _accumulate_groups(groups, keys, net, closing):
+    if not len(keys):
+        return
+    unique, inverse = np.unique(keys, return_inverse=True)
+    pnl = np.bincount(inverse, weights=net, minlength=len(unique))
+    trades = np.bincount(inverse, weights=closing, minlength=len(unique))
+    wins = np.bincount(inverse, weights=closing & (net > 0), minlength=len(unique))
+    for key, key_pnl, key_trades, key_wins in zip(unique.tolist(), pnl, trades, wins):
+        totals = groups.setdefault(key, [0.0, 0, 0])
+        totals[0] += float(key_pnl)
+        totals[1] += int(key_trades)
+        totals[2] += int(key_wins)
+
+
+def _groups_to_dict(groups):
+    return {
+        str(key): {'pnl': round(pnl, 2), 'trades': trades, 'wins': wins, 'win_rate': _ratio(wins, trades, 100)}
+        for key, (pnl, trades, wins) in sorted(groups.items(), key=lambda item: -item[1][0])
+    }
+
+
+# Statistiche di portafoglio di un account, aggiornate in modo incrementale: ogni
+# aggiornamento elabora solo i deal nuovi, in blocco con NumPy, proseguendo curva dei
+# profitti, picco e drawdown dallo stato precedente
+class AccountAnalytics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.last_ticket = 0
+        self.deals = 0
+        self.times = np.empty(0, dtype=np.int64)
+        # Profitto netto cumulato del trading (senza depositi e prelievi) e saldo
+        self.curve = np.empty(0)
+        self.balances = np.empty(0)
+
+        self.net_pnl = 0.0
+        self.balance = 0.0
+        self.deposits = 0.0
+        self.commission = 0.0
+        self.swap = 0.0
+        self.fee = 0.0
+        self.peak = 0.0
+        self.balance_at_peak = 0.0
+        self.max_drawdown = 0.0
+        self.max_drawdown_pct = 0.0
+        self.trades = 0
+        self.wins = 0
+        self.losses = 0
+        self.gross_profit = 0.0
+        self.gross_loss = 0.0
+        self.by_symbol = {}
+        self.by_magic = {}
+
+    # Elabora i deal nuovi, righe con i campi di ANALYTICS_FIELDS in ordine di ticket
+    def update(self, rows):
+        if not rows:
+            return
+
+        ticket, deal_time, deal_type, entry, magic, symbol, profit, commission, swap, fee = zip(*rows)
+        deal_type = np.array(deal_type, dtype=np.int64)
+        entry = np.array(entry, dtype=np.int64)
+        commission = np.array(commission, dtype=float)
+        swap = np.array(swap, dtype=float)
+        fee = np.nan_to_num(np.array(fee, dtype=float))
+        net = np.array(profit, dtype=float) + commission + swap + fee
+
+        trading = (deal_type == DEAL_TYPE_BUY) | (deal_type == DEAL_TYPE_SELL)
+        closing = trading & np.isin(entry, CLOSING_ENTRIES)
+        trading_net = np.where(trading, net, 0.0)
+
+        # Curva dei profitti e saldo, proseguendo dai valori dell'aggiornamento precedente
+        curve = self.net_pnl + np.cumsum(trading_net)
+        balances = self.balance + np.cumsum(net)
+
+        # Drawdown: distanza dal massimo precedente della curva, in valore e in
+        # percentuale del saldo raggiunto in corrispondenza di quel massimo
+        peaks = np.maximum.accumulate(np.concatenate(([self.peak], curve)))[1:]
+        peak_index = np.maximum.accumulate(np.where(curve >= peaks, np.arange(len(curve)), -1))
+        peak_balances = np.where(peak_index >= 0, balances[np.maximum(peak_index, 0)], self.balance_at_peak)
+        drawdowns = peaks - curve
+        drawdowns_pct = np.divide(drawdowns * 100, peak_balances, out=np.zeros_like(drawdowns), where=peak_balances > 0)
+
+        results = net[closing]
+        self.trades += int(closing.sum())
+        self.wins += int((results > 0).sum())
+        self.losses += int((results < 0).sum())
+        self.gross_profit += float(results[results > 0].sum())
+        self.gross_loss += float(-results[results < 0].sum())
+        self.commission += float(commission[trading].sum())
+        self.swap += float(swap[trading].sum())
+        self.fee += float(fee[trading].sum())
+        self.deposits += float(net[deal_type == DEAL_TYPE_BALANCE].sum())
+
+        self.net_pnl = float(curve[-1])
+        self.balance = float(balances[-1])
+        self.peak = float(peaks[-1])
+        self.balance_at_peak = float(peak_balances[-1])
+        self.max_drawdown = max(self.max_drawdown, float(drawdowns.max()))
+        self.max_drawdown_pct = max(self.max_drawdown_pct, float(drawdowns_pct.max()))
+
+        _accumulate_groups(self.by_symbol, np.array(symbol, dtype=object)[trading].astype(str), trading_net[trading], closing[trading])
+        _accumulate_groups(self.by_magic, np.array(magic, dtype=np.int64)[trading], trading_net[trading], closing[trading])
+
+        self.times = np.concatenate((self.times, np.array(deal_time, dtype=np.int64)))
+        self.curve = np.concatenate((self.curve, curve))
+        self.balances = np.concatenate((self.balances, balances))
+        self.deals += len(rows)
+        self.last_ticket = int(ticket[-1])
+
+    # Curva dei profitti ridotta a circa `points` punti equidistanti (ultimo punto incluso)
+    def equity_curve(self, points=ANALYTICS_CURVE_POINTS):
+        if points <= 0 or not len(self.curve):
+            return {'time': [], 'pnl': [], 'balance': []}
+        index = np.unique(np.linspace(0, len(self.curve) - 1, min(points, len(self.curve))).round().astype(np.int64))
+        return {
+            'time': self.times[index].tolist(),
+            'pnl': np.round(self.curve[index], 2).tolist(),
+            'balance': np.round(self.balances[index], 2).tolist()
+        }
+
+    def to_dict(self, curve_points=ANALYTICS_CURVE_POINTS):
+        return {
+            'deals': self.deals,
+            'trades': self.trades,
+            'wins': self.wins,
+            'losses': self.losses,
+            'win_rate': _ratio(self.wins, self.trades, 100),
+            'net_pnl': round(self.net_pnl, 2),
+            'gross_profit': round(self.gross_profit, 2),
+            'gross_loss': round(self.gross_loss, 2),
+            'profit_factor': _ratio(self.gross_profit, self.gross_loss),
+            'commission': round(self.commission, 2),
+            'swap': round(self.swap, 2),
+            'fee': round(self.fee, 2),
+            'deposits': round(self.deposits, 2),
+            'balance': round(self.balance, 2),
+            'max_drawdown': round(self.max_drawdown, 2),
+            'max_drawdown_pct': round(self.max_drawdown_pct, 2),
+            'by_symbol': _groups_to_dict(self.by_symbol),
+            'by_magic': _groups_to_dict(self.by_magic),
+            'equity_curve': self.equity_curve(curve_points),
+            'last_ticket': self.last_ticket
+        }
+
+
+# Statistiche di tutti gli account serviti da questo processo, calcolate dall'archivio
+# locale della cronologia e mantenute in memoria
+class PortfolioAnalytics:
+    def __init__(self):
+        self._accounts = {}
+        self._lock = threading.Lock()
+
+    # Aggiorna le statistiche di un account con i deal archiviati dopo l'ultimo
+    # aggiornamento. Se nell'archivio sono comparsi deal più vecchi (es. cronologia
+    # scaricata per un periodo più lungo) le statistiche vengono ricalcolate da zero.
+    def refresh(self, login, store):
+        with self._lock:
+            analytics = self._accounts.setdefault(login, AccountAnalytics())
+
+        with analytics.lock:
+            if store.count_until(analytics.last_ticket) != analytics.deals:
+                analytics.reset()
+            analytics.update(store.deals_after(analytics.last_ticket, ANALYTICS_FIELDS))
+        return analytics
+
+
+# Aggrega le statistiche di più account ({account_id: statistiche}): totali, win rate e
+# profit factor complessivi, drawdown peggiore e profitti per simbolo e magic number
+def aggregate_analytics(accounts):
+    if not accounts:
+        return {'accounts': 0}
+
+    values = list(accounts.values())
+    totals = np.array([[account[field] for field in SUMMED_FIELDS] for account in values], dtype=float).sum(axis=0)
+    summary = {field: round(float(total), 2) for field, total in zip(SUMMED_FIELDS, totals)}
+    for field in ('deals', 'trades', 'wins', 'losses'):
+        summary[field] = int(summary[field])
+
+    drawdowns = np.array([account['max_drawdown'] for account in values])
+    drawdowns_pct = np.array([account['max_drawdown_pct'] for account in values])
+    worst = int(np.argmax(drawdowns_pct))
+
+    summary.update({
+        'accounts': len(values),
+        'win_rate': _ratio(summary['wins'], summary['trades'], 100),
+        'profit_factor': _ratio(summary['gross_profit'], summary['gross_loss']),
+        'max_drawdown': round(float(drawdowns.max()), 2),
+        'max_drawdown_pct': round(float(drawdowns_pct[worst]), 2),
+        'max_drawdown_account': list(accounts)[worst]
+    })
+
+    for field in ('by_symbol', 'by_magic'):
+        groups = {}
+        for account in values:
+            for key, group in account.get(field, {}).items():
+                totals = groups.setdefault(key, [0.0, 0, 0])
+                totals[0] += group['pnl']
+                totals[1] += group['trades']
+                totals[2] += group['wins']
+        summary[field] = _groups_to_dict(groups)
+
+    return summary
+
+
+portfolio_analytics = PortfolioAnalytics()
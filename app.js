@@ -8,6 +8,16 @@ let config = {
 let servers = [];
 let masterSlaveConfigs = [];
 
+// Stato live degli account ricevuto dallo stream della dashboard
+let liveAccounts = {};
+let liveFeed = null;
+let pollingTimer = null;
+let liveFeedRetryTimer = null;
+
+// Attesa prima di ritentare lo stream quando il server lo rifiuta (es. 503 con troppi
+// stream aperti): EventSource in quel caso non si ricollega da solo
+const LIVE_FEED_RETRY_MS = 30000;
+
 // Elementi DOM
 const sections = document.querySelectorAll('.section');
 const navLinks = document.querySelectorAll('.nav-link');
@@ -26,8 +36,8 @@ document.addEventListener('DOMContentLoaded', () => {
     // Carica i dati iniziali
     loadInitialData();
     
-    // Imposta l'aggiornamento periodico
-    setInterval(refreshData, config.refreshInterval);
+    // Collega lo stream degli aggiornamenti (con polling periodico come riserva)
+    connectLiveFeed();
 });
 
 // Funzione per caricare le impostazioni
@@ -57,6 +67,10 @@ function saveSettings() {
     config.apiUrl = apiUrl;
     config.refreshInterval = parseInt(refreshInterval) * 1000;
     
+    // Ricollega lo stream al nuovo backend
+    stopPolling();
+    connectLiveFeed();
+    
     alert('Impostazioni salvate con successo');
 }
 
@@ -161,6 +175,134 @@ function loadInitialData() {
     loadMasterSlaveConfigs();
 }
 
+// Funzione per collegarsi allo stream della dashboard: uno snapshot iniziale e poi
+// solo i campi cambiati di account e posizioni
+function connectLiveFeed() {
+    if (liveFeed) {
+        liveFeed.close();
+        liveFeed = null;
+    }
+    if (liveFeedRetryTimer) {
+        clearTimeout(liveFeedRetryTimer);
+        liveFeedRetryTimer = null;
+    }
+    
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    
+    liveFeed = new EventSource(`${config.apiUrl}/api/stream`, { withCredentials: true });
+    
+    liveFeed.addEventListener('snapshot', (e) => {
+        // Lo stream è attivo: il polling non serve più
+        stopPolling();
+        
+        liveAccounts = JSON.parse(e.data).accounts;
+        loadServers();
+    });
+    
+    liveFeed.addEventListener('account', (e) => {
+        const event = JSON.parse(e.data);
+        applyAccountChanges(event.account_id, event.changes);
+    });
+    
+    liveFeed.addEventListener('server', (e) => {
+        const event = JSON.parse(e.data);
+        applyServerStatus(event.server_id, event.status);
+    });
+    
+    liveFeed.addEventListener('config', () => {
+        refreshData();
+    });
+    
+    liveFeed.onerror = () => {
+        // EventSource ritenta la connessione da solo, nel frattempo si torna al polling
+        startPolling();
+        
+        // Stream rifiutato dal server (es. 503): si resta al polling e lo stream viene
+        // ritentato più tardi
+        if (liveFeed && liveFeed.readyState === EventSource.CLOSED && !liveFeedRetryTimer) {
+            liveFeedRetryTimer = setTimeout(() => {
+                liveFeedRetryTimer = null;
+                connectLiveFeed();
+            }, LIVE_FEED_RETRY_MS);
+        }
+    };
+}
+
+// Funzioni per attivare e disattivare il polling periodico
+function startPolling() {
+    if (!pollingTimer) {
+        pollingTimer = setInterval(refreshData, config.refreshInterval);
+    }
+}
+
+function stopPolling() {
+    if (pollingTimer) {
+        clearInterval(pollingTimer);
+        pollingTimer = null;
+    }
+}
+
+// Funzione per copiare lo stato live di un account nei dati del server
+function mergeLiveState(account) {
+    const state = liveAccounts[account.id];
+    if (!state) {
+        return;
+    }
+    
+    account.status = state.status;
+    if (state.balance !== null) {
+        account.balance = state.balance;
+        account.equity = state.equity;
+    }
+    account.positions = state.positions;
+}
+
+// Funzione per applicare lo stato di un server rilevato dall'heartbeat del server centrale
+function applyServerStatus(serverId, status) {
+    const server = servers.find(s => s.id === serverId);
+    if (!server) {
+        return;
+    }
+    
+    server.status = status;
+    updateServerStatusTable([serverId]);
+    updateServerCards([serverId]);
+}
+
+// Funzione per applicare i campi cambiati di un account ricevuti dallo stream
+function applyAccountChanges(accountId, changes) {
+    const state = liveAccounts[accountId] || (liveAccounts[accountId] = { positions: [] });
+    const { positions_changed, positions_removed, ...fields } = changes;
+    
+    Object.assign(state, fields);
+    if (positions_changed || positions_removed) {
+        const positions = new Map(state.positions.map(position => [position.ticket, position]));
+        (positions_removed || []).forEach(ticket => positions.delete(ticket));
+        (positions_changed || []).forEach(position => positions.set(position.ticket, position));
+        state.positions = Array.from(positions.values());
+    }
+    
+    const server = servers.find(s => s.id === state.server_id);
+    const account = server && server.accounts ? server.accounts.find(a => a.id === accountId) : null;
+    if (!account) {
+        return;
+    }
+    
+    mergeLiveState(account);
+    
+    // Aggiorna solo gli elementi dell'account e del server interessati
+    updateCounters();
+    updateServerStatusTable([server.id]);
+    updateServerCards([server.id]);
+    updateAccountCards([accountId]);
+    if (positions_changed || positions_removed) {
+        updateRecentPositionsTable();
+    }
+}
+
 // Funzione per aggiornare i dati periodicamente
 function refreshData() {
     // Aggiorna i server
@@ -176,6 +318,11 @@ function loadServers() {
         .then(response => {
             servers = response.data;
             
+            // Applica lo stato live già ricevuto dallo stream
+            servers.forEach(server => {
+                (server.accounts || []).forEach(account => mergeLiveState(account));
+            });
+            
             // Aggiorna i contatori
             updateCounters();
             
@@ -188,6 +335,9 @@ function loadServers() {
             // Aggiorna i container delle card degli account
             updateAccountCards();
             
+            // Aggiorna la tabella delle posizioni recenti
+            updateRecentPositionsTable();
+            
             // Aggiorna le select dei server nei form
             updateServerSelects();
         })
@@ -240,184 +390,745 @@ function updateCounters() {
     document.getElementById('total-ms-configs').textContent = masterSlaveConfigs.length;
 }
 
-// Funzione per aggiornare la tabella dello stato dei server
-function updateServerStatusTable() {
+
+// Funzione per sostituire solo gli elementi indicati di un container, o per ricostruirlo
+// interamente se non vengono indicati id
+function replaceItems(container, attribute, ids, items, buildItem) {
+    if (!ids) {
+        container.innerHTML = '';
+        items.forEach(item => container.appendChild(buildItem(item)));
+        return;
+    }
+    
+    ids.forEach(id => {
+        const item = items.find(i => i.id === id);
+        const existing = container.querySelector(`[${attribute}="${id}"]`);
+        if (item && existing) {
+            existing.replaceWith(buildItem(item));
+        }
+    });
+}
+
+// Funzione per aggiornare la tabella dello stato dei server (solo le righe dei server
+// indicati, se serverIds è fornito)
+function updateServerStatusTable(serverIds) {
     const tableBody = document.getElementById('server-status-table');
+    replaceItems(tableBody, 'data-server-id', serverIds, servers, buildServerStatusRow);
+}
+
+// Funzione per creare la riga di un server nella tabella dello stato
+function buildServerStatusRow(server) {
+    const row = document.createElement('tr');
+    row.setAttribute('data-server-id', server.id);
+    
+    const nameCell = document.createElement('td');
+    nameCell.textContent = server.name;
+    row.appendChild(nameCell);
+    
+    const urlCell = document.createElement('td');
+    urlCell.textContent = server.url;
+    row.appendChild(urlCell);
+    
+    const statusCell = document.createElement('td');
+    const statusIndicator = document.createElement('span');
+    statusIndicator.classList.add('status-indicator');
+    statusIndicator.classList.add(server.status === 'online' ? 'status-online' : 'status-offline');
+    statusCell.appendChild(statusIndicator);
+    statusCell.appendChild(document.createTextNode(server.status === 'online' ? 'Online' : 'Offline'));
+    row.appendChild(statusCell);
+    
+    const accountsCell = document.createElement('td');
+    accountsCell.textContent = server.accounts ? server.accounts.length : 0;
+    row.appendChild(accountsCell);
+    
+    const actionsCell = document.createElement('td');
+    
+    const viewBtn = document.createElement('button');
+    viewBtn.classList.add('btn', 'btn-sm', 'btn-info', 'me-2');
+    viewBtn.innerHTML = '<i class="bi bi-eye"></i>';
+    viewBtn.title = 'Visualizza';
+    viewBtn.addEventListener('click', () => {
+        // Implementa la visualizzazione dettagliata del server
+    });
+    actionsCell.appendChild(viewBtn);
+    
+    const editBtn = document.createElement('button');
+    editBtn.classList.add('btn', 'btn-sm', 'btn-warning', 'me-2');
+    editBtn.innerHTML = '<i class="bi bi-pencil"></i>';
+    editBtn.title = 'Modifica';
+    editBtn.addEventListener('click', () => {
+        // Implementa la modifica del server
+    });
+    actionsCell.appendChild(editBtn);
+    
+    const deleteBtn = document.createElement('button');
+    deleteBtn.classList.add('btn', 'btn-sm', 'btn-danger');
+    deleteBtn.innerHTML = '<i class="bi bi-trash"></i>';
+    deleteBtn.title = 'Elimina';
+    deleteBtn.addEventListener('click', () => {
+        deleteServer(server.id);
+    });
+    actionsCell.appendChild(deleteBtn);
+    
+    row.appendChild(actionsCell);
+    
+    return row;
+}
+
+// Funzione per aggiornare le card dei server (solo quelle dei server indicati, se
+// serverIds è fornito)
+function updateServerCards(serverIds) {
+    const container = document.getElementById('server-cards-container');
+    replaceItems(container, 'data-server-id', serverIds, servers, buildServerCard);
+}
+
+// Funzione per creare la card di un server
+function buildServerCard(server) {
+    const col = document.createElement('div');
+    col.classList.add('col-md-4', 'mb-4');
+    col.setAttribute('data-server-id', server.id);
+    
+    const card = document.createElement('div');
+    card.classList.add('card');
+    
+    const cardHeader = document.createElement('div');
+    cardHeader.classList.add('card-header', 'd-flex', 'justify-content-between', 'align-items-center');
+    
+    const serverName = document.createElement('h5');
+    serverName.classList.add('mb-0');
+    serverName.textContent = server.name;
+    
+    const statusBadge = document.createElement('span');
+    statusBadge.classList.add('badge', server.status === 'online' ? 'bg-success' : 'bg-danger');
+    statusBadge.textContent = server.status === 'online' ? 'Online' : 'Offline';
+    
+    cardHeader.appendChild(serverName);
+    cardHeader.appendChild(statusBadge);
+    
+    const cardBody = document.createElement('div');
+    cardBody.classList.add('card-body');
+    
+    const urlParagraph = document.createElement('p');
+    urlParagraph.innerHTML = `<strong>URL:</strong> ${server.url}`;
+    
+    const accountsParagraph = document.createElement('p');
+    accountsParagraph.innerHTML = `<strong>Account:</strong> ${server.accounts ? server.accounts.length : 0}`;
+    
+    cardBody.appendChild(urlParagraph);
+    cardBody.appendChild(accountsParagraph);
+    
+    const cardFooter = document.createElement('div');
+    cardFooter.classList.add('card-footer', 'd-flex', 'justify-content-between');
+    
+    const addAccountBtn = document.createElement('button');
+    addAccountBtn.classList.add('btn', 'btn-sm', 'btn-primary');
+    addAccountBtn.innerHTML = '<i class="bi bi-plus-circle me-2"></i>Aggiungi Account';
+    addAccountBtn.addEventListener('click', () => {
+        document.getElementById('account-server').value = server.id;
+        const modal = new bootstrap.Modal(document.getElementById('addAccountModal'));
+        modal.show();
+    });
+    
+    const deleteServerBtn = document.createElement('button');
+    deleteServerBtn.classList.add('btn', 'btn-sm', 'btn-danger');
+    deleteServerBtn.innerHTML = '<i class="bi bi-trash me-2"></i>Elimina Server';
+    deleteServerBtn.addEventListener('click', () => {
+        deleteServer(server.id);
+    });
+    
+    cardFooter.appendChild(addAccountBtn);
+    cardFooter.appendChild(deleteServerBtn);
+    
+    card.appendChild(cardHeader);
+    card.appendChild(cardBody);
+    card.appendChild(cardFooter);
+    
+    col.appendChild(card);
+    return col;
+}
+
+// Funzione per aggiornare le card degli account (solo quelle degli account indicati, se
+// accountIds è fornito)
+function updateAccountCards(accountIds) {
+    const container = document.getElementById('account-cards-container');
+    const accounts = [];
+    servers.forEach(server => {
+        (server.accounts || []).forEach(account => {
+            accounts.push({ id: account.id, server: server, account: account });
+        });
+    });
+    
+    replaceItems(container, 'data-account-id', accountIds, accounts, item => buildAccountCard(item.server, item.account));
+}
+
+// Funzione per creare la card di un account
+function buildAccountCard(server, account) {
+    const col = document.createElement('div');
+    col.classList.add('col-md-4', 'mb-4');
+    col.setAttribute('data-account-id', account.id);
+    
+    const card = document.createElement('div');
+    card.classList.add('card', 'account-card');
+    card.addEventListener('click', () => {
+        showAccountDetails(server.id, account.id);
+    });
+    
+    const cardHeader = document.createElement('div');
+    cardHeader.classList.add('card-header', 'd-flex', 'justify-content-between', 'align-items-center');
+    
+    const accountNumber = document.createElement('h5');
+    accountNumber.classList.add('mb-0');
+    accountNumber.textContent = account.description || `Account ${account.account_number}`;
+    
+    const statusBadge = document.createElement('span');
+    statusBadge.classList.add('badge', account.status === 'online' ? 'bg-success' : 'bg-danger');
+    statusBadge.textContent = account.status === 'online' ? 'Online' : 'Offline';
+    
+    cardHeader.appendChild(accountNumber);
+    cardHeader.appendChild(statusBadge);
+    
+    const cardBody = document.createElement('div');
+    cardBody.classList.add('card-body');
+    
+    const serverParagraph = document.createElement('p');
+    serverParagraph.innerHTML = `<strong>Server:</strong> ${server.name}`;
+    
+    const balanceParagraph = document.createElement('p');
+    balanceParagraph.innerHTML = `<strong>Saldo:</strong> ${account.balance || 0}`;
+    
+    const equityParagraph = document.createElement('p');
+    equityParagraph.innerHTML = `<strong>Equity:</strong> ${account.equity || 0}`;
+    
+    const positionsParagraph = document.createElement('p');
+    positionsParagraph.innerHTML = `<strong>Posizioni:</strong> ${account.positions ? account.positions.length : 0}`;
+    
+    cardBody.appendChild(serverParagraph);
+    cardBody.appendChild(balanceParagraph);
+    cardBody.appendChild(equityParagraph);
+    cardBody.appendChild(positionsParagraph);
+    
+    card.appendChild(cardHeader);
+    card.appendChild(cardBody);
+    
+    col.appendChild(card);
+    return col;
+}
+
+// Funzione per ottenere la descrizione del tipo di una posizione
+function positionTypeLabel(type) {
+    return type === 0 || type === 'buy' ? 'Buy' : 'Sell';
+}
+
+// Funzione per aggiornare la tabella delle posizioni recenti
+function updateRecentPositionsTable() {
+    const tableBody = document.getElementById('recent-positions-table');
     tableBody.innerHTML = '';
     
+    const rows = [];
     servers.forEach(server => {
+        (server.accounts || []).forEach(account => {
+            (account.positions || []).forEach(position => {
+                rows.push({ server: server, account: account, position: position });
+            });
+        });
+    });
+    rows.sort((a, b) => (b.position.time || 0) - (a.position.time || 0));
+    
+    rows.slice(0, 20).forEach(({ server, account, position }) => {
         const row = document.createElement('tr');
         
-        const nameCell = document.createElement('td');
-        nameCell.textContent = server.name;
-        row.appendChild(nameCell);
-        
-        const urlCell = document.createElement('td');
-        urlCell.textContent = server.url;
-        row.appendChild(urlCell);
-        
-        const statusCell = document.createElement('td');
-        const statusIndicator = document.createElement('span');
-        statusIndicator.classList.add('status-indicator');
-        statusIndicator.classList.add(server.status === 'online' ? 'status-online' : 'status-offline');
-        statusCell.appendChild(statusIndicator);
-        statusCell.appendChild(document.createTextNode(server.status === 'online' ? 'Online' : 'Offline'));
-        row.appendChild(statusCell);
-        
-        const accountsCell = document.createElement('td');
-        accountsCell.textContent = server.accounts ? server.accounts.length : 0;
-        row.appendChild(accountsCell);
+        const profitClass = position.profit >= 0 ? 'profit-positive' : 'profit-negative';
+        row.innerHTML = `
+            <td>${account.description || account.account_number}</td>
+            <td>${position.symbol}</td>
+            <td>${positionTypeLabel(position.type)}</td>
+            <td>${position.volume}</td>
+            <td>${position.price_open}</td>
+            <td>${position.price_current}</td>
+            <td class="${profitClass}">${position.profit}</td>
+        `;
         
         const actionsCell = document.createElement('td');
-        
-        const viewBtn = document.createElement('button');
-        viewBtn.classList.add('btn', 'btn-sm', 'btn-info', 'me-2');
-        viewBtn.innerHTML = '<i class="bi bi-eye"></i>';
-        viewBtn.title = 'Visualizza';
-        viewBtn.addEventListener('click', () => {
-            // Implementa la visualizzazione dettagliata del server
+        const closeBtn = document.createElement('button');
+        closeBtn.classList.add('btn', 'btn-sm', 'btn-danger');
+        closeBtn.innerHTML = '<i class="bi bi-x-circle"></i>';
+        closeBtn.title = 'Chiudi';
+        closeBtn.addEventListener('click', () => {
+            closePosition(server.id, account.id, position.ticket);
         });
-        actionsCell.appendChild(viewBtn);
+        actionsCell.appendChild(closeBtn);
+        row.appendChild(actionsCell);
         
-        const editBtn = document.createElement('button');
-        editBtn.classList.add('btn', 'btn-sm', 'btn-warning', 'me-2');
-        editBtn.innerHTML = '<i class="bi bi-pencil"></i>';
-        editBtn.title = 'Modifica';
-        editBtn.addEventListener('click', () => {
-            // Implementa la modifica del server
-        });
-        actionsCell.appendChild(editBtn);
+        tableBody.appendChild(row);
+    });
+}
+
+// Funzione per aggiornare le select dei server nei form
+function updateServerSelects() {
+    ['account-server', 'master-server'].forEach(selectId => {
+        const select = document.getElementById(selectId);
+        const selected = select.value;
         
-        const deleteBtn = document.createElement('button');
-        deleteBtn.classList.add('btn', 'btn-sm', 'btn-danger');
-        deleteBtn.innerHTML = '<i class="bi bi-trash"></i>';
-        deleteBtn.title = 'Elimina';
-        deleteBtn.addEventListener('click', () => {
-            deleteServer(server.id);
+        select.innerHTML = '<option value="">Seleziona un server</option>';
+        servers.forEach(server => {
+            const option = document.createElement('option');
+            option.value = server.id;
+            option.textContent = server.name;
+            select.appendChild(option);
         });
-        actionsCell.appendChild(deleteBtn);
         
-        row.appendChild(actionsCell);
-        
-        tableBody.appendChild(row);
+        select.value = selected;
     });
 }
 
-// Funzione per aggiornare le card dei server
-function updateServerCards() {
-    const container = document.getElementById('server-cards-container');
+// Funzione per trovare un account all'interno di un server
+function findAccount(serverId, accountId) {
+    const server = servers.find(s => s.id === serverId);
+    if (!server || !server.accounts) {
+        return null;
+    }
+    return server.accounts.find(a => a.id === accountId) || null;
+}
+
+// Funzione per ottenere la descrizione di un account
+function accountLabel(serverId, accountId) {
+    const server = servers.find(s => s.id === serverId);
+    const account = findAccount(serverId, accountId);
+    if (!server || !account) {
+        return accountId;
+    }
+    return `${account.description || account.account_number} (${server.name})`;
+}
+
+// Funzione per aggiornare il container delle configurazioni master-slave
+function updateMasterSlaveConfigsContainer() {
+    const container = document.getElementById('master-slave-configs-container');
     container.innerHTML = '';
     
-    servers.forEach(server => {
-        const col = document.createElement('div');
-        col.classList.add('col-md-4', 'mb-4');
-        
+    masterSlaveConfigs.forEach(msConfig => {
         const card = document.createElement('div');
         card.classList.add('card');
         
         const cardHeader = document.createElement('div');
         cardHeader.classList.add('card-header', 'd-flex', 'justify-content-between', 'align-items-center');
         
-        const serverName = document.createElement('h5');
-        serverName.classList.add('mb-0');
-        serverName.textContent = server.name;
+        const title = document.createElement('h5');
+        title.classList.add('mb-0');
+        title.textContent = `Master: ${accountLabel(msConfig.master_server_id, msConfig.master_account_id)}`;
         
-        const statusBadge = document.createElement('span');
-        statusBadge.classList.add('badge', server.status === 'online' ? 'bg-success' : 'bg-danger');
-        statusBadge.textContent = server.status === 'online' ? 'Online' : 'Offline';
+        const deleteBtn = document.createElement('button');
+        deleteBtn.classList.add('btn', 'btn-sm', 'btn-danger');
+        deleteBtn.innerHTML = '<i class="bi bi-trash"></i>';
+        deleteBtn.title = 'Elimina';
+        deleteBtn.addEventListener('click', () => {
+            deleteMasterSlaveConfig(msConfig.master_server_id, msConfig.master_account_id);
+        });
         
-        cardHeader.appendChild(serverName);
-        cardHeader.appendChild(statusBadge);
+        cardHeader.appendChild(title);
+        cardHeader.appendChild(deleteBtn);
         
         const cardBody = document.createElement('div');
         cardBody.classList.add('card-body');
         
-        const urlParagraph = document.createElement('p');
-        urlParagraph.innerHTML = `<strong>URL:</strong> ${server.url}`;
-        
-        const accountsParagraph = document.createElement('p');
-        accountsParagraph.innerHTML = `<strong>Account:</strong> ${server.accounts ? server.accounts.length : 0}`;
-        
-        cardBody.appendChild(urlParagraph);
-        cardBody.appendChild(accountsParagraph);
-        
-        const cardFooter = document.createElement('div');
-        cardFooter.classList.add('card-footer', 'd-flex', 'justify-content-between');
-        
-        const addAccountBtn = document.createElement('button');
-        addAccountBtn.classList.add('btn', 'btn-sm', 'btn-primary');
-        addAccountBtn.innerHTML = '<i class="bi bi-plus-circle me-2"></i>Aggiungi Account';
-        addAccountBtn.addEventListener('click', () => {
-            document.getElementById('account-server').value = server.id;
-            const modal = new bootstrap.Modal(document.getElementById('addAccountModal'));
-            modal.show();
-        });
+        const table = document.createElement('table');
+        table.classList.add('table', 'table-sm');
+        table.innerHTML = `
+            <thead>
+                <tr>
+                    <th>Slave</th>
+                    <th>Rapporto Volume</th>
+                    <th>Direzione</th>
+                    <th>SL/TP</th>
+                </tr>
+            </thead>
+        `;
         
-        const deleteServerBtn = document.createElement('button');
-        deleteServerBtn.classList.add('btn', 'btn-sm', 'btn-danger');
-        deleteServerBtn.innerHTML = '<i class="bi bi-trash me-2"></i>Elimina Server';
-        deleteServerBtn.addEventListener('click', () => {
-            deleteServer(server.id);
+        const tableBody = document.createElement('tbody');
+        msConfig.slaves.forEach(slave => {
+            const row = document.createElement('tr');
+            row.innerHTML = `
+                <td>${accountLabel(slave.server_id, slave.account_id)}</td>
+                <td>${slave.size_ratio}</td>
+                <td>${slave.direction === 'opposite' ? 'Opposta' : 'Stessa'}</td>
+                <td>${slave.use_sl_tp ? 'Sì' : 'No'}</td>
+            `;
+            tableBody.appendChild(row);
         });
-        
-        cardFooter.appendChild(addAccountBtn);
-        cardFooter.appendChild(deleteServerBtn);
+        table.appendChild(tableBody);
+        cardBody.appendChild(table);
         
         card.appendChild(cardHeader);
         card.appendChild(cardBody);
-        card.appendChild(cardFooter);
-        
-        col.appendChild(card);
-        container.appendChild(col);
+        container.appendChild(card);
     });
 }
 
-// Funzione per aggiornare le card degli account
-function updateAccountCards() {
-    const container = document.getElementById('account-cards-container');
-    container.innerHTML = '';
+// Funzione per aggiungere un server
+function addServer() {
+    const name = document.getElementById('server-name').value;
+    const url = document.getElementById('server-url').value;
+    
+    if (!name || !url) {
+        alert('Compila tutti i campi obbligatori');
+        return;
+    }
+    
+    axios.post(`${config.apiUrl}/api/servers`, { name: name, url: url })
+        .then(() => {
+            bootstrap.Modal.getInstance(document.getElementById('addServerModal')).hide();
+            document.getElementById('add-server-form').reset();
+            loadServers();
+        })
+        .catch(error => {
+            console.error("Errore nell'aggiunta del server:", error);
+            alert("Errore nell'aggiunta del server");
+        });
+}
+
+// Funzione per aggiungere un account
+function addAccount() {
+    const serverId = document.getElementById('account-server').value;
+    const accountNumber = document.getElementById('account-number').value;
+    
+    if (!serverId || !accountNumber) {
+        alert('Compila tutti i campi obbligatori');
+        return;
+    }
+    
+    axios.post(`${config.apiUrl}/api/servers/${serverId}/accounts`, {
+        account_number: accountNumber,
+        password: document.getElementById('account-password').value,
+        server: document.getElementById('account-server-name').value,
+        description: document.getElementById('account-description').value
+    })
+        .then(() => {
+            bootstrap.Modal.getInstance(document.getElementById('addAccountModal')).hide();
+            document.getElementById('add-account-form').reset();
+            loadServers();
+        })
+        .catch(error => {
+            console.error("Errore nell'aggiunta dell'account:", error);
+            alert("Errore nell'aggiunta dell'account");
+        });
+}
+
+// Funzione per creare le opzioni degli account di un server
+function accountOptions(serverId) {
+    const server = servers.find(s => s.id === serverId);
+    let options = '<option value="">Seleziona un account</option>';
+    if (server && server.accounts) {
+        server.accounts.forEach(account => {
+            options += `<option value="${account.id}">${account.description || account.account_number}</option>`;
+        });
+    }
+    return options;
+}
+
+// Funzione per aggiungere una riga slave al form master-slave
+function addSlaveRow() {
+    const container = document.getElementById('slaves-container');
     
+    const row = document.createElement('div');
+    row.classList.add('row', 'g-2', 'mb-2', 'slave-row');
+    
+    let serverOptions = '<option value="">Seleziona un server</option>';
     servers.forEach(server => {
-        if (server.accounts && server.accounts.length > 0) {
-            server.accounts.forEach(account => {
-                const col = document.createElement('div');
-                col.classList.add('col-md-4', 'mb-4');
+        serverOptions += `<option value="${server.id}">${server.name}</option>`;
+    });
+    
+    row.innerHTML = `
+        <div class="col-md-3">
+            <select class="form-select slave-server">${serverOptions}</select>
+        </div>
+        <div class="col-md-3">
+            <select class="form-select slave-account"><option value="">Seleziona un account</option></select>
+        </div>
+        <div class="col-md-2">
+            <input type="number" class="form-control slave-ratio" value="1" min="0.01" step="0.01" title="Rapporto Volume">
+        </div>
+        <div class="col-md-2">
+            <select class="form-select slave-direction">
+                <option value="same">Stessa</option>
+                <option value="opposite">Opposta</option>
+            </select>
+        </div>
+        <div class="col-md-1 d-flex align-items-center">
+            <input type="checkbox" class="form-check-input slave-sl-tp" checked title="Usa SL/TP">
+        </div>
+        <div class="col-md-1">
+            <button type="button" class="btn btn-outline-danger remove-slave-btn"><i class="bi bi-x"></i></button>
+        </div>
+    `;
+    
+    row.querySelector('.slave-server').addEventListener('change', (e) => {
+        row.querySelector('.slave-account').innerHTML = accountOptions(e.target.value);
+    });
+    row.querySelector('.remove-slave-btn').addEventListener('click', () => {
+        row.remove();
+    });
+    
+    container.appendChild(row);
+}
+
+// Funzione per caricare gli account del server master selezionato
+function loadMasterAccounts() {
+    const serverId = document.getElementById('master-server').value;
+    document.getElementById('master-account').innerHTML = accountOptions(serverId);
+}
+
+// Funzione per salvare una configurazione master-slave
+function addMasterSlaveConfig() {
+    const masterServerId = document.getElementById('master-server').value;
+    const masterAccountId = document.getElementById('master-account').value;
+    
+    if (!masterServerId || !masterAccountId) {
+        alert("Seleziona il server e l'account master");
+        return;
+    }
+    
+    const slaves = [];
+    document.querySelectorAll('#slaves-container .slave-row').forEach(row => {
+        const serverId = row.querySelector('.slave-server').value;
+        const accountId = row.querySelector('.slave-account').value;
+        if (serverId && accountId) {
+            slaves.push({
+                server_id: serverId,
+                account_id: accountId,
+                size_ratio: parseFloat(row.querySelector('.slave-ratio').value),
+                direction: row.querySelector('.slave-direction').value,
+                use_sl_tp: row.querySelector('.slave-sl-tp').checked
+            });
+        }
+    });
+    
+    if (slaves.length === 0) {
+        alert('Aggiungi almeno uno slave');
+        return;
+    }
+    
+    axios.post(`${config.apiUrl}/api/master-slave`, {
+        master_server_id: masterServerId,
+        master_account_id: masterAccountId,
+        slaves: slaves
+    })
+        .then(() => {
+            bootstrap.Modal.getInstance(document.getElementById('addMasterSlaveModal')).hide();
+            document.getElementById('slaves-container').innerHTML = '';
+            loadMasterSlaveConfigs();
+        })
+        .catch(error => {
+            console.error('Errore nel salvataggio della configurazione master-slave:', error);
+            alert('Errore nel salvataggio della configurazione master-slave');
+        });
+}
+
+// Funzione per eliminare una configurazione master-slave
+function deleteMasterSlaveConfig(masterServerId, masterAccountId) {
+    if (!confirm('Sei sicuro di voler eliminare questa configurazione?')) {
+        return;
+    }
+    
+    axios.delete(`${config.apiUrl}/api/master-slave/${masterServerId}/${masterAccountId}`)
+        .then(() => {
+            loadMasterSlaveConfigs();
+        })
+        .catch(error => {
+            console.error('Errore nella eliminazione della configurazione master-slave:', error);
+        });
+}
+
+// Funzione per mostrare i dettagli di un account
+function showAccountDetails(serverId, accountId) {
+    const account = findAccount(serverId, accountId);
+    if (!account) {
+        return;
+    }
+    
+    document.getElementById('accountDetailsModalLabel').textContent = account.description || `Account ${account.account_number}`;
+    
+    const openBtn = document.getElementById('open-position-modal-btn');
+    openBtn.setAttribute('data-server-id', serverId);
+    openBtn.setAttribute('data-account-id', accountId);
+    
+    const closeAllBtn = document.getElementById('close-all-positions-btn');
+    closeAllBtn.setAttribute('data-server-id', serverId);
+    closeAllBtn.setAttribute('data-account-id', accountId);
+    
+    loadAccountPositions(serverId, accountId);
+    loadAccountHistory(serverId, accountId);
+    
+    const modal = new bootstrap.Modal(document.getElementById('accountDetailsModal'));
+    modal.show();
+}
+
+// Funzione per caricare le posizioni aperte di un account
+function loadAccountPositions(serverId, accountId) {
+    const tableBody = document.getElementById('account-positions-table');
+    
+    axios.get(`${config.apiUrl}/api/servers/${serverId}/accounts/${accountId}/positions`)
+        .then(response => {
+            tableBody.innerHTML = '';
+            response.data.data.forEach(position => {
+                const row = document.createElement('tr');
+                const profitClass = position.profit >= 0 ? 'profit-positive' : 'profit-negative';
+                row.innerHTML = `
+                    <td>${position.ticket}</td>
+                    <td>${position.symbol}</td>
+                    <td>${positionTypeLabel(position.type)}</td>
+                    <td>${position.volume}</td>
+                    <td>${position.price_open}</td>
+                    <td>${position.sl || '-'}</td>
+                    <td>${position.tp || '-'}</td>
+                    <td class="${profitClass}">${position.profit}</td>
+                `;
                 
-                const card = document.createElement('div');
-                card.classList.add('card', 'account-card');
-                card.addEventListener('click', () => {
-                    showAccountDetails(server.id, account.id);
+                const actionsCell = document.createElement('td');
+                const closeBtn = document.createElement('button');
+                closeBtn.classList.add('btn', 'btn-sm', 'btn-danger');
+                closeBtn.innerHTML = '<i class="bi bi-x-circle"></i>';
+                closeBtn.title = 'Chiudi';
+                closeBtn.addEventListener('click', () => {
+                    closePosition(serverId, accountId, position.ticket);
                 });
+                actionsCell.appendChild(closeBtn);
+                row.appendChild(actionsCell);
                 
-                const cardHeader = document.createElement('div');
-                cardHeader.classList.add('card-header', 'd-flex', 'justify-content-between', 'align-items-center');
-                
-                const accountNumber = document.createElement('h5');
-                accountNumber.classList.add('mb-0');
-                accountNumber.textContent = account.description || `Account ${account.account_number}`;
-                
-                const statusBadge = document.createElement('span');
-                statusBadge.classList.add('badge', account.status === 'online' ? 'bg-success' : 'bg-danger');
-                statusBadge.textContent = account.status === 'online' ? 'Online' : 'Offline';
-                
-                cardHeader.appendChild(accountNumber);
-                cardHeader.appendChild(statusBadge);
-                
-                const cardBody = document.createElement('div');
-                cardBody.classList.add('card-body');
-                
-                const serverParagraph = document.createElement('p');
-                serverParagraph.innerHTML = `<strong>Server:</strong> ${server.name}`;
-                
-                const balanceParagraph = document.createElement('p');
-                balanceParagraph.innerHTML = `<strong>Saldo:</strong> ${account.balance || 0}`;
-                
-                const equityParagraph = document.createElement('p');
-                equityParagraph.innerHTML = `<strong>Equity:</strong> ${account.equity || 0}`;
-                
-                const positionsParagraph = document.createElement('p');
-                positionsParagraph.innerHTML = `<strong>Posizioni:</strong> ${account.positions ? account.positions.length : 0}`;
-                
-                cardBody.appendChild(serverParagraph);
-                cardBody.appendChild(balanc
-(Content truncated due to size limit. Use line ranges to read in chunks)
\ No newline at end of file
+                tableBody.appendChild(row);
+            });
+        })
+        .catch(error => {
+            console.error('Errore nel caricamento delle posizioni:', error);
+        });
+}
+
+// Funzione per caricare la cronologia di un account
+function loadAccountHistory(serverId, accountId) {
+    const tableBody = document.getElementById('account-history-table');
+    
+    // Cronologia in formato colonnare (un array per campo): più compatta da trasferire
+    axios.get(`${config.apiUrl}/api/servers/${serverId}/accounts/${accountId}/history`, {
+        params: { format: 'columns' }
+    })
+        .then(response => {
+            tableBody.innerHTML = '';
+            const columns = response.data.data;
+            const fields = Object.keys(columns);
+            const count = fields.length ? columns[fields[0]].length : 0;
+            for (let i = 0; i < count; i++) {
+                const deal = {};
+                fields.forEach(field => { deal[field] = columns[field][i]; });
+                const row = document.createElement('tr');
+                const profitClass = deal.profit >= 0 ? 'profit-positive' : 'profit-negative';
+                row.innerHTML = `
+                    <td>${new Date(deal.time * 1000).toLocaleString()}</td>
+                    <td>${deal.ticket}</td>
+                    <td>${deal.symbol}</td>
+                    <td>${positionTypeLabel(deal.type)}</td>
+                    <td>${deal.volume}</td>
+                    <td>${deal.price}</td>
+                    <td class="${profitClass}">${deal.profit}</td>
+                `;
+                tableBody.appendChild(row);
+            }
+        })
+        .catch(error => {
+            console.error('Errore nel caricamento della cronologia:', error);
+        });
+}
+
+// Funzione per aprire una posizione
+function openPosition() {
+    const serverId = document.getElementById('position-server-id').value;
+    const accountId = document.getElementById('position-account-id').value;
+    const symbol = document.getElementById('position-symbol').value;
+    const volume = parseFloat(document.getElementById('position-volume').value);
+    
+    if (!symbol || !volume) {
+        alert('Compila tutti i campi obbligatori');
+        return;
+    }
+    
+    const optionalNumber = (id) => {
+        const value = document.getElementById(id).value;
+        return value ? parseFloat(value) : null;
+    };
+    
+    axios.post(`${config.apiUrl}/api/servers/${serverId}/accounts/${accountId}/positions`, {
+        symbol: symbol,
+        type: document.getElementById('position-type').value,
+        volume: volume,
+        sl: optionalNumber('position-sl'),
+        tp: optionalNumber('position-tp'),
+        limit_price: optionalNumber('position-limit-price')
+    })
+        .then(response => {
+            bootstrap.Modal.getInstance(document.getElementById('openPositionModal')).hide();
+            document.getElementById('open-position-form').reset();
+            
+            if (!response.data.success) {
+                alert(`Apertura della posizione fallita: ${response.data.result ? response.data.result.message : ''}`);
+            }
+            loadAccountPositions(serverId, accountId);
+        })
+        .catch(error => {
+            console.error("Errore nell'apertura della posizione:", error);
+            alert("Errore nell'apertura della posizione");
+        });
+}
+
+// Funzione per chiudere una posizione
+function closePosition(serverId, accountId, positionId) {
+    if (!confirm('Sei sicuro di voler chiudere questa posizione?')) {
+        return;
+    }
+    
+    axios.delete(`${config.apiUrl}/api/servers/${serverId}/accounts/${accountId}/positions/${positionId}`)
+        .then(() => {
+            loadAccountPositions(serverId, accountId);
+        })
+        .catch(error => {
+            console.error('Errore nella chiusura della posizione:', error);
+            alert('Errore nella chiusura della posizione');
+        });
+}
+
+// Funzione per chiudere tutte le posizioni dell'account visualizzato
+function closeAllPositions() {
+    const closeAllBtn = document.getElementById('close-all-positions-btn');
+    const serverId = closeAllBtn.getAttribute('data-server-id');
+    const accountId = closeAllBtn.getAttribute('data-account-id');
+    
+    if (!confirm('Sei sicuro di voler chiudere tutte le posizioni?')) {
+        return;
+    }
+    
+    // Un'unica richiesta: l'agente chiude le posizioni una dopo l'altra sul terminale
+    axios.post(`${config.apiUrl}/api/servers/${serverId}/accounts/${accountId}/positions/close-batch`, {})
+        .then(response => {
+            const failed = response.data.results.filter(result => !result.success);
+            if (failed.length > 0) {
+                alert(`Chiusura fallita per ${failed.length} posizioni`);
+            }
+            loadAccountPositions(serverId, accountId);
+        })
+        .catch(error => {
+            console.error('Errore nella chiusura delle posizioni:', error);
+            alert('Errore nella chiusura delle posizioni');
+        });
+}
+
+// Funzione per eliminare un server
+function deleteServer(serverId) {
+    if (!confirm('Sei sicuro di voler eliminare questo server?')) {
+        return;
+    }
+    
+    axios.delete(`${config.apiUrl}/api/servers/${serverId}`)
+        .then(() => {
+            loadServers();
+            loadMasterSlaveConfigs();
+        })
+        .catch(error => {
+            console.error("Errore nell'eliminazione del server:", error);
+        });
+}
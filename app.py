@@ -1,10 +1,34 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from flask_httpauth import HTTPBasicAuth
-import json
 import os
+import json
+import queue
 import uuid
+import zlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from agent_client import AGENT_CONNECT_TIMEOUT, AGENT_READ_TIMEOUT, agent_clients
+from agent_health import AgentHealthMonitor
+from analytics import aggregate_analytics
+from config_index import ConfigIndex
+from config_store import create_config_store
+from copy_rules import validate_slave_rules
+from fanout import dispatch_orders
+from fleet_poller import FLEET_CACHE_TTL, FLEET_IDLE_TIMEOUT, FLEET_POLL_INTERVAL, FleetPoller
+from hub_state import HUB_EVENT_POLL_INTERVAL, HUB_STATE_DB, HubState
+from idempotency import idempotency_key_from_comment
+from live_feed import diff_account_state, live_feed
+from metrics import PROMETHEUS_CONTENT_TYPE, Timings, registry
+from position_links import LINK_CLOSED, LINK_OPEN, PositionLinks
+from position_stream import position_streams
+from replication_queue import REPLICATION_DB, ReplicationQueue
+from sizing import SIZE_MODE_EQUITY_RATIO, SIZE_MODE_FIXED, SIZE_MODES, compute_slave_volumes, symbol_constraints
+from wire_format import negotiate_format, unsupported_format_response, wire_response
 
 # Configurazione del logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -24,37 +48,162 @@ def verify_password(username, password):
         return username
     return None
 
-# Percorso del file di configurazione
+# Porta del server di sviluppo (in produzione il server centrale è servito da gunicorn)
+HUB_PORT = int(os.environ.get('HUB_PORT', 5000))
+
+# Ruolo del processo del server centrale:
+# - all: un unico processo che serve le API ed esegue replica, stream e heartbeat
+# - api: worker API senza stato proprio (più processi, es. gunicorn -c gunicorn.conf.py)
+# - replication: worker di replica avviato con replication_worker.py, che riceve gli
+#   eventi dagli agenti, consegna la coda di replica ed esegue l'heartbeat
+HUB_ROLE_ALL = 'all'
+HUB_ROLE_API = 'api'
+HUB_ROLE_REPLICATION = 'replication'
+HUB_ROLE = os.environ.get('HUB_ROLE', HUB_ROLE_ALL)
+# Numero di worker di replica e indice di questo worker: i server sono ripartiti tra i
+# worker, ognuno apre gli stream ed esegue l'heartbeat solo dei propri
+REPLICATION_WORKERS = int(os.environ.get('REPLICATION_WORKERS', 1))
+REPLICATION_WORKER_INDEX = int(os.environ.get('REPLICATION_WORKER_INDEX', 0))
+# Intervallo di pubblicazione dello stato dei worker di replica, in secondi
+HUB_STATE_INTERVAL = float(os.environ.get('HUB_STATE_INTERVAL', 1.0))
+# Conservazione delle metriche pubblicate da un processo che non le aggiorna più
+# (processo terminato), in secondi: fino ad allora restano nei totali di /metrics
+HUB_METRICS_RETENTION = float(os.environ.get('HUB_METRICS_RETENTION', 24 * 3600))
+# Nome dello snapshot delle metriche di questo processo nello stato condiviso
+METRICS_SNAPSHOT_NAME = f"metrics.{uuid.uuid4().hex}"
+
+# Stato ed eventi condivisi tra i processi del server centrale
+hub_state = HubState(HUB_STATE_DB)
+
+# Percorso del file di configurazione (importato nell'archivio SQLite al primo avvio)
 CONFIG_FILE = 'config.json'
 
+# Magic number usato dall'agente per gli ordini inviati dal server centrale
+AGENT_MAGIC = 234000
+# Attesa (secondi) prima che lo stream replichi un'apertura del master inviata dal server
+# centrale: entro questo tempo la replica spetta alla risposta dell'agente in open_position
+MASTER_OPEN_GRACE = float(os.environ.get('MASTER_OPEN_GRACE', AGENT_CONNECT_TIMEOUT + AGENT_READ_TIMEOUT + 2.0))
+POSITION_TYPE_BUY = 0
+
 # Struttura dati per memorizzare le informazioni sui server MetaTrader
 servers = {}
 master_slave_config = {}
 
-# Carica la configurazione se esiste
+# Indici per ricerche in tempo costante su account e relazioni master-slave
+config_index = ConfigIndex()
+
+# Archivio della configurazione (SQLite per default, vedi CONFIG_BACKEND)
+config_store = create_config_store(CONFIG_FILE)
+
+# Carica la configurazione dall'archivio
 def load_config():
     global servers, master_slave_config
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-                servers = config.get('servers', {})
-                master_slave_config = config.get('master_slave_config', {})
-            logger.info(f"Configurazione caricata: {len(servers)} server trovati")
-        except Exception as e:
-            logger.error(f"Errore nel caricamento della configurazione: {e}")
+    try:
+        servers, master_slave_config = config_store.load()
+        config_index.rebuild(servers, master_slave_config)
+        
+        # Lo stato degli agenti non è salvato nell'archivio: è quello dell'ultimo heartbeat
+        statuses = agent_statuses()
+        for server_id, server in servers.items():
+            server['status'] = statuses.get(server_id) or 'offline'
+        logger.info(f"Configurazione caricata: {len(servers)} server trovati")
+    except Exception as e:
+        logger.error(f"Errore nel caricamento della configurazione: {e}")
+
+# Errore nel salvataggio della configurazione: la richiesta termina con 500
+class ConfigSaveError(Exception):
+    pass
 
-# Salva la configurazione
+# Salva le modifiche alla configurazione in un'unica transazione atomica. Se il
+# salvataggio fallisce la configurazione in memoria, già modificata dalla richiesta,
+# viene ricaricata dall'archivio e l'errore viene propagato come ConfigSaveError.
+@contextmanager
 def save_config():
     try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump({
-                'servers': servers,
-                'master_slave_config': master_slave_config
-            }, f, indent=4)
-        logger.info("Configurazione salvata con successo")
+        with config_store.transaction() as store:
+            yield store
     except Exception as e:
         logger.error(f"Errore nel salvataggio della configurazione: {e}")
+        load_config()
+        raise ConfigSaveError(str(e)) from e
+    logger.info("Configurazione salvata con successo")
+    publish_event({"event": "config"})
+
+@app.errorhandler(ConfigSaveError)
+def handle_config_save_error(e):
+    return jsonify({"error": f"Errore nel salvataggio della configurazione: {e}"}), 500
+
+# Ricarica la configurazione se è stata modificata da un altro processo (es. un altro worker gunicorn).
+# I worker API ricevono anche l'evento della modifica, pubblicato da chi l'ha salvata.
+@app.before_request
+def refresh_config():
+    if config_store.has_changed():
+        load_config()
+        if HUB_ROLE == HUB_ROLE_ALL:
+            sync_position_streams()
+            live_feed.publish({"event": "config"})
+
+# Pubblica un evento per le dashboard: direttamente in un processo unico, altrimenti sul
+# bus condiviso, da cui lo ricevono tutti i worker API (compreso quello che lo pubblica)
+def publish_event(event):
+    if HUB_ROLE == HUB_ROLE_ALL:
+        live_feed.publish(event)
+    else:
+        hub_state.publish(event)
+
+# Gestisce in un worker API un evento del bus condiviso
+def handle_hub_event(event):
+    if event['event'] == 'server':
+        server = servers.get(event['server_id'])
+        if server is not None:
+            server['status'] = event['status']
+    elif event['event'] == 'config' and config_store.has_changed():
+        load_config()
+    live_feed.publish(event)
+
+# Indica se questo processo gestisce stream e heartbeat dell'agente di un server
+def owns_server(server_id):
+    if HUB_ROLE == HUB_ROLE_ALL or REPLICATION_WORKERS <= 1:
+        return True
+    return zlib.crc32(server_id.encode()) % REPLICATION_WORKERS == REPLICATION_WORKER_INDEX
+
+# Stato degli agenti secondo l'ultimo heartbeat ({server_id: 'online'/'offline'}): nei
+# worker API è quello pubblicato dai worker di replica
+def agent_statuses():
+    return {server_id: health['status'] for server_id, health in agent_health_status().items()}
+
+# Stato degli agenti con i percentili di latenza dell'heartbeat
+def agent_health_status():
+    if HUB_ROLE != HUB_ROLE_API:
+        return agent_health.status()
+    status = {}
+    for worker_status in hub_state.snapshots('agent_health').values():
+        status.update(worker_status)
+    return status
+
+# Cerca un account all'interno di un server
+def find_account(server_id, account_id):
+    return config_index.find_account(server_id, account_id)
+
+# Elimina le configurazioni master-slave indicate
+def remove_master_configs(store, master_keys):
+    for master_key in master_keys:
+        if master_slave_config.pop(master_key, None) is not None:
+            config_index.remove_master(master_key)
+            store.delete_master_slave(master_key)
+
+# Rimuove gli account slave indicati ({(server_id, account_id)}) dalle configurazioni dei master
+# che li copiano
+def remove_slave_references(store, master_keys, slave_keys):
+    for master_key in master_keys:
+        master_config = master_slave_config.get(master_key)
+        if master_config is None:
+            continue
+        master_config['slaves'] = [
+            s for s in master_config.get('slaves', []) if (s['server_id'], s['account_id']) not in slave_keys
+        ]
+        config_index.set_master(master_key, master_config)
+        store.save_master_slave(master_key, master_config)
 
 # Rotta principale
 @app.route('/')
@@ -81,7 +230,9 @@ def register_server():
         'status': 'offline',
         'accounts': []
     }
-    save_config()
+    with save_config() as store:
+        store.save_server(servers[server_id])
+    sync_position_streams()
     return jsonify({"id": server_id, "message": "Server registrato con successo"}), 201
 
 # API per ottenere tutti i server
@@ -114,7 +265,12 @@ def update_server(server_id):
         if key != 'id':  # Non permettere di modificare l'ID
             servers[server_id][key] = value
     
-    save_config()
+    if 'accounts' in data:
+        config_index.rebuild(servers, master_slave_config)
+    
+    with save_config() as store:
+        store.save_server(servers[server_id])
+    sync_position_streams()
     return jsonify({"message": "Server aggiornato con successo"})
 
 # API per eliminare un server
@@ -124,18 +280,27 @@ def delete_server(server_id):
     if server_id not in servers:
         return jsonify({"error": "Server non trovato"}), 404
     
+    account_ids = config_index.account_ids(server_id)
+    slave_keys = {(server_id, account_id) for account_id in account_ids}
+    
+    # Master e slave coinvolti, trovati tramite gli indici
+    masters_to_delete = config_index.masters_on_server(server_id)
+    masters_to_update = config_index.masters_of_slave_server(server_id) - masters_to_delete
+    
     del servers[server_id]
+    agent_clients.remove(server_id)
+    symbol_constraints.invalidate(server_id)
+    for account_id in account_ids:
+        config_index.remove_account(account_id)
     
-    # Rimuovi anche le configurazioni master-slave associate
-    for master_id in list(master_slave_config.keys()):
-        if master_id == server_id:
-            del master_slave_config[master_id]
-        else:
-            # Rimuovi questo server dalle configurazioni slave
-            slaves = master_slave_config[master_id].get('slaves', [])
-            master_slave_config[master_id]['slaves'] = [s for s in slaves if s['server_id'] != server_id]
+    with save_config() as store:
+        store.delete_server(server_id)
+        
+        # Rimuovi anche le configurazioni master-slave associate
+        remove_master_configs(store, masters_to_delete)
+        remove_slave_references(store, masters_to_update, slave_keys)
     
-    save_config()
+    sync_position_streams()
     return jsonify({"message": "Server eliminato con successo"})
 
 # API per registrare un account MetaTrader su un server
@@ -165,7 +330,9 @@ def register_account(server_id):
         servers[server_id]['accounts'] = []
     
     servers[server_id]['accounts'].append(account)
-    save_config()
+    config_index.add_account(server_id, account)
+    with save_config() as store:
+        store.save_account(server_id, account)
     return jsonify({"id": account_id, "message": "Account registrato con successo"}), 201
 
 # API per ottenere tutti gli account di un server
@@ -184,11 +351,11 @@ def get_account(server_id, account_id):
     if server_id not in servers:
         return jsonify({"error": "Server non trovato"}), 404
     
-    for account in servers[server_id].get('accounts', []):
-        if account['id'] == account_id:
-            return jsonify(account)
+    account = find_account(server_id, account_id)
+    if account is None:
+        return jsonify({"error": "Account non trovato"}), 404
     
-    return jsonify({"error": "Account non trovato"}), 404
+    return jsonify(account)
 
 # API per aggiornare un account
 @app.route('/api/servers/<server_id>/accounts/<account_id>', methods=['PUT'])
@@ -201,17 +368,22 @@ def update_account(server_id, account_id):
     if not data:
         return jsonify({"error": "Dati mancanti"}), 400
     
-    for i, account in enumerate(servers[server_id].get('accounts', [])):
-        if account['id'] == account_id:
-            # Aggiorna solo i campi forniti
-            for key, value in data.items():
-                if key != 'id':  # Non permettere di modificare l'ID
-                    servers[server_id]['accounts'][i][key] = value
-            
-            save_config()
-            return jsonify({"message": "Account aggiornato con successo"})
+    account = find_account(server_id, account_id)
+    if account is None:
+        return jsonify({"error": "Account non trovato"}), 404
     
-    return jsonify({"error": "Account non trovato"}), 404
+    # Aggiorna solo i campi forniti
+    old_account_number = account['account_number']
+    for key, value in data.items():
+        if key != 'id':  # Non permettere di modificare l'ID
+            account[key] = value
+    
+    if account['account_number'] != old_account_number:
+        config_index.reindex_account(server_id, account, old_account_number)
+    
+    with save_config() as store:
+        store.save_account(server_id, account)
+    return jsonify({"message": "Account aggiornato con successo"})
 
 # API per eliminare un account
 @app.route('/api/servers/<server_id>/accounts/<account_id>', methods=['DELETE'])
@@ -220,25 +392,24 @@ def delete_account(server_id, account_id):
     if server_id not in servers:
         return jsonify({"error": "Server non trovato"}), 404
     
-    for i, account in enumerate(servers[server_id].get('accounts', [])):
-        if account['id'] == account_id:
-            del servers[server_id]['accounts'][i]
-            
-            # Rimuovi anche le configurazioni master-slave associate
-            for master_id in list(master_slave_config.keys()):
-                if master_id == account_id:
-                    del master_slave_config[master_id]
-                else:
-                    # Rimuovi questo account dalle configurazioni slave
-                    slaves = master_slave_config[master_id].get('slaves', [])
-                    master_slave_config[master_id]['slaves'] = [
-                        s for s in slaves if not (s['server_id'] == server_id and s['account_id'] == account_id)
-                    ]
-            
-            save_config()
-            return jsonify({"message": "Account eliminato con successo"})
+    account = find_account(server_id, account_id)
+    if account is None:
+        return jsonify({"error": "Account non trovato"}), 404
+    
+    master_key = f"{server_id}_{account_id}"
+    masters_to_update = config_index.masters_of_slave(server_id, account_id) - {master_key}
     
-    return jsonify({"error": "Account non trovato"}), 404
+    servers[server_id]['accounts'].remove(account)
+    config_index.remove_account(account_id)
+    
+    with save_config() as store:
+        store.delete_account(server_id, account_id)
+        
+        # Rimuovi anche le configurazioni master-slave associate
+        remove_master_configs(store, [master_key])
+        remove_slave_references(store, masters_to_update, {(server_id, account_id)})
+    
+    return jsonify({"message": "Account eliminato con successo"})
 
 # API per configurare una relazione master-slave
 @app.route('/api/master-slave', methods=['POST'])
@@ -255,13 +426,7 @@ def configure_master_slave():
     if master_server_id not in servers:
         return jsonify({"error": "Server master non trovato"}), 404
     
-    master_exists = False
-    for account in servers[master_server_id].get('accounts', []):
-        if account['id'] == master_account_id:
-            master_exists = True
-            break
-    
-    if not master_exists:
+    if find_account(master_server_id, master_account_id) is None:
         return jsonify({"error": "Account master non trovato"}), 404
     
     # Verifica che tutti gli slave esistano
@@ -269,19 +434,30 @@ def configure_master_slave():
         if not all(k in slave for k in ['server_id', 'account_id', 'size_ratio', 'direction', 'use_sl_tp']):
             return jsonify({"error": "Dati slave incompleti"}), 400
         
+        size_mode = slave.get('size_mode')
+        if size_mode is not None and size_mode not in SIZE_MODES:
+            return jsonify({"error": f"Modalità di calcolo del volume non valida: {size_mode}"}), 400
+        
+        if size_mode == SIZE_MODE_FIXED and not slave.get('fixed_volume'):
+            return jsonify({"error": "Volume fisso mancante"}), 400
+        
+        size_ratio = slave['size_ratio']
+        if size_mode != SIZE_MODE_FIXED and (
+            isinstance(size_ratio, bool) or not isinstance(size_ratio, (int, float)) or not size_ratio > 0
+        ):
+            return jsonify({"error": "Il rapporto di dimensione deve essere un numero positivo"}), 400
+        
+        error = validate_slave_rules(slave)
+        if error is not None:
+            return jsonify({"error": error}), 400
+        
         slave_server_id = slave['server_id']
         slave_account_id = slave['account_id']
         
         if slave_server_id not in servers:
             return jsonify({"error": f"Server slave {slave_server_id} non trovato"}), 404
         
-        slave_exists = False
-        for account in servers[slave_server_id].get('accounts', []):
-            if account['id'] == slave_account_id:
-                slave_exists = True
-                break
-        
-        if not slave_exists:
+        if find_account(slave_server_id, slave_account_id) is None:
             return jsonify({"error": f"Account slave {slave_account_id} non trovato"}), 404
     
     # Crea o aggiorna la configurazione master-slave
@@ -291,8 +467,10 @@ def configure_master_slave():
         'master_account_id': master_account_id,
         'slaves': data['slaves']
     }
+    config_index.set_master(master_key, master_slave_config[master_key])
     
-    save_config()
+    with save_config() as store:
+        store.save_master_slave(master_key, master_slave_config[master_key])
     return jsonify({"message": "Configurazione master-slave salvata con successo"})
 
 # API per ottenere tutte le configurazioni master-slave
@@ -320,35 +498,334 @@ def delete_master_slave_config(master_server_id, master_account_id):
         return jsonify({"error": "Configurazione master-slave non trovata"}), 404
     
     del master_slave_config[master_key]
-    save_config()
+    config_index.remove_master(master_key)
+    with save_config() as store:
+        store.delete_master_slave(master_key)
     return jsonify({"message": "Configurazione master-slave eliminata con successo"})
 
+# Richieste parallele dell'equity agli agenti per il calcolo dei volumi
+equity_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='equity')
+
+# Equity attuale di un account (server_id, account): dallo snapshot della flotta se
+# recente, altrimenti chiesta subito all'agente. None se non disponibile.
+def account_equity(server_id, account):
+    state = fleet_account(account['id'])
+    if state is not None and state.get('status') == 'online' and state.get('equity'):
+        return state['equity']
+    
+    server = servers.get(server_id)
+    if server is None:
+        return None
+    success, message, info = agent_clients.get(server_id, server['url']).get_account(account['account_number'])
+    if not success:
+        logger.warning(f"Equity dell'account {account['account_number']} non disponibile: {message}")
+        return None
+    return info.get('equity') or None
+
+# Equity di più account [(server_id, account)], richieste in parallelo
+def account_equities(accounts):
+    return list(equity_executor.map(lambda entry: account_equity(*entry), accounts))
+
+# Metriche del percorso degli ordini, esposte su /metrics
+order_span_ms = registry.histogram(
+    'mrc_hub_order_span_ms', "Durata delle fasi di un'operazione sul server centrale, in millisecondi", ('operation', 'span')
+)
+agent_latency_ms = registry.histogram(
+    'mrc_hub_agent_latency_ms', "Tempo di andata e ritorno di un ordine verso l'agente, in millisecondi", ('operation', 'role')
+)
+agent_overhead_ms = registry.histogram(
+    'mrc_hub_agent_overhead_ms', "Andata e ritorno verso l'agente escluso il tempo sull'agente (rete e HTTP), in millisecondi",
+    ('operation', 'role')
+)
+order_results = registry.counter(
+    'mrc_hub_orders_total', 'Ordini inviati agli agenti per esito', ('operation', 'role', 'result')
+)
+order_retcodes = registry.counter(
+    'mrc_hub_order_retcodes_total', 'Retcode finali degli ordini inviati agli agenti', ('operation', 'role', 'retcode')
+)
+
+# Registra le fasi di un'operazione e, per ogni ordine inviato (master o slave secondo
+# roles), latenza, tempo di rete, esito e retcode
+def record_order_metrics(operation, timings, results=(), roles=()):
+    for span, value in timings.to_dict().items():
+        order_span_ms.observe(value, operation=operation, span=span)
+    
+    for result, role in zip(results, roles):
+        if result.get('queued'):
+            order_results.inc(operation=operation, role=role, result='queued')
+            continue
+        order_results.inc(operation=operation, role=role, result='success' if result['success'] else 'failed')
+        agent_latency_ms.observe(result['latency_ms'], operation=operation, role=role)
+        
+        data = result.get('result') or {}
+        agent_total = (data.get('timings') or {}).get('total')
+        if agent_total is not None:
+            agent_overhead_ms.observe(max(result['latency_ms'] - agent_total, 0.0), operation=operation, role=role)
+        
+        attempts = (data.get('execution') or {}).get('attempts') or data.get('attempts') or []
+        retcode = data.get('retcode', attempts[-1]['retcode'] if attempts else None)
+        if retcode is not None:
+            order_retcodes.inc(operation=operation, role=role, retcode=retcode)
+
+# Prepara le operazioni e gli ordini per gli slave di un master
+def build_slave_orders(master_key, trade):
+    slave_operations = []
+    orders = []
+    
+    is_limit_order = trade.get('limit_price') is not None
+    master_config = master_slave_config[master_key]
+    
+    # Slave a cui copiare il simbolo, con il simbolo di ognuno, dalle regole compilate
+    # al salvataggio della configurazione (filtri e mappature già applicati)
+    slaves = []
+    for rule, slave_symbol in config_index.rules_of(master_key).routes(trade['symbol']):
+        slave_account = find_account(rule.server_id, rule.account_id)
+        if slave_account is None:
+            logger.warning(f"Account slave {rule.account_id} non trovato, operazione ignorata")
+            continue
+        slaves.append((rule, slave_account, slave_symbol))
+    
+    # Con size_mode equity_ratio servono le equity attuali di master e slave: uno slave
+    # senza equity disponibile non viene copiato, invece di ricevere il volume del master
+    master_account = find_account(master_config['master_server_id'], master_config['master_account_id'])
+    equity_indexes = [i for i, (rule, _, _) in enumerate(slaves) if rule.size_mode == SIZE_MODE_EQUITY_RATIO]
+    equities = [None] * len(slaves)
+    master_equity = None
+    if equity_indexes and master_account is not None:
+        fetched = account_equities(
+            [(master_config['master_server_id'], master_account)]
+            + [(slaves[i][0].server_id, slaves[i][1]) for i in equity_indexes]
+        )
+        master_equity = fetched[0]
+        for i, equity in zip(equity_indexes, fetched[1:]):
+            equities[i] = equity
+    
+    skipped_operations = []
+    sized = []
+    for i, (rule, slave_account, slave_symbol) in enumerate(slaves):
+        if rule.size_mode == SIZE_MODE_EQUITY_RATIO and (master_equity is None or equities[i] is None):
+            logger.warning(f"Equity non disponibile per lo slave {rule.account_id}, operazione ignorata")
+            skipped_operations.append({
+                "server_id": rule.server_id,
+                "account_id": rule.account_id,
+                "symbol": slave_symbol,
+                "success": False,
+                "message": "Equity del master o dello slave non disponibile: volume non calcolabile",
+                "result": None,
+                "latency_ms": 0,
+                "delivered": False
+            })
+            continue
+        sized.append(((rule, slave_account, slave_symbol), equities[i]))
+    
+    # Calcola i volumi di tutti gli slave in un unico passaggio, arrotondati ai limiti
+    # del simbolo di ogni slave
+    slaves = [entry for entry, _ in sized]
+    volumes = compute_slave_volumes(trade['volume'], master_equity, [
+        {
+            'size_mode': rule.size_mode,
+            'size_ratio': rule.size_ratio,
+            'fixed_volume': rule.fixed_volume,
+            'max_volume': rule.max_volume,
+            'equity': equity,
+            'constraints': symbol_constraints.get(
+                rule.server_id,
+                servers[rule.server_id]['url'],
+                slave_account['account_number'],
+                slave_symbol
+            )
+        }
+        for (rule, slave_account, slave_symbol), equity in sized
+    ])
+    
+    for (rule, slave_account, slave_symbol), slave_volume in zip(slaves, volumes):
+        if slave_volume == 0:
+            logger.warning(f"Volume per lo slave {rule.account_id} inferiore al lotto minimo, operazione ignorata")
+            continue
+        
+        slave_type = rule.order_type(trade['type'])
+        slave_sl = trade.get('sl') if rule.copy_sl_tp else None
+        slave_tp = trade.get('tp') if rule.copy_sl_tp else None
+        
+        # Determina se usare un ordine limite o market per lo slave
+        # Se il master usa un ordine limite, lo slave proverà a usare un ordine limite
+        # ma se non riesce, userà un ordine market come fallback
+        slave_limit_price = trade.get('limit_price')
+        
+        slave_operations.append({
+            "id": str(uuid.uuid4()),
+            "server_id": rule.server_id,
+            "account_id": rule.account_id,
+            "symbol": slave_symbol,
+            "type": slave_type,
+            "volume": slave_volume,
+            "sl": slave_sl,
+            "tp": slave_tp,
+            "is_limit_order": is_limit_order,
+            "limit_price": slave_limit_price,
+            "fallback_to_market": True  # Indica che lo slave deve usare un ordine market come fallback
+        })
+        orders.append({
+            "server_id": rule.server_id,
+            "account_id": rule.account_id,
+            "url": servers[rule.server_id]['url'],
+            "idempotency_key": uuid.uuid4().hex[:16],
+            "copy_sl_tp": rule.copy_sl_tp,
+            "payload": {
+                "account_number": slave_account['account_number'],
+                "symbol": slave_symbol,
+                "type": slave_type,
+                "volume": slave_volume,
+                "sl": slave_sl,
+                "tp": slave_tp,
+                # Punti di cui l'agente sposta SL e TP, con il punto del simbolo dello slave
+                "sl_tp_offset_points": rule.sl_tp_offset_points if rule.copy_sl_tp else 0,
+                "limit_price": slave_limit_price,
+                "fallback_to_market": True,
+                # Prezzo del master per il controllo dello slippage (solo nella stessa direzione)
+                "reference_price": trade.get('reference_price') if not rule.opposite else None,
+                # Eventuali limiti di esecuzione specifici dello slave (deviation,
+                # max_retry_ms, max_attempts, max_slippage_points)
+                "execution": rule.execution
+            }
+        })
+    
+    return slave_operations, orders, skipped_operations
+
+# Registra i collegamenti tra la posizione del master e quelle che gli ordini degli slave
+# apriranno: i ticket degli slave arrivano con gli esiti degli ordini
+def link_slave_orders(group_id, server_id, account_id, master_ticket, orders):
+    position_links.add(group_id, server_id, account_id, master_ticket, [
+        {
+            'server_id': order['server_id'],
+            'account_id': order['account_id'],
+            'idempotency_key': order['idempotency_key'],
+            'volume': order['payload']['volume'],
+            'copy_sl_tp': order['copy_sl_tp']
+        }
+        for order in orders
+    ])
+
+# Prepara gli ordini di chiusura (totale, o parziale con close_ratio) o di modifica SL/TP
+# per le posizioni degli slave collegate a una posizione del master
+def build_link_orders(links, action, close_ratio=None, sl=None, tp=None):
+    orders = []
+    for link in links:
+        if action == 'modify' and not link['copy_sl_tp']:
+            continue
+        
+        slave_account = find_account(link['slave_server_id'], link['slave_account_id'])
+        if slave_account is None:
+            logger.warning(f"Account slave {link['slave_account_id']} non trovato, operazione ignorata")
+            continue
+        
+        payload = {
+            "action": action,
+            "account_number": slave_account['account_number'],
+            "position_id": link['slave_ticket']
+        }
+        if action == 'close' and close_ratio is not None:
+            payload['volume'] = link['volume'] * close_ratio
+        if action == 'modify':
+            payload.update(sl=sl, tp=tp)
+            rules = config_index.rules_of(f"{link['master_server_id']}_{link['master_account_id']}")
+            rule = rules.slave(link['slave_server_id'], link['slave_account_id']) if rules is not None else None
+            if rule is not None and rule.sl_tp_offset_points:
+                payload['sl_tp_offset_points'] = rule.sl_tp_offset_points
+        
+        orders.append({
+            "server_id": link['slave_server_id'],
+            "account_id": link['slave_account_id'],
+            "url": servers[link['slave_server_id']]['url'],
+            "payload": payload,
+            "link": link
+        })
+    return orders
+
+# Propaga agli slave la chiusura (closed), la chiusura parziale (close_ratio) o la modifica
+# di SL/TP (sl_tp) di una posizione del master, con un unico dispatch parallelo.
+# Restituisce le operazioni eseguite sugli slave.
+def propagate_position_change(server_id, account_id, ticket, closed=False, close_ratio=None, sl_tp=None):
+    timings = Timings()
+    with timings.span('build_orders'):
+        if closed:
+            links = position_links.take_open(server_id, account_id, ticket)
+            # Slave non ancora aperti: gli ordini mai inviati vengono annullati, quelli
+            # già inviati vengono chiusi da record_slave_fill quando arriva l'esito
+            pending_keys = [link['idempotency_key'] for link in links if link['slave_ticket'] is None]
+            if pending_keys:
+                cancelled = replication_queue.cancel(pending_keys)
+                logger.info(
+                    f"Posizione {ticket} del master {server_id}_{account_id} chiusa con {len(pending_keys)} "
+                    f"slave in attesa di apertura ({len(cancelled)} ordini annullati)"
+                )
+            links = [link for link in links if link['slave_ticket'] is not None]
+            orders = build_link_orders(links, 'close')
+        else:
+            links = position_links.find(server_id, account_id, ticket)
+            orders = []
+            if close_ratio:
+                orders.extend(build_link_orders(links, 'close', close_ratio=close_ratio))
+            if sl_tp is not None:
+                orders.extend(build_link_orders(links, 'modify', sl=sl_tp[0], tp=sl_tp[1]))
+    
+    if not orders:
+        if closed and links:
+            # Slave non più registrati: non resta nulla da chiudere
+            position_links.set_status([link['id'] for link in links], LINK_CLOSED)
+        return []
+    
+    with timings.span('dispatch'):
+        results = dispatch_orders(orders)
+    record_order_metrics('close' if closed else 'update', timings, results, ['slave'] * len(orders))
+    
+    slave_operations = []
+    reopen = []
+    for order, result in zip(orders, results):
+        link = order['link']
+        action = order['payload']['action']
+        if action == 'close' and closed and not result['success']:
+            # La posizione dello slave è ancora aperta: il collegamento resta valido
+            reopen.append(link['id'])
+        elif action == 'close' and result['success'] and result['result']:
+            position_links.reduce_volume(link['id'], result['result']['volume'])
+        
+        slave_operations.append(dict(
+            result,
+            action=action,
+            server_id=link['slave_server_id'],
+            account_id=link['slave_account_id'],
+            ticket=link['slave_ticket']
+        ))
+    
+    if closed:
+        reopened = set(reopen)
+        position_links.set_status([link['id'] for link in links if link['id'] not in reopened], LINK_CLOSED)
+    if reopen:
+        position_links.set_status(reopen, LINK_OPEN)
+    
+    return slave_operations
+
 # API per aprire una posizione su un account (supporta ordini limite)
 @app.route('/api/servers/<server_id>/accounts/<account_id>/positions', methods=['POST'])
 @auth.login_required
 def open_position(server_id, account_id):
+    timings = Timings()
     if server_id not in servers:
         return jsonify({"error": "Server non trovato"}), 404
     
-    account_exists = False
-    for account in servers[server_id].get('accounts', []):
-        if account['id'] == account_id:
-            account_exists = True
-            break
-    
-    if not account_exists:
+    master_account = find_account(server_id, account_id)
+    if master_account is None:
         return jsonify({"error": "Account non trovato"}), 404
     
-    data = request.json
+    with timings.span('parse'):
+        data = request.json
     if not data or not all(k in data for k in ['symbol', 'type', 'volume']):
         return jsonify({"error": "Dati mancanti"}), 400
     
     # Verifica se è un ordine limite o market
     is_limit_order = 'limit_price' in data and data['limit_price'] is not None
     
-    # Qui dovresti inviare la richiesta all'agente MetaTrader sul server specificato
-    # Per ora, simuliamo una risposta di successo
-    
     position_id = str(uuid.uuid4())
     response = {
         "id": position_id,
@@ -366,64 +843,697 @@ def open_position(server_id, account_id):
         }
     }
     
+    # Ordine del master, con una chiave di idempotenza registrata prima dell'invio: se la
+    # risposta dell'agente va persa (timeout) la posizione viene replicata dallo stream
+    master_idempotency_key = uuid.uuid4().hex[:16]
+    position_links.add_master_open(master_idempotency_key, server_id, account_id)
+    orders = [{
+        "server_id": server_id,
+        "url": servers[server_id]['url'],
+        "payload": {
+            "account_number": master_account['account_number'],
+            "symbol": data['symbol'],
+            "type": data['type'],
+            "volume": data['volume'],
+            "sl": data.get('sl'),
+            "tp": data.get('tp'),
+            "limit_price": data.get('limit_price'),
+            "fallback_to_market": data.get('fallback_to_market', False),
+            "idempotency_key": master_idempotency_key
+        }
+    }]
+    
+    # Invia prima l'ordine del master: gli slave vengono aperti solo se il master è
+    # stato eseguito, altrimenti resterebbero posizioni sugli slave senza una posizione
+    # del master a cui collegarle
+    with timings.span('dispatch_master'):
+        master_result = dispatch_orders(orders)[0]
+    
+    response["success"] = master_result['success']
+    response["result"] = master_result['result']
+    response["latency_ms"] = master_result['latency_ms']
+    if not master_result['success']:
+        response["message"] = master_result['message']
+    
     # Se questo è un account master, propaga l'operazione agli slave
     master_key = f"{server_id}_{account_id}"
+    results = [master_result]
     if master_key in master_slave_config:
-        slaves = master_slave_config[master_key].get('slaves', [])
         slave_operations = []
-        
-        for slave in slaves:
-            slave_server_id = slave['server_id']
-            slave_account_id = slave['account_id']
-            size_ratio = slave['size_ratio']
-            direction = slave['direction']
-            use_sl_tp = slave['use_sl_tp']
-            
-            # Calcola il volume per lo slave
-            slave_volume = data['volume'] * size_ratio
-            
-            # Determina il tipo di operazione in base alla direzione
-            slave_type = data['type']
-            if direction == 'opposite':
-                if slave_type == 'buy':
-                    slave_type = 'sell'
-                elif slave_type == 'sell':
-                    slave_type = 'buy'
+        if (master_result['success'] and master_result['result']
+                and position_links.claim_master_open(master_idempotency_key, server_id, account_id)):
+            with timings.span('build_orders'):
+                # Lo slippage degli slave si misura dal prezzo di esecuzione del master
+                trade = dict(data, reference_price=master_result['result'].get('price') or None)
+                slave_operations, slave_orders, skipped_operations = build_slave_orders(master_key, trade)
+                # Il ticket della posizione coincide con quello dell'ordine che l'ha aperta
+                link_slave_orders(position_id, server_id, account_id, master_result['result']['order'], slave_orders)
             
-            # Prepara i parametri SL/TP se necessario
-            slave_sl = data.get('sl') if use_sl_tp else None
-            slave_tp = data.get('tp') if use_sl_tp else None
-            
-            # Determina se usare un ordine limite o market per lo slave
-            # Se il master usa un ordine limite, lo slave proverà a usare un ordine limite
-            # ma se non riesce, userà un ordine market come fallback
-            slave_is_limit_order = is_limit_order
-            slave_limit_price = data.get('limit_price')
-            
-            # Qui dovresti inviare la richiesta all'agente MetaTrader sul server dello slave
-            # Per ora, simuliamo una risposta di successo
-            
-            slave_position_id = str(uuid.uuid4())
-            slave_operation = {
-                "id": slave_position_id,
-                "server_id": slave_server_id,
-                "account_id": slave_account_id,
-                "symbol": data['symbol'],
-                "type": slave_type,
-                "volume": slave_volume,
-                "sl": slave_sl,
-                "tp": slave_tp,
-                "is_limit_order": slave_is_limit_order,
-                "limit_price": slave_limit_price,
-                "fallback_to_market": True  # Indica che lo slave deve usare un ordine market come fallback
-            }
-            
-            slave_operations.append(slave_operation)
+            # Gli ordini degli slave passano dalla coda persistente, che li ritenta se
+            # l'agente non risponde
+            with timings.span('dispatch'):
+                slave_results = replication_queue.submit(slave_orders)
+            for slave_operation, slave_result in zip(slave_operations, slave_results):
+                slave_operation.update(slave_result)
+            results.extend(slave_results)
+            slave_operations.extend(skipped_operations)
         
         response["slave_operations"] = slave_operations
+        response["fanout_latency_ms"] = round(sum(
+            max((r['latency_ms'] for r in group), default=0) for group in (results[:1], results[1:])
+        ), 2)
     
+    record_order_metrics('open', timings, results, ['master'] + ['slave'] * (len(results) - 1))
+    response["timings"] = timings.to_dict()
     return jsonify(response)
 
+# Gestisce un evento sulle posizioni ricevuto dallo stream di un agente
+def handle_position_event(server_id, event):
+    position = event.get('position') or {}
+    
+    # Aggiorna subito lo snapshot della flotta per le dashboard collegate
+    fleet_poller.request_refresh()
+    
+    if server_id not in servers:
+        return
+    
+    master_account = config_index.find_account_by_number(server_id, event.get('login'))
+    if master_account is None:
+        return
+    
+    if event.get('event') in ('close', 'modify'):
+        propagate_master_event(server_id, master_account['id'], event)
+        return
+    
+    master_key = f"{server_id}_{master_account['id']}"
+    if master_key not in master_slave_config:
+        return
+    
+    # Le posizioni aperte dal server centrale vengono replicate da open_position; lo
+    # stream le replica solo se, trascorso MASTER_OPEN_GRACE, nessuno le ha prese in
+    # carico (risposta dell'agente persa). Quelle senza un'apertura del master
+    # registrata (es. posizioni di un account che è anche slave) vengono ignorate.
+    if position.get('magic') == AGENT_MAGIC:
+        idempotency_key = idempotency_key_from_comment(position.get('comment'))
+        if idempotency_key is not None:
+            timer = threading.Timer(
+                MASTER_OPEN_GRACE, replicate_unclaimed_master_open,
+                args=(server_id, master_account['id'], idempotency_key, position)
+            )
+            timer.daemon = True
+            timer.start()
+        return
+    
+    replicate_master_position(server_id, master_account['id'], position)
+
+# Replica un'apertura del master inviata dal server centrale la cui risposta non è
+# arrivata a open_position (es. timeout dell'agente dopo l'esecuzione dell'ordine)
+def replicate_unclaimed_master_open(server_id, account_id, idempotency_key, position):
+    try:
+        if not position_links.claim_master_open(idempotency_key, server_id, account_id):
+            return
+        logger.warning(
+            f"Apertura {idempotency_key} del master {server_id}_{account_id} non replicata da open_position, "
+            f"replica dalla posizione {position['ticket']}"
+        )
+        replicate_master_position(server_id, account_id, position)
+    except Exception as e:
+        logger.error(f"Errore nella replica della posizione {position.get('ticket')}: {e}")
+
+# Replica sugli slave una posizione aperta sul master
+def replicate_master_position(server_id, account_id, position):
+    master_key = f"{server_id}_{account_id}"
+    if master_key not in master_slave_config:
+        return
+    
+    timings = Timings()
+    trade = {
+        "symbol": position['symbol'],
+        "type": 'buy' if position['type'] == POSITION_TYPE_BUY else 'sell',
+        "volume": position['volume'],
+        "sl": position.get('sl') or None,
+        "tp": position.get('tp') or None,
+        "limit_price": None,
+        "reference_price": position.get('price_open')
+    }
+    
+    with timings.span('build_orders'):
+        slave_operations, orders, skipped_operations = build_slave_orders(master_key, trade)
+        link_slave_orders(str(uuid.uuid4()), server_id, account_id, position['ticket'], orders)
+    with timings.span('dispatch'):
+        results = replication_queue.submit(orders)
+    record_order_metrics('replicate', timings, results, ['slave'] * len(results))
+    
+    failed = sum(1 for r in results if not r['success'])
+    queued = sum(1 for r in results if r.get('queued'))
+    slowest = max((r['latency_ms'] for r in results), default=0)
+    logger.info(
+        f"Posizione {position['ticket']} del master {master_key} replicata su {len(results) - failed}/{len(results)} "
+        f"slave in {slowest} ms ({queued} in coda, {len(skipped_operations)} ignorati per equity non disponibile)"
+    )
+
+# Propaga agli slave collegati la chiusura, la chiusura parziale o la modifica di SL/TP
+# di una posizione del master rilevata dallo stream dell'agente
+def propagate_master_event(server_id, account_id, event):
+    position = event['position']
+    if event['event'] == 'close':
+        slave_operations = propagate_position_change(server_id, account_id, position['ticket'], closed=True)
+    else:
+        previous = event.get('previous') or {}
+        close_ratio = None
+        if previous.get('volume') and position['volume'] < previous['volume']:
+            close_ratio = (previous['volume'] - position['volume']) / previous['volume']
+        sl_tp = None
+        if (position.get('sl'), position.get('tp')) != (previous.get('sl'), previous.get('tp')):
+            sl_tp = (position.get('sl'), position.get('tp'))
+        slave_operations = propagate_position_change(
+            server_id, account_id, position['ticket'], close_ratio=close_ratio, sl_tp=sl_tp
+        )
+    
+    if slave_operations:
+        failed = sum(1 for op in slave_operations if not op['success'])
+        slowest = max(op['latency_ms'] for op in slave_operations)
+        logger.info(
+            f"Evento {event['event']} sulla posizione {position['ticket']} del master {server_id}_{account_id} propagato "
+            f"a {len(slave_operations) - failed}/{len(slave_operations)} posizioni slave in {slowest} ms"
+        )
+
+# URL attuale dell'agente di un server, per la consegna degli ordini in coda
+def resolve_server_url(server_id):
+    server = servers.get(server_id)
+    return server['url'] if server is not None else None
+
+# Coda persistente degli ordini destinati agli slave e collegamenti tra le posizioni del
+# master e quelle degli slave (nello stesso database)
+replication_queue = ReplicationQueue(REPLICATION_DB, resolve_server_url)
+position_links = PositionLinks(REPLICATION_DB)
+
+# Registra il ticket della posizione aperta su uno slave. Se nel frattempo la posizione
+# del master è stata chiusa, la posizione dello slave viene chiusa subito, passando dalla
+# coda di replica (dietro all'apertura, con nuovi tentativi se l'agente non risponde).
+def record_slave_fill(idempotency_key, result):
+    link = position_links.record_fill(idempotency_key, result)
+    if link is None or link['status'] != LINK_CLOSED:
+        return
+    
+    logger.warning(
+        f"Posizione {link['slave_ticket']} dello slave {link['slave_server_id']}/{link['slave_account_id']} aperta "
+        f"dopo la chiusura della posizione {link['master_ticket']} del master, chiusura"
+    )
+    results = replication_queue.submit(build_link_orders([link], 'close'))
+    for result in results:
+        if not result['success'] and not result.get('queued'):
+            logger.error(
+                f"Chiusura della posizione {link['slave_ticket']} dello slave {link['slave_server_id']}/"
+                f"{link['slave_account_id']} fallita: {result['message']}"
+            )
+
+replication_queue.add_listener(record_slave_fill)
+
+# Allinea gli stream di eventi ai server registrati (gestiti da questo processo). Nei
+# worker API non ci sono stream: i worker di replica rilevano la modifica della configurazione.
+def sync_position_streams():
+    if HUB_ROLE == HUB_ROLE_API:
+        return
+    position_streams.sync(
+        {server_id: server['url'] for server_id, server in servers.items() if owns_server(server_id)},
+        handle_position_event
+    )
+
+# Restituisce il client dell'agente di un server
+def get_agent_client(server_id):
+    return agent_clients.get(server_id, servers[server_id]['url'])
+
+# API per ottenere le informazioni live di un account dall'agente
+@app.route('/api/servers/<server_id>/accounts/<account_id>/info', methods=['GET'])
+@auth.login_required
+def get_account_info(server_id, account_id):
+    if server_id not in servers:
+        return jsonify({"error": "Server non trovato"}), 404
+    
+    account = find_account(server_id, account_id)
+    if account is None:
+        return jsonify({"error": "Account non trovato"}), 404
+    
+    success, message, data = get_agent_client(server_id).get_account(account['account_number'])
+    if not success:
+        return jsonify({"success": False, "message": message}), 502
+    
+    # Aggiorna i dati live dell'account
+    account['status'] = 'online'
+    account['balance'] = data.get('balance', account.get('balance', 0))
+    account['equity'] = data.get('equity', account.get('equity', 0))
+    
+    return jsonify({"success": True, "data": data})
+
+# API per ottenere le posizioni aperte di un account dall'agente
+# (formato della risposta negoziato con il parametro format o l'header Accept)
+@app.route('/api/servers/<server_id>/accounts/<account_id>/positions', methods=['GET'])
+@auth.login_required
+def get_positions(server_id, account_id):
+    if server_id not in servers:
+        return jsonify({"error": "Server non trovato"}), 404
+    
+    wire_format = negotiate_format(request.args, request.headers)
+    if wire_format is None:
+        return unsupported_format_response()
+    
+    account = find_account(server_id, account_id)
+    if account is None:
+        return jsonify({"error": "Account non trovato"}), 404
+    
+    success, message, data = get_agent_client(server_id).get_positions(account['account_number'])
+    if not success:
+        return jsonify({"success": False, "message": message}), 502
+    
+    account['positions'] = data
+    return wire_response(data, wire_format=wire_format)
+
+# API per ottenere la cronologia delle operazioni di un account dall'agente.
+# La cronologia viene sempre richiesta all'agente per colonne e convertita solo se il
+# client chiede il formato a righe.
+@app.route('/api/servers/<server_id>/accounts/<account_id>/history', methods=['GET'])
+@auth.login_required
+def get_history(server_id, account_id):
+    if server_id not in servers:
+        return jsonify({"error": "Server non trovato"}), 404
+    
+    account = find_account(server_id, account_id)
+    if account is None:
+        return jsonify({"error": "Account non trovato"}), 404
+    
+    wire_format = negotiate_format(request.args, request.headers)
+    if wire_format is None:
+        return unsupported_format_response()
+    
+    days = request.args.get('days', default=7, type=int)
+    success, message, data = get_agent_client(server_id).get_history(account['account_number'], days, columnar=True)
+    if not success:
+        return jsonify({"success": False, "message": message}), 502
+    
+    return wire_response(data, wire_format=wire_format)
+
 # API per chiudere una posizione su un account
-@app.route('/api/servers/<server_id>/accounts/<account_id>/pos
-(Content truncated due to size limit. Use line ranges to read in chunks)
\ No newline at end of file
+# (e le posizioni degli slave collegate, dopo la chiusura del master)
+@app.route('/api/servers/<server_id>/accounts/<account_id>/positions/<int:position_id>', methods=['DELETE'])
+@auth.login_required
+def close_position(server_id, account_id, position_id):
+    if server_id not in servers:
+        return jsonify({"error": "Server non trovato"}), 404
+    
+    account = find_account(server_id, account_id)
+    if account is None:
+        return jsonify({"error": "Account non trovato"}), 404
+    
+    master_order = {
+        "server_id": server_id,
+        "url": servers[server_id]['url'],
+        "payload": {
+            "action": "close",
+            "account_number": account['account_number'],
+            "position_id": position_id
+        }
+    }
+    # Chiude prima il master: se la chiusura fallisce la posizione del master resta
+    # aperta, e con essa quelle degli slave e i relativi collegamenti
+    timings = Timings()
+    with timings.span('dispatch_master'):
+        master_result = dispatch_orders([master_order])[0]
+    record_order_metrics('close', timings, [master_result], ['master'])
+    if not master_result['success']:
+        return jsonify({"success": False, "message": master_result['message'], "slave_operations": []}), 502
+    
+    slave_operations = propagate_position_change(server_id, account_id, position_id, closed=True)
+    
+    return jsonify({
+        "success": True,
+        "message": master_result['message'],
+        "result": master_result['result'],
+        "slave_operations": slave_operations,
+        "details": {
+            "server_id": server_id,
+            "account_id": account_id,
+            "position_id": position_id
+        }
+    })
+
+# API per le posizioni degli slave ancora aperte collegate a una posizione del master
+@app.route('/api/servers/<server_id>/accounts/<account_id>/positions/<int:position_id>/links', methods=['GET'])
+@auth.login_required
+def get_position_links(server_id, account_id, position_id):
+    if find_account(server_id, account_id) is None:
+        return jsonify({"error": "Account non trovato"}), 404
+    
+    return jsonify(position_links.find(server_id, account_id, position_id))
+
+# API per chiudere più posizioni di un account con un'unica richiesta all'agente
+# (tutte le posizioni aperte se tickets non è indicato)
+@app.route('/api/servers/<server_id>/accounts/<account_id>/positions/close-batch', methods=['POST'])
+@auth.login_required
+def close_positions_batch(server_id, account_id):
+    if server_id not in servers:
+        return jsonify({"error": "Server non trovato"}), 404
+    
+    account = find_account(server_id, account_id)
+    if account is None:
+        return jsonify({"error": "Account non trovato"}), 404
+    
+    client = get_agent_client(server_id)
+    tickets = (request.json or {}).get('tickets')
+    if tickets is None:
+        success, message, positions = client.get_positions(account['account_number'])
+        if not success:
+            return jsonify({"success": False, "message": message}), 502
+        tickets = [position['ticket'] for position in positions]
+    
+    if not tickets:
+        return jsonify({"success": True, "message": "Nessuna posizione da chiudere", "results": []})
+    
+    success, message, data = client.close_positions(tickets, account['account_number'])
+    if not success:
+        return jsonify({"success": False, "message": message}), 502
+    
+    return jsonify({
+        "success": all(r['success'] for r in data),
+        "message": message,
+        "results": data
+    })
+
+# Aggiorna lo stato di un server quando l'heartbeat rileva un cambiamento
+def set_server_status(server_id, status):
+    server = servers.get(server_id)
+    if server is None:
+        return
+    server['status'] = status
+    publish_event({"event": "server", "server_id": server_id, "status": status})
+
+# Heartbeat degli agenti di tutti i server registrati, con circuit breaker
+agent_health = AgentHealthMonitor(
+    lambda: {server_id: server['url'] for server_id, server in list(servers.items()) if owns_server(server_id)},
+    set_server_status
+)
+
+# API per lo stato degli agenti: ultimo heartbeat, percentili di latenza e circuit breaker
+@app.route('/api/agents/health', methods=['GET'])
+@auth.login_required
+def get_agent_health():
+    return jsonify(agent_health_status())
+
+# Elenco degli account da interrogare per lo snapshot della flotta
+def list_fleet_targets():
+    return [
+        {
+            'server_id': server_id,
+            'url': server['url'],
+            'account_id': account['id'],
+            'account_number': account['account_number']
+        }
+        for server_id, server in list(servers.items())
+        for account in list(server.get('accounts', []))
+    ]
+
+# Snapshot della flotta condiviso da tutte le dashboard. Su più processi lo calcolano i
+# worker di replica, ognuno per gli account dei propri server, e lo pubblicano ai worker
+# API, che non interrogano gli agenti: il carico sugli agenti non cresce con i worker.
+fleet_poller = FleetPoller(lambda: [target for target in list_fleet_targets() if owns_server(target['server_id'])])
+
+# Attesa massima di uno snapshot aggiornato dai worker di replica quando il polling era
+# sospeso, in secondi
+FLEET_SNAPSHOT_WAIT = 2.0
+# Ultima segnalazione di interesse per lo snapshot e ultimi account letti dai worker API
+fleet_demand_at = 0.0
+fleet_accounts_cache = (0.0, {'generated_at': None, 'accounts': {}})
+
+# Nei worker API segnala ai worker di replica che lo snapshot è richiesto (al massimo
+# una volta al secondo): il polling resta attivo finché ci sono richieste
+def touch_fleet():
+    global fleet_demand_at
+    if HUB_ROLE != HUB_ROLE_API:
+        fleet_poller.touch()
+        return
+    now = time.time()
+    if now - fleet_demand_at >= 1.0:
+        fleet_demand_at = now
+        hub_state.put('fleet_demand', now)
+
+# Parti dello snapshot pubblicate dai worker di replica
+def shared_fleet_parts():
+    snapshots = hub_state.snapshots('fleet')
+    return [snapshots[f"fleet.{index}"] for index in range(REPLICATION_WORKERS) if f"fleet.{index}" in snapshots]
+
+# Unisce le parti dello snapshot dei worker di replica
+def merge_fleet_parts(parts):
+    accounts = {}
+    for part in parts:
+        accounts.update(part['accounts'])
+    return {
+        'generated_at': min((part['generated_at'] for part in parts), default=None),
+        'accounts': accounts
+    }
+
+# Snapshot della flotta. Nei worker API, se il polling era sospeso, attende brevemente
+# il primo snapshot aggiornato dai worker di replica.
+def fleet_snapshot():
+    if HUB_ROLE != HUB_ROLE_API:
+        return fleet_poller.snapshot()
+    
+    touch_fleet()
+    deadline = time.monotonic() + FLEET_SNAPSHOT_WAIT
+    while True:
+        parts = shared_fleet_parts()
+        fresh = len(parts) == REPLICATION_WORKERS and all(
+            part['generated_at'] is not None and time.time() - part['generated_at'] <= FLEET_CACHE_TTL
+            for part in parts
+        )
+        if fresh or time.monotonic() >= deadline:
+            return merge_fleet_parts(parts)
+        time.sleep(HUB_EVENT_POLL_INTERVAL)
+
+# Ultimo stato di un account nello snapshot della flotta, senza avviare il polling (nei
+# worker API dall'ultimo snapshot pubblicato, letto al massimo una volta per intervallo).
+# None se lo snapshot non è aggiornato da più di FLEET_CACHE_TTL (polling sospeso).
+def fleet_account(account_id):
+    global fleet_accounts_cache
+    if HUB_ROLE != HUB_ROLE_API:
+        return fleet_poller.get_account(account_id, max_age=FLEET_CACHE_TTL)
+    read_at, snapshot = fleet_accounts_cache
+    if time.monotonic() - read_at > FLEET_POLL_INTERVAL:
+        snapshot = merge_fleet_parts(shared_fleet_parts())
+        fleet_accounts_cache = (time.monotonic(), snapshot)
+    generated_at = snapshot.get('generated_at')
+    if generated_at is None or time.time() - generated_at > FLEET_CACHE_TTL:
+        return None
+    return snapshot['accounts'].get(account_id)
+
+# API per ottenere saldo, equity e posizioni di tutti gli account in un'unica risposta
+@app.route('/api/fleet', methods=['GET'])
+@auth.login_required
+def get_fleet():
+    return jsonify(fleet_snapshot())
+
+# Configurazione delle statistiche di portafoglio aggregate
+ANALYTICS_MAX_WORKERS = int(os.environ.get('ANALYTICS_MAX_WORKERS', 16))
+# Timeout di risposta degli agenti: la prima richiesta può scaricare molta cronologia
+ANALYTICS_TIMEOUT = float(os.environ.get('ANALYTICS_TIMEOUT', 60.0))
+# Punti della curva dei profitti di ogni account nella risposta aggregata
+ANALYTICS_CURVE_POINTS = 100
+
+analytics_executor = ThreadPoolExecutor(max_workers=ANALYTICS_MAX_WORKERS, thread_name_prefix='analytics')
+
+# Statistiche di portafoglio di un account dal suo agente
+def fetch_account_analytics(target, curve_points):
+    client = agent_clients.get(target['server_id'], target['url'])
+    return client.get_analytics(
+        target['account_number'],
+        curve_points,
+        timeout=(agent_clients.default_timeout[0], ANALYTICS_TIMEOUT)
+    )
+
+# API per le statistiche di portafoglio (drawdown, win rate, profit factor, profitti per
+# simbolo e magic number) di tutti gli account, o di quelli di un server o di un account
+# indicati con server_id e account_id, interrogando gli agenti in parallelo
+@app.route('/api/analytics', methods=['GET'])
+@auth.login_required
+def get_analytics():
+    server_id = request.args.get('server_id')
+    account_id = request.args.get('account_id')
+    curve_points = max(0, request.args.get('curve_points', default=ANALYTICS_CURVE_POINTS, type=int))
+    
+    targets = [
+        target for target in list_fleet_targets()
+        if (server_id is None or target['server_id'] == server_id)
+        and (account_id is None or target['account_id'] == account_id)
+    ]
+    if (server_id is not None or account_id is not None) and not targets:
+        return jsonify({"error": "Account non trovato"}), 404
+    
+    results = analytics_executor.map(lambda target: fetch_account_analytics(target, curve_points), targets)
+    
+    accounts = {}
+    errors = {}
+    for target, (success, message, data) in zip(targets, results):
+        if success:
+            accounts[target['account_id']] = dict(data, server_id=target['server_id'], account_number=target['account_number'])
+        else:
+            errors[target['account_id']] = message
+    
+    return jsonify({
+        "success": True,
+        "data": {
+            "summary": aggregate_analytics(accounts),
+            "accounts": accounts,
+            "errors": errors
+        }
+    })
+
+# Intervallo dei messaggi di keep-alive dello stream della dashboard
+DASHBOARD_KEEPALIVE_SECONDS = 15
+# Stream della dashboard aperti al massimo da un processo: ognuno occupa un thread del
+# worker per tutta la connessione, quindi per default al massimo metà dei thread di un
+# worker API (HUB_API_THREADS), lasciando gli altri alle API. Oltre il limite lo stream
+# risponde 503 e la dashboard usa il polling.
+DASHBOARD_MAX_STREAMS = int(os.environ.get(
+    'DASHBOARD_MAX_STREAMS', max(1, int(os.environ.get('HUB_API_THREADS', 16)) // 2)
+))
+# Secondi dopo cui una dashboard respinta ritenta lo stream (header Retry-After)
+DASHBOARD_STREAM_RETRY_SECONDS = 30
+
+# Pubblica sullo stream della dashboard solo i campi cambiati di un account (dai worker
+# di replica il polling è attivo solo se ci sono richieste dai worker API)
+def publish_account_changes(account_id, previous, state):
+    if HUB_ROLE == HUB_ROLE_ALL and not live_feed.has_subscribers():
+        return
+    changes = diff_account_state(previous, state)
+    if changes:
+        publish_event({"event": "account", "account_id": account_id, "changes": changes})
+
+fleet_poller.add_listener(publish_account_changes)
+if HUB_ROLE == HUB_ROLE_REPLICATION:
+    fleet_poller.add_refresh_listener(lambda snapshot: hub_state.put(f"fleet.{REPLICATION_WORKER_INDEX}", snapshot))
+
+# Stream Server-Sent Events per la dashboard: uno snapshot iniziale e poi solo i campi
+# cambiati di account e posizioni, oltre alle modifiche della configurazione
+@app.route('/api/stream', methods=['GET'])
+@auth.login_required
+def dashboard_stream():
+    subscriber = live_feed.subscribe(limit=DASHBOARD_MAX_STREAMS)
+    if subscriber is None:
+        return jsonify({"error": "Troppi stream della dashboard aperti, usare il polling"}), 503, {
+            'Retry-After': str(DASHBOARD_STREAM_RETRY_SECONDS)
+        }
+    snapshot = fleet_snapshot()
+    
+    def stream():
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(snapshot)}\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=DASHBOARD_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    touch_fleet()
+                    yield ": keep-alive\n\n"
+                    continue
+                touch_fleet()
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            live_feed.unsubscribe(subscriber)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# API per lo stato dei pool di connessioni verso gli agenti
+@app.route('/api/agents/pool', methods=['GET'])
+@auth.login_required
+def get_agent_pool_stats():
+    return jsonify(agent_clients.stats())
+
+# API per lo stato della coda di replica verso gli slave
+@app.route('/api/replication', methods=['GET'])
+@auth.login_required
+def get_replication_stats():
+    return jsonify(replication_queue.stats())
+
+# Metriche del server centrale nel formato di Prometheus
+@app.route('/metrics', methods=['GET'])
+@auth.login_required
+def get_metrics():
+    if HUB_ROLE == HUB_ROLE_ALL:
+        return Response(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+    
+    # Con più processi le metriche sono la somma di quelle pubblicate da ogni worker
+    snapshots = hub_state.snapshots('metrics')
+    snapshots[METRICS_SNAPSHOT_NAME] = registry.snapshot()
+    return Response(registry.render_merged(snapshots.values()), content_type=PROMETHEUS_CONTENT_TYPE)
+
+# API per lo stato degli stream di eventi dagli agenti
+@app.route('/api/agents/streams', methods=['GET'])
+@auth.login_required
+def get_agent_streams():
+    if HUB_ROLE != HUB_ROLE_API:
+        return jsonify(position_streams.status())
+    status = {}
+    for worker_status in hub_state.snapshots('position_streams').values():
+        status.update(worker_status)
+    return jsonify(status)
+
+# Ciclo principale di un worker di replica: ricarica la configurazione modificata dai
+# worker API, pubblica lo stato di heartbeat e stream per le loro API e mantiene attivo
+# il polling della flotta finché i worker API ricevono richieste dello snapshot
+def run_replication_worker():
+    logger.info(f"Worker di replica {REPLICATION_WORKER_INDEX + 1}/{REPLICATION_WORKERS} avviato")
+    while True:
+        try:
+            if config_store.has_changed():
+                load_config()
+                sync_position_streams()
+            hub_state.put(f"agent_health.{REPLICATION_WORKER_INDEX}", agent_health.status())
+            hub_state.put(f"position_streams.{REPLICATION_WORKER_INDEX}", position_streams.status())
+            demand_at = hub_state.snapshots('fleet_demand').get('fleet_demand')
+            if demand_at is not None and time.time() - demand_at < FLEET_IDLE_TIMEOUT:
+                fleet_poller.touch()
+            hub_state.delete_stale('metrics', HUB_METRICS_RETENTION)
+            hub_state.purge()
+        except Exception as e:
+            logger.error(f"Errore nel worker di replica: {e}")
+        time.sleep(HUB_STATE_INTERVAL)
+
+# Allinea i circuit breaker dei client di questo processo all'heartbeat degli agenti,
+# eseguito per ogni server da un solo worker di replica e pubblicato nello stato condiviso
+def sync_agent_breakers():
+    shared = {}
+    for worker_status in hub_state.snapshots('agent_health').values():
+        for server_id, health in worker_status.items():
+            if HUB_ROLE == HUB_ROLE_REPLICATION and owns_server(server_id):
+                continue
+            shared[server_id] = {'breaker': health.get('breaker'), 'last_success_at': health.get('last_success_at')}
+    agent_clients.apply_shared_breakers(shared)
+
+# Sincronizza periodicamente questo processo con lo stato condiviso: pubblica le sue
+# metriche per /metrics degli altri worker e allinea i circuit breaker all'heartbeat
+def sync_shared_state():
+    while True:
+        try:
+            hub_state.put(METRICS_SNAPSHOT_NAME, registry.snapshot())
+            sync_agent_breakers()
+        except Exception as e:
+            logger.error(f"Errore nella sincronizzazione con lo stato condiviso: {e}")
+        time.sleep(HUB_STATE_INTERVAL)
+
+# Carica la configurazione all'avvio (anche quando l'app è servita da gunicorn). I worker
+# API non ricevono eventi dagli agenti né consegnano la coda di replica: gli ordini
+# inviati dalle loro API che non vengono consegnati subito restano in coda per i worker
+# di replica.
+load_config()
+if HUB_ROLE == HUB_ROLE_API:
+    hub_state.start_relay(handle_hub_event)
+else:
+    sync_position_streams()
+    replication_queue.start()
+    agent_health.start()
+if HUB_ROLE != HUB_ROLE_ALL:
+    threading.Thread(target=sync_shared_state, name='shared-state-sync', daemon=True).start()
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=HUB_PORT)
@@ -0,0 +1,315 @@
+# Benchmark del percorso degli ordini: avvia in locale il server centrale e N agenti
+# collegati al modulo MetaTrader5 simulato (mock_mt5) e misura, per ogni dimensione
+# della flotta, la latenza di copia master -> slave, il throughput in ordini al secondo
+# e il tempo delle interrogazioni della cronologia.
+#
+# Esempio: python benchmark.py --agents 4 --accounts 1,10,100,500 --orders 20
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MOCK_MT5_DIR = os.path.join(REPO_DIR, 'mock_mt5')
+
+BENCH_USERNAME = 'bench'
+BENCH_PASSWORD = 'bench'
+STARTUP_TIMEOUT = 30.0
+# Attesa massima perché la coda di replica consegni gli ordini rimasti in coda
+DRAIN_TIMEOUT = 120.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark di fan-out, throughput e cronologia con MT5 simulato")
+    parser.add_argument('--agents', type=int, default=4, help="numero di agenti (server MT5) da avviare")
+    parser.add_argument('--accounts', default='1,10,100,500', help="dimensioni della flotta da misurare, in account")
+    parser.add_argument('--orders', type=int, default=20, help="ordini del master per ogni misura")
+    parser.add_argument('--concurrency', type=int, default=8, help="richieste parallele nelle misure di throughput e cronologia")
+    parser.add_argument('--order-latency-ms', type=float, default=20.0, help="latenza simulata di order_send")
+    parser.add_argument('--read-latency-ms', type=float, default=0.5, help="latenza simulata delle letture dal terminale")
+    parser.add_argument('--history-deals', type=int, default=2000, help="deal negli ultimi 30 giorni di ogni terminale simulato")
+    parser.add_argument('--history-days', type=int, default=7, help="giorni di cronologia richiesti")
+    parser.add_argument('--symbol', default='EURUSD')
+    parser.add_argument('--volume', type=float, default=0.01)
+    parser.add_argument('--hub-workers', type=int, default=0,
+                        help="worker API del server centrale (gunicorn.conf.py, con un worker di replica); 0 = processo unico")
+    parser.add_argument('--hub-port', type=int, default=15000)
+    parser.add_argument('--agent-base-port', type=int, default=15001)
+    parser.add_argument('--output', help="salva i risultati in un file JSON")
+    parser.add_argument('--keep', action='store_true', help="non cancella la cartella di lavoro (database e log)")
+    return parser.parse_args()
+
+
+def percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': round(float(p50), 2), 'p95': round(float(p95), 2), 'p99': round(float(p99), 2),
+            'max': round(float(np.max(values)), 2)}
+
+
+# Processi del server centrale e degli agenti, con database e log in una cartella temporanea
+class Cluster:
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix='mrc-bench-')
+        self.processes = []
+        self.hub_url = f"http://127.0.0.1:{args.hub_port}"
+        self.agent_urls = [f"http://127.0.0.1:{args.agent_base_port + i}" for i in range(args.agents)]
+
+    def _spawn(self, name, command, env):
+        directory = os.path.join(self.workdir, name)
+        os.makedirs(directory)
+        log = open(os.path.join(directory, 'output.log'), 'w')
+        process = subprocess.Popen(
+            [sys.executable] + command,
+            cwd=directory, env=dict(os.environ, **env), stdout=log, stderr=subprocess.STDOUT
+        )
+        self.processes.append((process, log))
+
+    def start(self):
+        pythonpath = os.pathsep.join([MOCK_MT5_DIR, REPO_DIR, os.environ.get('PYTHONPATH', '')])
+        for i, url in enumerate(self.agent_urls):
+            self._spawn(f'agent{i}', [os.path.join(REPO_DIR, 'agent.py')], {
+                'PYTHONPATH': pythonpath,
+                'AGENT_PORT': str(self.args.agent_base_port + i),
+                'FAKE_MT5_LOGIN': str(20000000 + i),
+                'FAKE_MT5_SEED': str(i),
+                'FAKE_MT5_ORDER_LATENCY_MS': str(self.args.order_latency_ms),
+                'FAKE_MT5_READ_LATENCY_MS': str(self.args.read_latency_ms),
+                'FAKE_MT5_HISTORY_DEALS': str(self.args.history_deals),
+            })
+        if self.args.hub_workers:
+            hub_command = ['-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'), 'app:app']
+        else:
+            hub_command = [os.path.join(REPO_DIR, 'app.py')]
+        self._spawn('hub', hub_command, {
+            'PYTHONPATH': pythonpath,
+            'HUB_API_WORKERS': str(self.args.hub_workers),
+            'HUB_PORT': str(self.args.hub_port),
+            'AUTH_USERNAME': BENCH_USERNAME,
+            'AUTH_PASSWORD': BENCH_PASSWORD,
+            'CONFIG_DB': 'config.db',
+            'REPLICATION_DB': 'replication.db',
+        })
+        for url in self.agent_urls + [self.hub_url]:
+            self._wait_ready(url)
+
+    def _wait_ready(self, url):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                requests.get(f"{url}/", timeout=1.0)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError(f"{url} non risponde dopo {STARTUP_TIMEOUT} secondi (log in {self.workdir})")
+
+    def stop(self):
+        for process, log in self.processes:
+            process.terminate()
+        for process, log in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+        if self.args.keep:
+            print(f"Database e log in {self.workdir}")
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+# Client dell'API del server centrale usato dal benchmark
+class HubClient:
+    def __init__(self, url, pool_size):
+        self.url = url
+        self.session = requests.Session()
+        self.session.auth = (BENCH_USERNAME, BENCH_PASSWORD)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+
+    def call(self, method, path, payload=None, timeout=60):
+        response = self.session.request(method, f"{self.url}{path}", json=payload, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class Benchmark:
+    def __init__(self, args, cluster):
+        self.args = args
+        self.cluster = cluster
+        self.hub = HubClient(cluster.hub_url, max(args.concurrency, 10))
+        self.server_ids = []
+        # (server_id, account_id) nell'ordine di registrazione
+        self.accounts = []
+
+    def setup_servers(self):
+        for i, url in enumerate(self.cluster.agent_urls):
+            self.server_ids.append(self.hub.call('POST', '/api/servers', {'name': f'bench-agent-{i}', 'url': url})['id'])
+
+    # Registra gli account mancanti distribuendoli tra gli agenti e collega il primo
+    # (master) a tutti gli altri (slave)
+    def setup_fleet(self, size):
+        while len(self.accounts) < size:
+            server_id = self.server_ids[len(self.accounts) % len(self.server_ids)]
+            account_id = self.hub.call('POST', f'/api/servers/{server_id}/accounts', {
+                'account_number': str(30000000 + len(self.accounts)),
+                'description': f'bench-{len(self.accounts)}'
+            })['id']
+            self.accounts.append((server_id, account_id))
+
+        master_server_id, master_account_id = self.accounts[0]
+        self.hub.call('POST', '/api/master-slave', {
+            'master_server_id': master_server_id,
+            'master_account_id': master_account_id,
+            'slaves': [
+                {'server_id': server_id, 'account_id': account_id, 'size_ratio': 1.0, 'direction': 'same', 'use_sl_tp': False}
+                for server_id, account_id in self.accounts[1:size]
+            ]
+        })
+
+    def open_master_order(self):
+        server_id, account_id = self.accounts[0]
+        start = time.perf_counter()
+        response = self.hub.call('POST', f'/api/servers/{server_id}/accounts/{account_id}/positions', {
+            'symbol': self.args.symbol, 'type': 'buy', 'volume': self.args.volume
+        })
+        wall_ms = (time.perf_counter() - start) * 1000
+        # Gli ordini degli slave con altri ordini in coda vengono consegnati in background
+        operations = [response] + response.get('slave_operations', [])
+        return {
+            'wall_ms': wall_ms,
+            'master_success': bool(response.get('success')),
+            'fanout_ms': response.get('fanout_latency_ms', response.get('latency_ms', 0)),
+            'executed': sum(1 for op in operations if op.get('success')),
+            'queued': sum(1 for op in operations if not op.get('success') and op.get('queued')),
+            'failed': sum(1 for op in operations if not op.get('success') and not op.get('queued'))
+        }
+
+    def replication_counts(self):
+        return self.hub.call('GET', '/api/replication')['counts']
+
+    # Attende che la coda di replica non abbia più ordini da consegnare
+    def wait_replication_drained(self):
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while self.hub.call('GET', '/api/replication')['backlog']:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"La coda di replica non si è svuotata in {DRAIN_TIMEOUT} secondi")
+            time.sleep(0.05)
+
+    # Ordini del master uno alla volta: latenza di copia verso tutti gli slave
+    def measure_fanout(self):
+        self.open_master_order()  # riscaldamento (vincoli dei simboli, connessioni)
+        results = [self.open_master_order() for _ in range(self.args.orders)]
+        self.wait_replication_drained()
+        return {
+            'request_ms': percentiles([r['wall_ms'] for r in results]),
+            'fanout_ms': percentiles([r['fanout_ms'] for r in results]),
+            'queued_orders': sum(r['queued'] for r in results),
+            'failed_orders': sum(r['failed'] for r in results)
+        }
+
+    # Ordini del master in parallelo: ordini eseguiti al secondo su tutta la flotta, fino
+    # alla consegna di quelli rimasti nella coda di replica
+    def measure_throughput(self):
+        before = self.replication_counts()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            results = list(executor.map(lambda _: self.open_master_order(), range(self.args.orders)))
+        self.wait_replication_drained()
+        elapsed = time.perf_counter() - start
+        after = self.replication_counts()
+
+        # Esito finale degli ordini degli slave (anche di quelli passati dalla coda) dai
+        # contatori della coda di replica
+        delta = {status: after.get(status, 0) - before.get(status, 0) for status in ('done', 'failed', 'expired')}
+        masters = sum(1 for r in results if r['master_success'])
+        executed = masters + delta['done']
+        return {
+            'master_orders': len(results),
+            'executed_orders': executed,
+            'queued_orders': sum(r['queued'] for r in results),
+            'failed_orders': len(results) - masters + delta['failed'] + delta['expired'],
+            'elapsed_s': round(elapsed, 3),
+            'orders_per_second': round(executed / elapsed, 1)
+        }
+
+    def query_history(self, account):
+        server_id, account_id = account
+        start = time.perf_counter()
+        response = self.hub.call('GET', f'/api/servers/{server_id}/accounts/{account_id}/history?days={self.args.history_days}')
+        return (time.perf_counter() - start) * 1000, len(response.get('data') or [])
+
+    # Cronologia di tutti gli account della flotta, prima a freddo e poi dall'archivio locale
+    def measure_history(self, size):
+        result = {}
+        for phase in ('first', 'repeat'):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+                samples = list(executor.map(self.query_history, self.accounts[:size]))
+            result[phase] = {
+                'request_ms': percentiles([ms for ms, _ in samples]),
+                'total_s': round(time.perf_counter() - start, 3),
+                'deals': int(np.mean([count for _, count in samples]))
+            }
+        return result
+
+    def run(self):
+        self.setup_servers()
+        results = []
+        for size in sorted(int(value) for value in self.args.accounts.split(',')):
+            print(f"Flotta di {size} account...", flush=True)
+            self.setup_fleet(size)
+            # La cronologia si misura prima degli ordini, che aggiungono deal ai terminali
+            history = self.measure_history(size)
+            results.append({
+                'accounts': size,
+                'agents': len(self.server_ids),
+                'fanout': self.measure_fanout(),
+                'throughput': self.measure_throughput(),
+                'history': history
+            })
+        return results
+
+
+def print_report(results):
+    header = (f"{'account':>8} {'fanout p50':>11} {'fanout p95':>11} {'richiesta p95':>14} "
+              f"{'ordini/s':>9} {'falliti':>8} {'cronologia p95':>15} {'(ripetuta)':>11}")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        fanout = r['fanout']
+        history = r['history']
+        print(f"{r['accounts']:>8} {fanout['fanout_ms']['p50']:>11} {fanout['fanout_ms']['p95']:>11} "
+              f"{fanout['request_ms']['p95']:>14} {r['throughput']['orders_per_second']:>9} "
+              f"{fanout['failed_orders'] + r['throughput']['failed_orders']:>8} "
+              f"{history['first']['request_ms']['p95']:>15} {history['repeat']['request_ms']['p95']:>11}")
+    print("Tempi in millisecondi.")
+
+
+def main():
+    args = parse_args()
+    cluster = Cluster(args)
+    try:
+        cluster.start()
+        results = Benchmark(args, cluster).run()
+    finally:
+        cluster.stop()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import threading
+
+from copy_rules import MasterRules
+
+
+# Indici in memoria sulla configurazione del server centrale: account per id e per
+# numero, slave di ogni master e indice inverso slave -> master, e regole di copia
+# compilate di ogni master
+class ConfigIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._accounts = {}
+            self._accounts_by_number = {}
+            self._accounts_by_server = {}
+            self._masters_by_slave = {}
+            self._masters_by_server = {}
+            self._slaves_by_master = {}
+            self._master_server = {}
+            self._rules = {}
+
+    # Ricostruisce tutti gli indici a partire dalla configurazione
+    def rebuild(self, servers, master_slave_config):
+        with self._lock:
+            self.clear()
+            for server_id, server in servers.items():
+                for account in server.get('accounts', []):
+                    self.add_account(server_id, account)
+            for master_key, master_config in master_slave_config.items():
+                self.set_master(master_key, master_config)
+
+    def add_account(self, server_id, account):
+        with self._lock:
+            self._accounts[account['id']] = (server_id, account)
+            self._accounts_by_server.setdefault(server_id, set()).add(account['id'])
+            self._accounts_by_number[(server_id, str(account['account_number']))] = account
+
+    def remove_account(self, account_id):
+        with self._lock:
+            server_id, account = self._accounts.pop(account_id, (None, None))
+            if account is not None:
+                self._accounts_by_server.get(server_id, set()).discard(account_id)
+                key = (server_id, str(account['account_number']))
+                if self._accounts_by_number.get(key) is account:
+                    del self._accounts_by_number[key]
+
+    # Aggiorna l'indice per numero dopo la modifica di un account
+    def reindex_account(self, server_id, account, old_account_number):
+        with self._lock:
+            old_key = (server_id, str(old_account_number))
+            if self._accounts_by_number.get(old_key) is account:
+                del self._accounts_by_number[old_key]
+            self.add_account(server_id, account)
+
+    def find_account(self, server_id, account_id):
+        entry = self._accounts.get(account_id)
+        if entry is None or entry[0] != server_id:
+            return None
+        return entry[1]
+
+    def find_account_by_number(self, server_id, account_number):
+        return self._accounts_by_number.get((server_id, str(account_number)))
+
+    def account_ids(self, server_id):
+        with self._lock:
+            return list(self._accounts_by_server.get(server_id, ()))
+
+    def set_master(self, master_key, master_config):
+        with self._lock:
+            self.remove_master(master_key)
+            slaves = {(s['server_id'], s['account_id']): s for s in master_config.get('slaves', [])}
+            self._slaves_by_master[master_key] = slaves
+            self._master_server[master_key] = master_config['master_server_id']
+            self._masters_by_server.setdefault(master_config['master_server_id'], set()).add(master_key)
+            for slave_key in slaves:
+                self._masters_by_slave.setdefault(slave_key, set()).add(master_key)
+            self._rules[master_key] = MasterRules(master_config)
+
+    def remove_master(self, master_key):
+        with self._lock:
+            slaves = self._slaves_by_master.pop(master_key, None)
+            if slaves is None:
+                return
+            for slave_key in slaves:
+                masters = self._masters_by_slave.get(slave_key)
+                if masters is not None:
+                    masters.discard(master_key)
+                    if not masters:
+                        del self._masters_by_slave[slave_key]
+            server_id = self._master_server.pop(master_key)
+            self._masters_by_server[server_id].discard(master_key)
+            self._rules.pop(master_key, None)
+
+    def slaves_of(self, master_key):
+        return self._slaves_by_master.get(master_key, {})
+
+    # Regole di copia compilate degli slave di un master (None se il master non copia)
+    def rules_of(self, master_key):
+        return self._rules.get(master_key)
+
+    # Master che copiano su un account slave
+    def masters_of_slave(self, server_id, account_id):
+        with self._lock:
+            return set(self._masters_by_slave.get((server_id, account_id), ()))
+
+    # Master che copiano su un qualunque account di un server
+    def masters_of_slave_server(self, server_id):
+        with self._lock:
+            masters = set()
+            for account_id in self._accounts_by_server.get(server_id, ()):
+                masters.update(self._masters_by_slave.get((server_id, account_id), ()))
+            return masters
+
+    # Master con l'account master su un server
+    def masters_on_server(self, server_id):
+        with self._lock:
+            return set(self._masters_by_server.get(server_id, ()))
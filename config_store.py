@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Configurazione dell'archivio della configurazione del server centrale
+CONFIG_BACKEND = os.environ.get('CONFIG_BACKEND', 'sqlite')
+CONFIG_DB = os.environ.get('CONFIG_DB', 'config.db')
+
+
+# Archivio su file JSON: ogni modifica riscrive l'intero file (comportamento storico)
+class JsonConfigStore:
+    def __init__(self, path):
+        self.path = path
+        self._servers = {}
+        self._master_slave_config = {}
+        self._mtime = None
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def load(self):
+        with self._lock:
+            self._servers, self._master_slave_config = {}, {}
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    config = json.load(f)
+                self._servers = config.get('servers', {})
+                self._master_slave_config = config.get('master_slave_config', {})
+                self._mtime = os.path.getmtime(self.path)
+            return self._servers, self._master_slave_config
+
+    # Indica se il file è stato modificato da un altro processo
+    def has_changed(self):
+        return os.path.exists(self.path) and os.path.getmtime(self.path) != self._mtime
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self._depth += 1
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+            if self._depth == 0:
+                self._dump()
+
+    def _dump(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'servers': self._servers,
+                'master_slave_config': self._master_slave_config
+            }, f, indent=4)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.path.getmtime(self.path)
+
+    def save_server(self, server):
+        with self.transaction():
+            self._servers[server['id']] = server
+
+    def delete_server(self, server_id):
+        with self.transaction():
+            self._servers.pop(server_id, None)
+
+    def save_account(self, server_id, account):
+        with self.transaction():
+            accounts = self._servers[server_id].setdefault('accounts', [])
+            for i, existing in enumerate(accounts):
+                if existing['id'] == account['id']:
+                    accounts[i] = account
+                    break
+            else:
+                accounts.append(account)
+
+    def delete_account(self, server_id, account_id):
+        with self.transaction():
+            server = self._servers.get(server_id, {})
+            server['accounts'] = [a for a in server.get('accounts', []) if a['id'] != account_id]
+
+    def save_master_slave(self, master_key, master_config):
+        with self.transaction():
+            self._master_slave_config[master_key] = master_config
+
+    def delete_master_slave(self, master_key):
+        with self.transaction():
+            self._master_slave_config.pop(master_key, None)
+
+
+# Archivio SQLite (WAL): scritture atomiche e puntuali, ricerche indicizzate per
+# server_id/account_id e stato condiviso tra più processi
+class SqliteConfigStore:
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS servers (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS accounts (
+                id TEXT PRIMARY KEY,
+                server_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS accounts_server ON accounts (server_id, position)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS master_slave (
+                master_key TEXT PRIMARY KEY,
+                master_server_id TEXT NOT NULL,
+                master_account_id TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS master_slave_server ON master_slave (master_server_id)")
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._data_version = None
+
+    def _data_version_now(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self):
+        with self._lock:
+            servers = {}
+            for server_id, data in self._conn.execute("SELECT id, data FROM servers"):
+                server = json.loads(data)
+                server['accounts'] = []
+                servers[server_id] = server
+
+            for server_id, data in self._conn.execute("SELECT server_id, data FROM accounts ORDER BY server_id, position"):
+                if server_id in servers:
+                    servers[server_id]['accounts'].append(json.loads(data))
+
+            master_slave_config = {
+                master_key: json.loads(data)
+                for master_key, data in self._conn.execute("SELECT master_key, data FROM master_slave")
+            }
+
+            self._data_version = self._data_version_now()
+            return servers, master_slave_config
+
+    # Indica se un altro processo ha modificato il database dall'ultimo caricamento
+    def has_changed(self):
+        with self._lock:
+            return self._data_version is not None and self._data_version_now() != self._data_version
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM servers").fetchone()[0] == 0
+
+    # Raggruppa più modifiche in un'unica transazione atomica
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield self
+            except Exception:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("COMMIT")
+
+    def save_server(self, server):
+        with self.transaction():
+            data = {k: v for k, v in server.items() if k != 'accounts'}
+            self._conn.execute("INSERT OR REPLACE INTO servers (id, data) VALUES (?, ?)", (server['id'], json.dumps(data)))
+            self._conn.execute("DELETE FROM accounts WHERE server_id = ?", (server['id'],))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO accounts (id, server_id, position, data) VALUES (?, ?, ?, ?)",
+                [(account['id'], server['id'], i, json.dumps(account)) for i, account in enumerate(server.get('accounts', []))]
+            )
+
+    def delete_server(self, server_id):
+        with self.transaction():
+            self._conn.execute("DELETE FROM accounts WHERE server_id = ?", (server_id,))
+            self._conn.execute("DELETE FROM servers WHERE id = ?", (server_id,))
+
+    def save_account(self, server_id, account):
+        with self.transaction():
+            row = self._conn.execute("SELECT position FROM accounts WHERE id = ?", (account['id'],)).fetchone()
+            if row is None:
+                row = self._conn.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM accounts WHERE server_id = ?", (server_id,)
+                ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO accounts (id, server_id, position, data) VALUES (?, ?, ?, ?)",
+                (account['id'], server_id, row[0], json.dumps(account))
+            )
+
+    def delete_account(self, server_id, account_id):
+        with self.transaction():
+            self._conn.execute("DELETE FROM accounts WHERE id = ? AND server_id = ?", (account_id, server_id))
+
+    def save_master_slave(self, master_key, master_config):
+        with self.transaction():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO master_slave (master_key, master_server_id, master_account_id, data) VALUES (?, ?, ?, ?)",
+                (master_key, master_config['master_server_id'], master_config['master_account_id'], json.dumps(master_config))
+            )
+
+    def delete_master_slave(self, master_key):
+        with self.transaction():
+            self._conn.execute("DELETE FROM master_slave WHERE master_key = ?", (master_key,))
+
+    # Ricerca indicizzata di un account
+    def get_account(self, account_id):
+        with self._lock:
+            row = self._conn.execute("SELECT server_id, data FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else (None, None)
+
+    # Ricerca indicizzata degli account di un server
+    def get_accounts(self, server_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM accounts WHERE server_id = ? ORDER BY position", (server_id,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    # Importa la configurazione da un file JSON esistente
+    def import_json(self, path):
+        json_store = JsonConfigStore(path)
+        servers, master_slave_config = json_store.load()
+        with self.transaction():
+            for server in servers.values():
+                self.save_server(server)
+            for master_key, master_config in master_slave_config.items():
+                self.save_master_slave(master_key, master_config)
+        logger.info(f"Configurazione importata da {path}: {len(servers)} server")
+
+
+# Crea l'archivio configurato con CONFIG_BACKEND
+def create_config_store(json_path):
+    if CONFIG_BACKEND == 'json':
+        return JsonConfigStore(json_path)
+
+    store = SqliteConfigStore(CONFIG_DB)
+    if store.is_empty() and os.path.exists(json_path):
+        store.import_json(json_path)
+    return store
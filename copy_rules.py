@@ -0,0 +1,142 @@
+import math
+
+from execution_policy import ExecutionPolicy
+
+# Regole di copia di uno slave, oltre a size_ratio, direction, use_sl_tp, size_mode,
+# fixed_volume ed execution (tutte facoltative):
+# - symbol_map: {simbolo del master: simbolo dello slave}
+# - symbol_suffix: suffisso aggiunto ai simboli del master non presenti in symbol_map
+#   (es. EURUSD -> EURUSD.pro)
+# - symbols_allow: simboli del master copiati (tutti se assente)
+# - symbols_deny: simboli del master non copiati
+# - max_volume: volume massimo degli ordini dello slave, in lotti
+# - sl_tp_offset_points: punti di cui SL e TP dello slave vengono allontanati dal prezzo
+#   (avvicinati se negativo)
+RULE_FIELDS = ('symbol_map', 'symbol_suffix', 'symbols_allow', 'symbols_deny', 'max_volume', 'sl_tp_offset_points')
+
+DIRECTIONS = ('same', 'opposite')
+OPPOSITE_TYPES = {'buy': 'sell', 'sell': 'buy'}
+
+
+# Verifica le regole di copia di uno slave: restituisce un messaggio di errore o None
+def validate_slave_rules(slave):
+    if slave.get('direction') not in DIRECTIONS:
+        return f"Direzione non valida: {slave.get('direction')}"
+
+    symbol_map = slave.get('symbol_map')
+    if symbol_map is not None and (
+        not isinstance(symbol_map, dict)
+        or not all(isinstance(k, str) and isinstance(v, str) and v for k, v in symbol_map.items())
+    ):
+        return "symbol_map deve associare simboli del master a simboli dello slave"
+
+    if not isinstance(slave.get('symbol_suffix') or '', str):
+        return "symbol_suffix deve essere una stringa"
+
+    for field in ('symbols_allow', 'symbols_deny'):
+        symbols = slave.get(field)
+        if symbols is not None and (not isinstance(symbols, list) or not all(isinstance(s, str) for s in symbols)):
+            return f"{field} deve essere una lista di simboli"
+
+    max_volume = slave.get('max_volume')
+    if max_volume is not None and (
+        isinstance(max_volume, bool) or not isinstance(max_volume, (int, float))
+        or not math.isfinite(max_volume) or max_volume <= 0
+    ):
+        return "max_volume deve essere un numero positivo"
+
+    offset = slave.get('sl_tp_offset_points')
+    if offset is not None and (isinstance(offset, bool) or not isinstance(offset, int)):
+        return "sl_tp_offset_points deve essere un numero intero di punti"
+
+    execution = slave.get('execution')
+    if execution is not None:
+        if not isinstance(execution, dict):
+            return f"execution deve essere un oggetto con i campi {', '.join(ExecutionPolicy.FIELDS)}"
+        for key, value in execution.items():
+            cast = ExecutionPolicy.FIELDS.get(key)
+            if cast is None:
+                return f"Campo di execution non valido: {key}"
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+                return f"execution.{key} deve essere un numero non negativo"
+            if cast is int and not float(value).is_integer():
+                return f"execution.{key} deve essere un numero intero"
+        if execution.get('max_attempts') is not None and execution['max_attempts'] < 1:
+            return "execution.max_attempts deve essere almeno 1"
+
+    return None
+
+
+# Regole di copia di uno slave, già elaborate: la replica di un'operazione legge solo
+# attributi e tabelle precalcolate, senza interpretare di nuovo la configurazione
+class SlaveRule:
+    __slots__ = (
+        'server_id', 'account_id', 'config', 'opposite', 'copy_sl_tp', 'size_mode', 'size_ratio',
+        'fixed_volume', 'max_volume', 'sl_tp_offset_points', 'execution',
+        '_symbol_map', '_symbol_suffix', '_symbols_allow', '_symbols_deny'
+    )
+
+    def __init__(self, slave):
+        self.server_id = slave['server_id']
+        self.account_id = slave['account_id']
+        self.config = slave
+        self.opposite = slave['direction'] == 'opposite'
+        self.copy_sl_tp = bool(slave['use_sl_tp'])
+        self.size_mode = slave.get('size_mode')
+        self.size_ratio = slave['size_ratio']
+        self.fixed_volume = slave.get('fixed_volume')
+        self.max_volume = float(slave['max_volume']) if slave.get('max_volume') else None
+        self.sl_tp_offset_points = int(slave.get('sl_tp_offset_points') or 0)
+        self.execution = slave.get('execution')
+
+        self._symbol_map = dict(slave.get('symbol_map') or {})
+        self._symbol_suffix = slave.get('symbol_suffix') or ''
+        allow = slave.get('symbols_allow')
+        self._symbols_allow = frozenset(allow) if allow is not None else None
+        self._symbols_deny = frozenset(slave.get('symbols_deny') or ())
+
+    # Simbolo dello slave per un simbolo del master, None se il simbolo non va copiato
+    def map_symbol(self, symbol):
+        if symbol in self._symbols_deny:
+            return None
+        if self._symbols_allow is not None and symbol not in self._symbols_allow:
+            return None
+        return self._symbol_map.get(symbol) or symbol + self._symbol_suffix
+
+    # Tipo dell'ordine dello slave ('buy'/'sell') per il tipo dell'ordine del master
+    def order_type(self, order_type):
+        return OPPOSITE_TYPES.get(order_type, order_type) if self.opposite else order_type
+
+    # Simboli noti in anticipo dalla configurazione (mappature e simboli ammessi)
+    def known_symbols(self):
+        return set(self._symbol_map) | set(self._symbols_allow or ())
+
+
+# Regole di copia di tutti gli slave di un master, compilate quando la configurazione
+# viene salvata. Per ogni simbolo del master la tabella degli slave a cui copiare, con
+# il simbolo di ognuno, viene calcolata una sola volta: per i simboli citati nella
+# configurazione già alla compilazione, per gli altri alla prima operazione.
+class MasterRules:
+    def __init__(self, master_config):
+        self.slaves = tuple(SlaveRule(slave) for slave in master_config.get('slaves', []))
+        self._by_slave = {(rule.server_id, rule.account_id): rule for rule in self.slaves}
+        self._routes = {}
+        for symbol in set().union(*(rule.known_symbols() for rule in self.slaves)):
+            self.routes(symbol)
+
+    # Slave a cui copiare un'operazione del master su un simbolo: ((regola, simbolo dello slave), ...)
+    def routes(self, symbol):
+        routes = self._routes.get(symbol)
+        if routes is None:
+            routes = tuple(
+                (rule, slave_symbol) for rule in self.slaves
+                for slave_symbol in (rule.map_symbol(symbol),) if slave_symbol is not None
+            )
+            self._routes[symbol] = routes
+        return routes
+
+    # Regola di uno slave (None se lo slave non copia più questo master)
+    def slave(self, server_id, account_id):
+        return self._by_slave.get((server_id, account_id))
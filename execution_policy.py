@@ -0,0 +1,68 @@
+import os
+
+# Politica di esecuzione predefinita dell'agente
+EXEC_DEVIATION = int(os.environ.get('EXEC_DEVIATION', 10))
+EXEC_MAX_RETRY_MS = float(os.environ.get('EXEC_MAX_RETRY_MS', 500))
+EXEC_MAX_ATTEMPTS = int(os.environ.get('EXEC_MAX_ATTEMPTS', 5))
+# Slippage massimo rispetto al prezzo di riferimento, in punti (0 = nessun limite)
+EXEC_MAX_SLIPPAGE_POINTS = float(os.environ.get('EXEC_MAX_SLIPPAGE_POINTS', 0))
+
+# Retcode MT5 gestiti dalla politica di esecuzione
+TRADE_RETCODE_REQUOTE = 10004
+TRADE_RETCODE_PRICE_CHANGED = 10020
+TRADE_RETCODE_PRICE_OFF = 10021
+TRADE_RETCODE_INVALID_FILL = 10030
+
+# Rifiuti per cui ha senso ritentare subito con un prezzo aggiornato
+RETRYABLE_RETCODES = {TRADE_RETCODE_REQUOTE, TRADE_RETCODE_PRICE_CHANGED, TRADE_RETCODE_PRICE_OFF}
+
+
+# Limiti dei tentativi di esecuzione di un ordine market: deviazione accettata dal
+# server, tempo massimo per i nuovi tentativi dopo un requote, numero massimo di
+# tentativi e slippage massimo rispetto al prezzo di riferimento (es. quello del master)
+class ExecutionPolicy:
+    FIELDS = {
+        'deviation': int,
+        'max_retry_ms': float,
+        'max_attempts': int,
+        'max_slippage_points': float
+    }
+
+    def __init__(self, deviation=EXEC_DEVIATION, max_retry_ms=EXEC_MAX_RETRY_MS,
+                 max_attempts=EXEC_MAX_ATTEMPTS, max_slippage_points=EXEC_MAX_SLIPPAGE_POINTS):
+        self.deviation = deviation
+        self.max_retry_ms = max_retry_ms
+        self.max_attempts = max_attempts
+        self.max_slippage_points = max_slippage_points
+
+    # Politica predefinita con i valori indicati nella richiesta (i campi sconosciuti o
+    # vuoti vengono ignorati)
+    @classmethod
+    def from_overrides(cls, overrides=None):
+        values = {}
+        for key, cast in cls.FIELDS.items():
+            if overrides and overrides.get(key) is not None:
+                values[key] = cast(overrides[key])
+        return cls(**values)
+
+    # Slippage sfavorevole in punti di un prezzo rispetto a quello di riferimento
+    @staticmethod
+    def slippage_points(is_buy, price, reference_price, point):
+        if reference_price is None or not point:
+            return 0.0
+        difference = price - reference_price if is_buy else reference_price - price
+        return round(difference / point, 1)
+
+    def slippage_exceeded(self, slippage_points):
+        return self.max_slippage_points > 0 and slippage_points > self.max_slippage_points
+
+    # Indica se è possibile un nuovo tentativo dopo il retcode ricevuto
+    def can_retry(self, retcode, attempts, elapsed_ms):
+        return (
+            retcode in RETRYABLE_RETCODES
+            and attempts < self.max_attempts
+            and elapsed_ms < self.max_retry_ms
+        )
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
@@ -0,0 +1,111 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from agent_client import agent_clients
+
+logger = logging.getLogger(__name__)
+
+# Configurazione del motore di dispatch
+FANOUT_MAX_WORKERS = int(os.environ.get('FANOUT_MAX_WORKERS', 32))
+# Ordini massimi per richiesta batch (non oltre ORDER_BATCH_MAX_SIZE degli agenti)
+FANOUT_BATCH_SIZE = int(os.environ.get('FANOUT_BATCH_SIZE', 100))
+
+# Pool di worker condiviso: il numero di ordini in volo è limitato da FANOUT_MAX_WORKERS
+_executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix='fanout')
+
+# Invia un singolo ordine all'agente e misura la latenza
+def _send_order(server_id, url, payload, timeout):
+    start = time.perf_counter()
+    client = agent_clients.get(server_id, url)
+    success, message, data, delivered = client.open_position(payload, timeout=timeout, return_reached=True)
+
+    latency_ms = (time.perf_counter() - start) * 1000
+    return {
+        "success": success,
+        "message": message,
+        "result": data,
+        "latency_ms": round(latency_ms, 2),
+        "delivered": delivered
+    }
+
+# Invia gli ordini diretti a un agente: un'apertura singola con l'endpoint dedicato,
+# altrimenti in batch (anche chiusure e modifiche, con il campo 'action')
+def _send_orders(server_id, url, payloads, timeout):
+    if len(payloads) == 1 and payloads[0].get('action', 'open') == 'open':
+        return [_send_order(server_id, url, payloads[0], timeout)]
+    return _send_batch(server_id, url, payloads, timeout)
+
+# Invia più ordini allo stesso agente in un'unica richiesta batch
+def _send_batch(server_id, url, payloads, timeout):
+    start = time.perf_counter()
+    client = agent_clients.get(server_id, url)
+    success, message, data, delivered = client.execute_batch(
+        [dict({'action': 'open'}, **payload) for payload in payloads],
+        timeout=timeout,
+        return_reached=True
+    )
+
+    latency_ms = round((time.perf_counter() - start) * 1000, 2)
+    if not success or data is None:
+        return [
+            {"success": False, "message": message, "result": None, "latency_ms": latency_ms, "delivered": delivered}
+            for _ in payloads
+        ]
+
+    results = [
+        {"success": item['success'], "message": item['message'], "result": item['data'], "latency_ms": latency_ms, "delivered": True}
+        for item in data[:len(payloads)]
+    ]
+    # Risposta incompleta: l'esito degli ordini mancanti non è noto, quindi vengono
+    # segnati come non consegnati (la coda di replica li ritenta con la stessa chiave
+    # di idempotenza, senza duplicati)
+    if len(data) != len(payloads):
+        logger.error(f"Risposta batch dell'agente {server_id} con {len(data)} esiti per {len(payloads)} ordini")
+    results.extend(
+        {"success": False, "message": "Esito mancante nella risposta dell'agente", "result": None,
+         "latency_ms": latency_ms, "delivered": False}
+        for _ in range(len(payloads) - len(results))
+    )
+    return results
+
+# Invia in parallelo una lista di ordini ({'server_id': ..., 'url': ..., 'payload': ...}) ai
+# rispettivi agenti. Gli ordini diretti allo stesso agente viaggiano in un'unica richiesta
+# batch (in più richieste parallele oltre FANOUT_BATCH_SIZE ordini). I risultati sono
+# restituiti nello stesso ordine degli ordini in ingresso; 'delivered' è False se non
+# è certo che l'ordine abbia raggiunto l'agente.
+def dispatch_orders(orders, timeout=None):
+    groups = {}
+    for i, order in enumerate(orders):
+        groups.setdefault(order['server_id'], []).append(i)
+
+    futures = {}
+    for server_id, group in groups.items():
+        url = orders[group[0]]['url']
+        for chunk_start in range(0, len(group), FANOUT_BATCH_SIZE):
+            indexes = group[chunk_start:chunk_start + FANOUT_BATCH_SIZE]
+            future = _executor.submit(_send_orders, server_id, url, [orders[i]['payload'] for i in indexes], timeout)
+            futures[future] = indexes
+
+    # Margine oltre il timeout HTTP per ordini rimasti in coda nel pool
+    max_wait = sum(timeout) if timeout else sum(agent_clients.default_timeout)
+    done, _ = wait(futures, timeout=max_wait + 1.0)
+
+    results = [None] * len(orders)
+    for future, indexes in futures.items():
+        if future in done:
+            for i, result in zip(indexes, future.result()):
+                results[i] = result
+        else:
+            future.cancel()
+            for i in indexes:
+                results[i] = {
+                    "success": False,
+                    "message": "Timeout nella comunicazione con l'agente",
+                    "result": None,
+                    "latency_ms": round(max_wait * 1000, 2),
+                    "delivered": False
+                }
+
+    return results
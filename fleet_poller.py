@@ -0,0 +1,196 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_client import agent_clients
+
+logger = logging.getLogger(__name__)
+
+# Configurazione del polling della flotta
+FLEET_POLL_INTERVAL = float(os.environ.get('FLEET_POLL_INTERVAL', 1.0))
+FLEET_CACHE_TTL = float(os.environ.get('FLEET_CACHE_TTL', 5.0))
+FLEET_MAX_WORKERS = int(os.environ.get('FLEET_MAX_WORKERS', 16))
+# Il polling si ferma se nessuno richiede lo snapshot per questo tempo
+FLEET_IDLE_TIMEOUT = float(os.environ.get('FLEET_IDLE_TIMEOUT', 60.0))
+
+
+# Snapshot aggregato di saldo, equity e posizioni di tutti gli account, aggiornato
+# in background interrogando gli agenti in parallelo
+class FleetPoller:
+    def __init__(self, list_targets):
+        # list_targets() restituisce [{'server_id', 'url', 'account_id', 'account_number'}]
+        self.list_targets = list_targets
+
+        # Pool dedicato: il polling non deve rubare worker alla replica degli ordini
+        self._executor = ThreadPoolExecutor(max_workers=FLEET_MAX_WORKERS, thread_name_prefix='fleet')
+        self._accounts = {}
+        self._versions = {}
+        self._generated_at = None
+        self._last_request = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self._listeners = []
+        self._refresh_listeners = []
+
+    # Registra una funzione chiamata con (account_id, stato_precedente, stato) quando
+    # lo stato di un account cambia
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    # Registra una funzione chiamata con lo snapshot completo dopo ogni aggiornamento
+    # (es. per pubblicarlo agli altri processi del server centrale)
+    def add_refresh_listener(self, listener):
+        self._refresh_listeners.append(listener)
+
+    # Mantiene attivo il polling senza richiedere lo snapshot (es. dashboard in streaming)
+    def touch(self):
+        self._last_request = time.monotonic()
+        self._ensure_running()
+
+    # Anticipa il prossimo polling, ad esempio dopo un evento di posizione
+    def request_refresh(self):
+        self._wake.set()
+
+    # Restituisce lo snapshot, aggiornandolo solo se più vecchio del TTL
+    def snapshot(self):
+        self.touch()
+
+        if self._generated_at is None or time.time() - self._generated_at > FLEET_CACHE_TTL:
+            self.refresh()
+
+        return self._current()
+
+    def _current(self):
+        with self._lock:
+            return {
+                'generated_at': self._generated_at,
+                'accounts': dict(self._accounts)
+            }
+
+    # Ultimo stato noto di un account, senza avviare un aggiornamento (None se lo
+    # snapshot è più vecchio di max_age secondi)
+    def get_account(self, account_id, max_age=None):
+        if max_age is not None and (self._generated_at is None or time.time() - self._generated_at > max_age):
+            return None
+        return self._accounts.get(account_id)
+
+    def _ensure_running(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='fleet-poller', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        logger.info("Polling della flotta avviato")
+        while time.monotonic() - self._last_request < FLEET_IDLE_TIMEOUT:
+            started = time.monotonic()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Errore nel polling della flotta: {e}")
+            self._wake.wait(max(0.0, FLEET_POLL_INTERVAL - (time.monotonic() - started)))
+            self._wake.clear()
+        logger.info("Polling della flotta sospeso: nessuna richiesta recente")
+
+    # Interroga tutti gli agenti in parallelo. Le richieste concorrenti attendono
+    # il refresh in corso invece di avviarne un altro.
+    def refresh(self):
+        requested_at = time.time()
+        with self._refresh_lock:
+            if self._generated_at is not None and self._generated_at >= requested_at:
+                return
+
+            targets = self.list_targets()
+            results = list(self._executor.map(self._poll_account, targets))
+
+            with self._lock:
+                first_refresh = self._generated_at is None
+                previous_accounts = self._accounts
+                self._accounts = {target['account_id']: result for target, result in zip(targets, results)}
+                self._generated_at = time.time()
+
+            # Il primo snapshot viene inviato per intero a chi lo richiede
+            if not first_refresh:
+                self._notify(previous_accounts, self._accounts)
+            if self._refresh_listeners:
+                snapshot = self._current()
+                for listener in self._refresh_listeners:
+                    try:
+                        listener(snapshot)
+                    except Exception as e:
+                        logger.error(f"Errore nel listener della flotta: {e}")
+
+    def _notify(self, previous_accounts, accounts):
+        if not self._listeners:
+            return
+        for account_id, state in accounts.items():
+            previous = previous_accounts.get(account_id)
+            if previous is not None and all(
+                previous[f] == state[f] for f in ('status', 'updated_at', 'error')
+            ):
+                continue
+            for listener in self._listeners:
+                try:
+                    listener(account_id, previous, state)
+                except Exception as e:
+                    logger.error(f"Errore nel listener della flotta: {e}")
+
+    # Interroga un singolo account: informazioni e posizioni cambiate dall'ultimo polling
+    def _poll_account(self, target):
+        account_id = target['account_id']
+        client = agent_clients.get(target['server_id'], target['url'])
+        previous = self._accounts.get(account_id)
+
+        state = {
+            'server_id': target['server_id'],
+            'account_number': target['account_number'],
+            'status': 'offline',
+            'balance': previous['balance'] if previous else None,
+            'equity': previous['equity'] if previous else None,
+            'margin': previous['margin'] if previous else None,
+            'margin_free': previous['margin_free'] if previous else None,
+            'currency': previous['currency'] if previous else None,
+            'positions': previous['positions'] if previous else [],
+            'updated_at': previous['updated_at'] if previous else None,
+            'error': None
+        }
+
+        success, message, info = client.get_account(target['account_number'])
+        if not success:
+            state['error'] = message
+            return state
+
+        since = self._versions.get(account_id, 0)
+        success, message, changes = client.get_position_changes(target['account_number'], since)
+        if not success:
+            state['error'] = message
+            return state
+
+        changed = bool(changes['full'] or changes['changed'] or changes['removed'])
+        if changed:
+            if changes['full']:
+                positions = {}
+            else:
+                positions = {position['ticket']: position for position in state['positions']}
+            for ticket in changes['removed']:
+                positions.pop(ticket, None)
+            for position in changes['changed']:
+                positions[position['ticket']] = position
+            state['positions'] = list(positions.values())
+        self._versions[account_id] = changes['version']
+
+        fields = ('balance', 'equity', 'margin', 'margin_free', 'currency')
+        if changed or previous is None or any(previous[f] != info.get(f) for f in fields):
+            state['updated_at'] = time.time()
+        for field in fields:
+            state[field] = info.get(field)
+        state['status'] = 'online'
+        return state
+
@@ -0,0 +1,60 @@
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Configurazione di gunicorn per il server centrale su più processi: worker API senza
+# stato proprio, che scalano sui core, e worker di replica dedicati, avviati e riavviati
+# dal processo principale di gunicorn. Il traffico dell'interfaccia web non può così
+# rallentare la replica delle operazioni. Avvio: gunicorn -c gunicorn.conf.py app:app
+
+bind = f"0.0.0.0:{os.environ.get('HUB_PORT', 5000)}"
+# Worker a thread: gli stream della dashboard restano aperti senza occupare un processo
+worker_class = 'gthread'
+workers = int(os.environ.get('HUB_API_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('HUB_API_THREADS', 16))
+
+REPLICATION_WORKERS = int(os.environ.get('REPLICATION_WORKERS', 1))
+# Attesa prima di riavviare un worker di replica terminato, in secondi
+REPLICATION_RESTART_DELAY = 1.0
+
+# I worker API ereditano il ruolo dal processo principale
+os.environ.setdefault('HUB_ROLE', 'api')
+
+logger = logging.getLogger('gunicorn.error')
+_replication_processes = {}
+_stopping = threading.Event()
+
+
+# Avvia un worker di replica e lo riavvia se termina
+def _supervise_replication_worker(index):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replication_worker.py')
+    env = dict(os.environ, REPLICATION_WORKERS=str(REPLICATION_WORKERS), REPLICATION_WORKER_INDEX=str(index))
+    while not _stopping.is_set():
+        process = subprocess.Popen([sys.executable, script], env=env)
+        _replication_processes[index] = process
+        returncode = process.wait()
+        if not _stopping.is_set():
+            logger.error(f"Worker di replica {index} terminato (codice {returncode}), riavvio")
+            time.sleep(REPLICATION_RESTART_DELAY)
+
+
+def when_ready(server):
+    if os.environ['HUB_ROLE'] != 'api':
+        return
+    for index in range(REPLICATION_WORKERS):
+        threading.Thread(target=_supervise_replication_worker, args=(index,), daemon=True).start()
+
+
+def on_exit(server):
+    _stopping.set()
+    for process in _replication_processes.values():
+        process.terminate()
+    for process in _replication_processes.values():
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,199 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Configurazione dell'archivio locale della cronologia
+HISTORY_DIR = os.environ.get('HISTORY_DIR', 'history')
+# Intervallo minimo tra due sincronizzazioni con il terminale, in secondi
+HISTORY_SYNC_INTERVAL = float(os.environ.get('HISTORY_SYNC_INTERVAL', 1.0))
+# Sovrapposizione con l'ultimo deal archiviato, in secondi: i deal nuovi vengono
+# richiesti a partire da qualche minuto prima (i duplicati vengono ignorati)
+HISTORY_SYNC_OVERLAP = float(os.environ.get('HISTORY_SYNC_OVERLAP', 300))
+# Margine per l'orario del server del terminale, che può differire da quello locale:
+# gli intervalli richiesti si estendono di tanto oltre l'orario locale
+HISTORY_SERVER_TIME_MARGIN = 24 * 3600
+
+DEAL_FIELDS = ('ticket', 'time', 'type', 'entry', 'magic', 'symbol', 'volume', 'price',
+               'profit', 'commission', 'swap', 'fee')
+
+
+# Archivio append-only dei deal di un account, indicizzato per ticket
+class HistoryStore:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS deals (
+                ticket INTEGER PRIMARY KEY,
+                time INTEGER NOT NULL,
+                type INTEGER,
+                entry INTEGER,
+                magic INTEGER,
+                symbol TEXT,
+                volume REAL,
+                price REAL,
+                profit REAL,
+                commission REAL,
+                swap REAL,
+                fee REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS deals_time ON deals (time, ticket)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.commit()
+
+        self._lock = threading.Lock()
+        self._last_sync = 0.0
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # Orario (del server) dell'ultimo deal archiviato, None se l'archivio è vuoto
+    def _last_deal_time(self):
+        return self._conn.execute("SELECT MAX(time) FROM deals").fetchone()[0]
+
+    def _insert(self, deals):
+        self._conn.executemany(
+            f"INSERT OR IGNORE INTO deals ({', '.join(DEAL_FIELDS)}) VALUES ({', '.join('?' * len(DEAL_FIELDS))})",
+            [tuple(getattr(deal, field) for field in DEAL_FIELDS) for deal in deals]
+        )
+
+    # Scarica dal terminale solo i deal non ancora archiviati.
+    # fetch_deals(from_ts, to_ts) restituisce i deal del terminale nell'intervallo o None.
+    # Con chunk_seconds gli intervalli vengono scaricati e archiviati a blocchi di quella
+    # ampiezza, così la memoria usata non dipende dalla lunghezza dell'intervallo.
+    def sync(self, fetch_deals, date_from, force=False, chunk_seconds=None):
+        with self._lock:
+            now = int(time.time())
+            synced_from = self._get_meta('synced_from')
+            synced_to = self._get_meta('synced_to')
+
+            ranges = []
+            # Intervallo più vecchio di quanto già archiviato
+            if synced_from is None:
+                ranges.append((date_from, now + HISTORY_SERVER_TIME_MARGIN))
+            elif date_from < synced_from:
+                ranges.append((date_from, synced_from + HISTORY_SERVER_TIME_MARGIN))
+            # Deal nuovi dopo l'ultimo archiviato (o, se non ce ne sono, dopo l'ultima
+            # sincronizzazione): i deal hanno l'orario del server, quindi l'intervallo parte
+            # dall'orario dell'ultimo deal e non da quello locale
+            if synced_to is not None and (force or time.monotonic() - self._last_sync >= HISTORY_SYNC_INTERVAL):
+                last_deal_time = self._last_deal_time()
+                if last_deal_time is not None:
+                    range_from = int(last_deal_time - HISTORY_SYNC_OVERLAP)
+                else:
+                    range_from = synced_to - HISTORY_SERVER_TIME_MARGIN
+                ranges.append((range_from, now + HISTORY_SERVER_TIME_MARGIN))
+
+            for range_from, range_to in ranges:
+                for chunk_from, chunk_to in _chunks(range_from, range_to, chunk_seconds):
+                    deals = fetch_deals(chunk_from, chunk_to)
+                    if deals is None:
+                        # I blocchi già archiviati restano: i duplicati verranno ignorati
+                        self._conn.commit()
+                        return False
+                    self._insert(deals)
+                    self._conn.commit()
+
+            if ranges:
+                self._set_meta('synced_from', min(date_from, synced_from) if synced_from is not None else date_from)
+                self._set_meta('synced_to', now)
+                self._conn.commit()
+                self._last_sync = time.monotonic()
+
+            return True
+
+    # Restituisce i deal archiviati nell'intervallo, ordinati per orario, con paginazione.
+    # Con columnar=True i deal sono restituiti per colonne ({campo: valori}).
+    def query(self, date_from=None, date_to=None, limit=None, offset=0, columnar=False):
+        conditions = []
+        params = []
+        if date_from is not None:
+            conditions.append("time >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append("time <= ?")
+            params.append(date_to)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM deals {where}", params).fetchone()[0]
+
+            sql = f"SELECT {', '.join(DEAL_FIELDS)} FROM deals {where} ORDER BY time, ticket"
+            if limit is not None:
+                sql += " LIMIT ? OFFSET ?"
+                params = params + [limit, offset]
+            rows = self._conn.execute(sql, params).fetchall()
+
+        if columnar:
+            columns = list(zip(*rows)) if rows else [()] * len(DEAL_FIELDS)
+            return {field: list(values) for field, values in zip(DEAL_FIELDS, columns)}, total
+        return [dict(zip(DEAL_FIELDS, row)) for row in rows], total
+
+    # Pagina di deal dell'intervallo successivi al cursore (time, ticket) dell'ultimo deal
+    # ricevuto, nello stesso ordine di query: la paginazione per chiave non rilegge le
+    # pagine precedenti e resta stabile anche se nel frattempo vengono archiviati nuovi deal
+    def page(self, date_from, date_to, cursor=None, limit=1000):
+        conditions = ["time >= ?", "time <= ?"]
+        params = [date_from, date_to]
+        if cursor is not None:
+            conditions.append("(time > ? OR (time = ? AND ticket > ?))")
+            params.extend((cursor[0], cursor[0], cursor[1]))
+
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT {', '.join(DEAL_FIELDS)} FROM deals WHERE {' AND '.join(conditions)} "
+                f"ORDER BY time, ticket LIMIT ?",
+                params + [limit]
+            ).fetchall()
+
+    # Deal archiviati con ticket successivo a quello indicato, in ordine di ticket, con i
+    # soli campi richiesti (per gli aggiornamenti incrementali delle statistiche)
+    def deals_after(self, ticket, fields=DEAL_FIELDS):
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT {', '.join(fields)} FROM deals WHERE ticket > ? ORDER BY ticket", (ticket,)
+            ).fetchall()
+
+    # Numero di deal archiviati con ticket fino a quello indicato
+    def count_until(self, ticket):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM deals WHERE ticket <= ?", (ticket,)).fetchone()[0]
+
+
+# Suddivide un intervallo (limiti inclusivi, in secondi) in blocchi di chunk_seconds
+def _chunks(date_from, date_to, chunk_seconds=None):
+    if not chunk_seconds:
+        return [(date_from, date_to)]
+    chunk_seconds = max(1, int(chunk_seconds))
+    return [
+        (chunk_from, min(chunk_from + chunk_seconds - 1, int(date_to)))
+        for chunk_from in range(int(date_from), int(date_to) + 1, chunk_seconds)
+    ]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+# Restituisce l'archivio della cronologia di un account
+def get_history_store(account_number):
+    with _stores_lock:
+        store = _stores.get(account_number)
+        if store is None:
+            store = HistoryStore(os.path.join(HISTORY_DIR, f"history_{account_number}.db"))
+            _stores[account_number] = store
+        return store
@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Archivio condiviso tra i processi del server centrale (worker API e worker di replica)
+HUB_STATE_DB = os.environ.get('HUB_STATE_DB', 'hub_state.db')
+# Intervallo di lettura dei nuovi eventi da parte dei worker API, in secondi
+HUB_EVENT_POLL_INTERVAL = float(os.environ.get('HUB_EVENT_POLL_INTERVAL', 0.05))
+# Conservazione degli eventi già distribuiti, in secondi
+HUB_EVENT_RETENTION = float(os.environ.get('HUB_EVENT_RETENTION', 300.0))
+HUB_EVENT_BATCH_SIZE = 500
+
+
+# Stato e eventi condivisi tra i processi del server centrale (SQLite, WAL):
+# - eventi: bus append-only letto da tutti i worker API (stato degli agenti, modifiche
+#   della configurazione, variazioni delle posizioni), ognuno dal proprio ultimo id
+# - snapshot: ultimo valore pubblicato di uno stato calcolato in un solo processo
+#   (es. heartbeat degli agenti), per nome
+class HubState:
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                payload TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                name TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_purge = 0.0
+
+    # Pubblica un evento per tutti i worker API
+    def publish(self, event):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO events (created_at, payload) VALUES (?, ?)", (time.time(), json.dumps(event))
+            )
+
+    # Eventi pubblicati dopo quello indicato: [(id, evento)]
+    def events_after(self, last_id, limit=HUB_EVENT_BATCH_SIZE):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, payload FROM events WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit)
+            ).fetchall()
+        return [(event_id, json.loads(payload)) for event_id, payload in rows]
+
+    def last_event_id(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    # Elimina gli eventi più vecchi di HUB_EVENT_RETENTION (al massimo una volta al minuto)
+    def purge(self):
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        with self._lock:
+            self._conn.execute("DELETE FROM events WHERE created_at < ?", (now - HUB_EVENT_RETENTION,))
+
+    def put(self, name, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO snapshots (name, updated_at, data) VALUES (?, ?, ?)",
+                (name, time.time(), json.dumps(data))
+            )
+
+    # Snapshot con il nome indicato o che inizia con prefix: {nome: dati}
+    def snapshots(self, prefix):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, data FROM snapshots WHERE name = ? OR substr(name, 1, ?) = ?",
+                (prefix, len(prefix) + 1, f"{prefix}.")
+            ).fetchall()
+        return {name: json.loads(data) for name, data in rows}
+
+    # Elimina gli snapshot con il nome indicato o che inizia con prefix non aggiornati da
+    # più di max_age secondi (es. quelli di processi terminati)
+    def delete_stale(self, prefix, max_age):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM snapshots WHERE (name = ? OR substr(name, 1, ?) = ?) AND updated_at < ?",
+                (prefix, len(prefix) + 1, f"{prefix}.", time.time() - max_age)
+            )
+
+    # Avvia il thread che consegna a handle_event(evento) gli eventi pubblicati da ora in poi
+    def start_relay(self, handle_event):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._relay, args=(handle_event,), name='hub-events', daemon=True)
+            self._thread.start()
+
+    def _relay(self, handle_event):
+        last_id = self.last_event_id()
+        while True:
+            try:
+                events = self.events_after(last_id)
+            except sqlite3.Error as e:
+                logger.error(f"Errore nella lettura degli eventi condivisi: {e}")
+                events = []
+
+            for event_id, event in events:
+                last_id = event_id
+                try:
+                    handle_event(event)
+                except Exception as e:
+                    logger.error(f"Errore nella gestione dell'evento {event.get('event')}: {e}")
+
+            if len(events) < HUB_EVENT_BATCH_SIZE:
+                time.sleep(HUB_EVENT_POLL_INTERVAL)
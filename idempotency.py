@@ -0,0 +1,90 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Numero di chiavi di idempotenza ricordate in memoria
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+# Ore di storico in cui cercare un ordine già eseguito dopo un riavvio dell'agente
+IDEMPOTENCY_LOOKBACK_HOURS = float(os.environ.get('IDEMPOTENCY_LOOKBACK_HOURS', 24))
+
+# Prefisso del commento MT5 che porta la chiave di idempotenza (massimo 31 caratteri)
+IDEMPOTENCY_COMMENT_PREFIX = 'MRC '
+
+# deal.entry di un'operazione di apertura
+DEAL_ENTRY_IN = 0
+
+
+# Commento MT5 di un ordine con la chiave di idempotenza indicata
+def idempotency_comment(key):
+    return f"{IDEMPOTENCY_COMMENT_PREFIX}{key}"[:31]
+
+
+# Chiave di idempotenza letta dal commento MT5 di una posizione (None se assente)
+def idempotency_key_from_comment(comment):
+    if not comment or not comment.startswith(IDEMPOTENCY_COMMENT_PREFIX):
+        return None
+    return comment[len(IDEMPOTENCY_COMMENT_PREFIX):] or None
+
+
+# Ordini già eseguiti, indicizzati per chiave di idempotenza. Un ordine ripetuto dal
+# server centrale (es. dopo un timeout) viene riconosciuto dalla memoria; dopo un
+# riavvio dell'agente, cercando il commento tra posizioni, ordini pendenti e deal recenti.
+class ExecutedOrders:
+    def __init__(self, size=IDEMPOTENCY_CACHE_SIZE):
+        self.size = size
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def remember(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+
+    # Restituisce il risultato dell'ordine già eseguito con questa chiave, oppure None.
+    # La ricerca sul terminale (più lenta) si fa solo con search_terminal=True, cioè
+    # per i nuovi tentativi di consegna.
+    def find(self, key, search_terminal=False):
+        result = self._results.get(key)
+        if result is not None or not search_terminal:
+            return result
+
+        result = self._find_in_terminal(key)
+        if result is not None:
+            self.remember(key, result)
+        return result
+
+    def _find_in_terminal(self, key):
+        import MetaTrader5 as mt5
+
+        comment = idempotency_comment(key)
+
+        for position in mt5.positions_get() or ():
+            if position.comment == comment:
+                return {'order': position.ticket, 'volume': position.volume, 'price': position.price_open}
+
+        for order in mt5.orders_get() or ():
+            if order.comment == comment:
+                return {'order': order.ticket, 'volume': order.volume_initial, 'price': order.price_open}
+
+        now = datetime.now()
+        deals = mt5.history_deals_get(
+            now - timedelta(hours=IDEMPOTENCY_LOOKBACK_HOURS), now + timedelta(minutes=1)
+        ) or ()
+        for deal in deals:
+            if deal.comment == comment and deal.entry == DEAL_ENTRY_IN:
+                return {'order': deal.order, 'deal': deal.ticket, 'volume': deal.volume, 'price': deal.price}
+
+        return None
+
+
+executed_orders = ExecutedOrders()
@@ -0,0 +1,67 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Massimo numero di eventi in attesa per una dashboard lenta
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+# Calcola i campi cambiati di un account tra due stati dello snapshot della flotta.
+# Le posizioni sono confrontate per ticket: vengono inviate solo quelle nuove o modificate
+# e i ticket di quelle chiuse.
+def diff_account_state(previous, current):
+    previous = previous or {}
+    changes = {
+        key: value for key, value in current.items()
+        if key != 'positions' and previous.get(key) != value
+    }
+
+    previous_positions = {p['ticket']: p for p in previous.get('positions', [])}
+    current_positions = {p['ticket']: p for p in current.get('positions', [])}
+
+    changed_positions = [p for ticket, p in current_positions.items() if previous_positions.get(ticket) != p]
+    removed_positions = [ticket for ticket in previous_positions if ticket not in current_positions]
+    if changed_positions:
+        changes['positions_changed'] = changed_positions
+    if removed_positions:
+        changes['positions_removed'] = removed_positions
+
+    return changes
+
+
+# Distribuisce gli eventi della dashboard a tutti i client connessi allo stream
+class LiveFeed:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    # Registra un nuovo client; con limit restituisce None se i client connessi sono
+    # già limit
+    def subscribe(self, limit=None):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                logger.warning("Coda eventi di una dashboard piena, evento scartato")
+
+
+live_feed = LiveFeed()
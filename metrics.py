@@ -0,0 +1,178 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket degli istogrammi di latenza, in millisecondi
+LATENCY_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Content-Type del formato testuale di Prometheus
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Contatore con etichette (es. retcode degli ordini)
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    # Valori serializzabili in JSON: [[etichette, valore]]
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    # Somma ai valori indicati ({etichette: valore}) quelli di uno snapshot
+    def merge(self, values, snapshot):
+        for key, value in snapshot:
+            key = tuple(key)
+            values[key] = values.get(key, 0) + value
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+# Istogramma con bucket cumulativi, somma e conteggio, nel formato di Prometheus
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS_MS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    # Valori serializzabili in JSON: [[etichette, {'counts', 'sum', 'count'}]]
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), dict(series, counts=list(series['counts']))] for key, series in self._values.items()]
+
+    # Somma ai valori indicati ({etichette: serie}) quelli di uno snapshot
+    def merge(self, values, snapshot):
+        for key, series in snapshot:
+            if len(series['counts']) != len(self.buckets) + 1:
+                continue
+            key = tuple(key)
+            total = values.get(key)
+            if total is None:
+                total = values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            total['counts'] = [a + b for a, b in zip(total['counts'], series['counts'])]
+            total['sum'] += series['sum']
+            total['count'] += series['count']
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        if values is None:
+            with self._lock:
+                values = {key: dict(series, counts=list(series['counts'])) for key, series in self._values.items()}
+        for key, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series['counts']):
+                cumulative += count
+                labels = _format_labels(self.labels, key, [('le', _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+# Registro delle metriche di un processo, esposte su /metrics
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labels=()):
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS_MS):
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    # Valori di tutte le metriche, serializzabili in JSON, per l'aggregazione tra processi
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    # Come render, ma con la somma dei valori di più snapshot (es. uno per processo)
+    def render_merged(self, snapshots):
+        lines = []
+        for metric in self._metrics:
+            values = {}
+            for snapshot in snapshots:
+                metric.merge(values, snapshot.get(metric.name, []))
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
+
+
+# Durata delle fasi di una richiesta, in millisecondi, restituita nelle risposte degli
+# ordini e registrata negli istogrammi
+class Timings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = {}
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, elapsed_ms):
+        self.spans[name] = self.spans.get(name, 0.0) + elapsed_ms
+
+    def to_dict(self):
+        spans = {name: round(value, 3) for name, value in self.spans.items()}
+        spans['total'] = round((time.perf_counter() - self.start) * 1000, 3)
+        return spans
+
+
+registry = MetricsRegistry()
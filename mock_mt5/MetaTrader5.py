@@ -0,0 +1,462 @@
+# Modulo MetaTrader5 simulato, da usare al posto del pacchetto ufficiale per i test e i
+# benchmark senza un terminale: basta anteporre questa cartella al PYTHONPATH
+# (es. PYTHONPATH=mock_mt5 python agent.py). Simula posizioni, ordini pendenti, tick,
+# cronologia dei deal e retcode di order_send, con latenza configurabile.
+import bisect
+import itertools
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+# Configurazione della simulazione
+FAKE_MT5_LOGIN = int(os.environ.get('FAKE_MT5_LOGIN', 10000001))
+FAKE_MT5_SERVER = os.environ.get('FAKE_MT5_SERVER', 'FakeBroker-Demo')
+FAKE_MT5_BALANCE = float(os.environ.get('FAKE_MT5_BALANCE', 10000.0))
+# Latenza simulata di order_send e delle letture (posizioni, tick, cronologia), in millisecondi
+FAKE_MT5_ORDER_LATENCY_MS = float(os.environ.get('FAKE_MT5_ORDER_LATENCY_MS', 20.0))
+FAKE_MT5_READ_LATENCY_MS = float(os.environ.get('FAKE_MT5_READ_LATENCY_MS', 0.5))
+# Variazione casuale della latenza, come frazione del valore configurato
+FAKE_MT5_LATENCY_JITTER = float(os.environ.get('FAKE_MT5_LATENCY_JITTER', 0.2))
+# Probabilità che order_send risponda con un requote o con un rifiuto
+FAKE_MT5_REQUOTE_RATE = float(os.environ.get('FAKE_MT5_REQUOTE_RATE', 0.0))
+FAKE_MT5_REJECT_RATE = float(os.environ.get('FAKE_MT5_REJECT_RATE', 0.0))
+# Deal sintetici presenti nella cronologia all'avvio, distribuiti sugli ultimi giorni
+FAKE_MT5_HISTORY_DEALS = int(os.environ.get('FAKE_MT5_HISTORY_DEALS', 2000))
+FAKE_MT5_HISTORY_DAYS = int(os.environ.get('FAKE_MT5_HISTORY_DAYS', 30))
+# Il terminale risulta già connesso senza chiamare initialize() (come un terminale aperto)
+FAKE_MT5_AUTO_INITIALIZE = os.environ.get('FAKE_MT5_AUTO_INITIALIZE', '1') == '1'
+FAKE_MT5_SEED = os.environ.get('FAKE_MT5_SEED')
+
+__version__ = '5.0.0-fake'
+
+# Costanti usate dagli agenti (stessi valori del pacchetto ufficiale)
+ORDER_TYPE_BUY = 0
+ORDER_TYPE_SELL = 1
+ORDER_TYPE_BUY_LIMIT = 2
+ORDER_TYPE_SELL_LIMIT = 3
+ORDER_TYPE_BUY_STOP = 4
+ORDER_TYPE_SELL_STOP = 5
+
+POSITION_TYPE_BUY = 0
+POSITION_TYPE_SELL = 1
+
+TRADE_ACTION_DEAL = 1
+TRADE_ACTION_PENDING = 5
+TRADE_ACTION_SLTP = 6
+TRADE_ACTION_MODIFY = 7
+TRADE_ACTION_REMOVE = 8
+
+ORDER_FILLING_FOK = 0
+ORDER_FILLING_IOC = 1
+ORDER_FILLING_RETURN = 2
+
+ORDER_TIME_GTC = 0
+
+SYMBOL_FILLING_FOK = 1
+SYMBOL_FILLING_IOC = 2
+
+DEAL_TYPE_BUY = 0
+DEAL_TYPE_SELL = 1
+DEAL_TYPE_BALANCE = 2
+DEAL_ENTRY_IN = 0
+DEAL_ENTRY_OUT = 1
+
+TRADE_RETCODE_REQUOTE = 10004
+TRADE_RETCODE_REJECT = 10006
+TRADE_RETCODE_DONE = 10009
+TRADE_RETCODE_PLACED = 10008
+TRADE_RETCODE_INVALID = 10013
+TRADE_RETCODE_INVALID_VOLUME = 10014
+TRADE_RETCODE_INVALID_STOPS = 10016
+TRADE_RETCODE_PRICE_CHANGED = 10020
+TRADE_RETCODE_POSITION_CLOSED = 10036
+TRADE_RETCODE_INVALID_FILL = 10030
+
+RES_S_OK = 1
+RES_E_FAIL = -1
+RES_E_INVALID_PARAMS = -2
+RES_E_NOT_FOUND = -4
+RES_E_INTERNAL_FAIL = -10003
+
+TerminalInfo = namedtuple('TerminalInfo', 'connected trade_allowed build name path')
+AccountInfo = namedtuple(
+    'AccountInfo', 'login server name currency leverage balance equity profit margin margin_free margin_level'
+)
+SymbolInfo = namedtuple(
+    'SymbolInfo', 'name visible select digits point filling_mode volume_min volume_max volume_step trade_contract_size bid ask'
+)
+Tick = namedtuple('Tick', 'time time_msc bid ask last volume')
+TradePosition = namedtuple(
+    'TradePosition', 'ticket time time_msc type magic identifier symbol volume price_open price_current sl tp profit swap comment'
+)
+TradeOrder = namedtuple(
+    'TradeOrder', 'ticket time_setup type magic symbol volume_initial volume_current price_open sl tp comment'
+)
+TradeDeal = namedtuple(
+    'TradeDeal', 'ticket order time time_msc type entry magic position_id volume price commission swap profit fee symbol comment'
+)
+OrderSendResult = namedtuple('OrderSendResult', 'retcode deal order volume price bid ask comment request_id request')
+
+# Simboli simulati: prezzo iniziale, cifre decimali, dimensione del contratto e
+# modalità di riempimento supportate
+SYMBOLS = {
+    'EURUSD': (1.08500, 5, 100000, SYMBOL_FILLING_FOK | SYMBOL_FILLING_IOC),
+    'GBPUSD': (1.27000, 5, 100000, SYMBOL_FILLING_FOK | SYMBOL_FILLING_IOC),
+    'USDJPY': (150.000, 3, 100000, SYMBOL_FILLING_FOK | SYMBOL_FILLING_IOC),
+    'XAUUSD': (2000.00, 2, 100, SYMBOL_FILLING_FOK),
+    'US30': (38000.0, 1, 1, 0),
+}
+SPREAD_POINTS = 10
+
+
+# Stato del terminale simulato, condiviso da tutti i thread del processo
+class _Terminal:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.random = random.Random(FAKE_MT5_SEED)
+        self.tickets = itertools.count(100000000)
+        self.initialized = FAKE_MT5_AUTO_INITIALIZE
+        self.login = FAKE_MT5_LOGIN
+        self.server = FAKE_MT5_SERVER
+        self.balance = FAKE_MT5_BALANCE
+        self.last_error = (RES_S_OK, 'Success')
+        self.prices = {symbol: spec[0] for symbol, spec in SYMBOLS.items()}
+        self.selected = set()
+        self.positions = {}
+        self.orders = {}
+        self.deals = []
+        self.deal_times = []
+        self._generate_history()
+
+    def _generate_history(self):
+        now = int(time.time())
+        start = now - FAKE_MT5_HISTORY_DAYS * 24 * 3600
+        symbols = list(SYMBOLS)
+        # Deposito iniziale, poi operazioni alternate di apertura e chiusura
+        self._add_deal(start, DEAL_TYPE_BALANCE, DEAL_ENTRY_IN, 0, 0, 0.0, 0.0, self.balance, '', 'Deposit')
+        times = sorted(self.random.randint(start, now - 60) for _ in range(FAKE_MT5_HISTORY_DEALS))
+        for i, deal_time in enumerate(times):
+            symbol = symbols[i % len(symbols)]
+            entry = i % 2
+            profit = round(self.random.gauss(0, 50), 2) if entry == DEAL_ENTRY_OUT else 0.0
+            self._add_deal(deal_time, self.random.randint(0, 1), entry, 0, next(self.tickets), 0.1,
+                           self.prices[symbol], profit, symbol, '')
+            self.balance += profit
+
+    def _add_deal(self, deal_time, deal_type, entry, magic, position_id, volume, price, profit, symbol, comment, order=0):
+        ticket = next(self.tickets)
+        deal = TradeDeal(ticket, order or ticket, deal_time, deal_time * 1000, deal_type, entry, magic, position_id,
+                         volume, price, -0.7 * volume * 10, 0.0, profit, 0.0, symbol, comment)
+        # I deal restano ordinati per orario per interrogazioni per intervallo in O(log n)
+        index = bisect.bisect_right(self.deal_times, deal_time)
+        self.deal_times.insert(index, deal_time)
+        self.deals.insert(index, deal)
+        return deal
+
+    # Prezzo corrente del simbolo, con un piccolo random walk a ogni lettura
+    def tick(self, symbol):
+        base, digits, _, _ = SYMBOLS[symbol]
+        point = 10 ** -digits
+        price = self.prices[symbol] + self.random.randint(-3, 3) * point
+        price = self.prices[symbol] = round(max(price, base * 0.5), digits)
+        return price, round(price + SPREAD_POINTS * point, digits)
+
+    def profit(self, position_type, symbol, volume, price_open, price_current):
+        direction = 1 if position_type == POSITION_TYPE_BUY else -1
+        return round(direction * (price_current - price_open) * volume * SYMBOLS[symbol][2], 2)
+
+    # Aggiorna prezzo corrente e profitto delle posizioni indicate, con un tick per simbolo
+    def refresh_positions(self, tickets):
+        ticks = {}
+        positions = []
+        for ticket in tickets:
+            position = self.positions.get(ticket)
+            if position is None:
+                continue
+            if position.symbol not in ticks:
+                ticks[position.symbol] = self.tick(position.symbol)
+            bid, ask = ticks[position.symbol]
+            price_current = bid if position.type == POSITION_TYPE_BUY else ask
+            position = self.positions[ticket] = position._replace(
+                price_current=price_current,
+                profit=self.profit(position.type, position.symbol, position.volume, position.price_open, price_current)
+            )
+            positions.append(position)
+        return positions
+
+
+_terminal = _Terminal()
+
+
+# Riconfigura la simulazione a runtime (es. latenze o probabilità dei retcode nei benchmark)
+def configure(**settings):
+    for name, value in settings.items():
+        key = f'FAKE_MT5_{name.upper()}'
+        if key not in globals():
+            raise ValueError(f"Parametro della simulazione sconosciuto: {name}")
+        globals()[key] = value
+
+
+# Riporta il terminale simulato allo stato iniziale
+def reset():
+    global _terminal
+    _terminal = _Terminal()
+
+
+def _sleep(latency_ms):
+    if latency_ms > 0:
+        jitter = 1 + _terminal.random.uniform(-FAKE_MT5_LATENCY_JITTER, FAKE_MT5_LATENCY_JITTER)
+        time.sleep(latency_ms * max(jitter, 0) / 1000)
+
+
+def _fail(code, message):
+    _terminal.last_error = (code, message)
+    return None
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+def initialize(path=None, login=None, password=None, server=None, timeout=None, portable=False):
+    _sleep(FAKE_MT5_READ_LATENCY_MS)
+    with _terminal.lock:
+        _terminal.initialized = True
+        if login is not None:
+            _terminal.login = int(login)
+        if server is not None:
+            _terminal.server = server
+        _terminal.last_error = (RES_S_OK, 'Success')
+    return True
+
+
+def login(login, password=None, server=None, timeout=None):
+    return initialize(login=login, password=password, server=server)
+
+
+def shutdown():
+    with _terminal.lock:
+        _terminal.initialized = False
+    return True
+
+
+def version():
+    return 500, 4000, '01 Jan 2024'
+
+
+def last_error():
+    return _terminal.last_error
+
+
+def terminal_info():
+    if not _terminal.initialized:
+        return _fail(RES_E_INTERNAL_FAIL, 'Terminal: Call initialize first')
+    return TerminalInfo(True, True, 4000, 'MetaTrader 5 (fake)', os.path.dirname(os.path.abspath(__file__)))
+
+
+def account_info():
+    _sleep(FAKE_MT5_READ_LATENCY_MS)
+    with _terminal.lock:
+        if not _terminal.initialized:
+            return _fail(RES_E_INTERNAL_FAIL, 'Terminal: Call initialize first')
+        profit = round(sum(p.profit for p in _terminal.refresh_positions(list(_terminal.positions))), 2)
+        margin = round(sum(p.volume * 1000 for p in _terminal.positions.values()), 2)
+        equity = round(_terminal.balance + profit, 2)
+        return AccountInfo(_terminal.login, _terminal.server, 'Fake Account', 'USD', 100, round(_terminal.balance, 2),
+                           equity, profit, margin, round(equity - margin, 2),
+                           round(equity / margin * 100, 2) if margin else 0.0)
+
+
+def symbol_info(symbol):
+    _sleep(FAKE_MT5_READ_LATENCY_MS)
+    if symbol not in SYMBOLS:
+        return _fail(RES_E_NOT_FOUND, f'Symbol {symbol} not found')
+    with _terminal.lock:
+        _, digits, contract_size, filling_mode = SYMBOLS[symbol]
+        bid, ask = _terminal.tick(symbol)
+        return SymbolInfo(symbol, symbol in _terminal.selected, True, digits, 10 ** -digits, filling_mode,
+                          0.01, 100.0, 0.01, contract_size, bid, ask)
+
+
+def symbol_select(symbol, enable=True):
+    if symbol not in SYMBOLS:
+        return False
+    with _terminal.lock:
+        if enable:
+            _terminal.selected.add(symbol)
+        else:
+            _terminal.selected.discard(symbol)
+    return True
+
+
+def symbol_info_tick(symbol):
+    _sleep(FAKE_MT5_READ_LATENCY_MS)
+    if symbol not in SYMBOLS:
+        return _fail(RES_E_NOT_FOUND, f'Symbol {symbol} not found')
+    with _terminal.lock:
+        bid, ask = _terminal.tick(symbol)
+    now = time.time()
+    return Tick(int(now), int(now * 1000), bid, ask, 0.0, 0)
+
+
+def positions_total():
+    return len(_terminal.positions)
+
+
+def positions_get(symbol=None, group=None, ticket=None):
+    _sleep(FAKE_MT5_READ_LATENCY_MS)
+    with _terminal.lock:
+        if not _terminal.initialized:
+            return _fail(RES_E_INTERNAL_FAIL, 'Terminal: Call initialize first')
+        tickets = [ticket] if ticket is not None else list(_terminal.positions)
+        return tuple(
+            p for p in _terminal.refresh_positions(tickets) if symbol is None or p.symbol == symbol
+        )
+
+
+def orders_total():
+    return len(_terminal.orders)
+
+
+def orders_get(symbol=None, group=None, ticket=None):
+    _sleep(FAKE_MT5_READ_LATENCY_MS)
+    with _terminal.lock:
+        if not _terminal.initialized:
+            return _fail(RES_E_INTERNAL_FAIL, 'Terminal: Call initialize first')
+        return tuple(
+            order for order in _terminal.orders.values()
+            if (ticket is None or order.ticket == ticket) and (symbol is None or order.symbol == symbol)
+        )
+
+
+def history_deals_get(date_from=None, date_to=None, group=None, ticket=None, position=None):
+    _sleep(FAKE_MT5_READ_LATENCY_MS)
+    with _terminal.lock:
+        if not _terminal.initialized:
+            return _fail(RES_E_INTERNAL_FAIL, 'Terminal: Call initialize first')
+        if ticket is not None or position is not None:
+            return tuple(
+                deal for deal in _terminal.deals
+                if (ticket is None or deal.order == ticket) and (position is None or deal.position_id == position)
+            )
+        if date_from is None or date_to is None:
+            return _fail(RES_E_INVALID_PARAMS, 'Invalid arguments')
+        start = bisect.bisect_left(_terminal.deal_times, _timestamp(date_from))
+        end = bisect.bisect_right(_terminal.deal_times, _timestamp(date_to))
+        return tuple(_terminal.deals[start:end])
+
+
+def history_deals_total(date_from, date_to):
+    deals = history_deals_get(date_from, date_to)
+    return len(deals) if deals is not None else None
+
+
+def _result(retcode, request, deal=0, order=0, volume=0.0, price=0.0, comment='', bid=0.0, ask=0.0):
+    return OrderSendResult(retcode, deal, order, volume, price, bid, ask, comment, 0, request)
+
+
+def _supports_filling(symbol, type_filling):
+    flags = SYMBOLS[symbol][3]
+    if type_filling == ORDER_FILLING_FOK:
+        return bool(flags & SYMBOL_FILLING_FOK)
+    if type_filling == ORDER_FILLING_IOC:
+        return bool(flags & SYMBOL_FILLING_IOC)
+    return True
+
+
+def order_send(request):
+    _sleep(FAKE_MT5_ORDER_LATENCY_MS)
+    action = request.get('action')
+    symbol = request.get('symbol')
+
+    with _terminal.lock:
+        if not _terminal.initialized:
+            return _fail(RES_E_INTERNAL_FAIL, 'Terminal: Call initialize first')
+
+        if action == TRADE_ACTION_SLTP:
+            return _modify_position(request)
+
+        if symbol not in SYMBOLS:
+            return _result(TRADE_RETCODE_INVALID, request, comment='Invalid symbol')
+        volume = request.get('volume', 0)
+        if volume <= 0:
+            return _result(TRADE_RETCODE_INVALID_VOLUME, request, comment='Invalid volume')
+        if action == TRADE_ACTION_DEAL and not _supports_filling(symbol, request.get('type_filling', ORDER_FILLING_FOK)):
+            return _result(TRADE_RETCODE_INVALID_FILL, request, comment='Unsupported filling mode')
+
+        bid, ask = _terminal.tick(symbol)
+        draw = _terminal.random.random()
+        if draw < FAKE_MT5_REJECT_RATE:
+            return _result(TRADE_RETCODE_REJECT, request, comment='Request rejected', bid=bid, ask=ask)
+        if draw < FAKE_MT5_REJECT_RATE + FAKE_MT5_REQUOTE_RATE:
+            return _result(TRADE_RETCODE_REQUOTE, request, comment='Requote', bid=bid, ask=ask)
+
+        if action == TRADE_ACTION_PENDING:
+            return _place_order(request, bid, ask)
+        if action != TRADE_ACTION_DEAL:
+            return _result(TRADE_RETCODE_INVALID, request, comment='Unsupported action')
+        if request.get('position'):
+            return _close_position(request, bid, ask)
+        return _open_position(request, bid, ask)
+
+
+def _open_position(request, bid, ask):
+    position_type = POSITION_TYPE_BUY if request['type'] == ORDER_TYPE_BUY else POSITION_TYPE_SELL
+    price = ask if position_type == POSITION_TYPE_BUY else bid
+    ticket = next(_terminal.tickets)
+    now = time.time()
+    comment = request.get('comment', '')[:31]
+    magic = request.get('magic', 0)
+
+    _terminal.positions[ticket] = TradePosition(
+        ticket, int(now), int(now * 1000), position_type, magic, ticket, request['symbol'], request['volume'],
+        price, price, request.get('sl', 0.0), request.get('tp', 0.0), 0.0, 0.0, comment
+    )
+    deal = _terminal._add_deal(int(now), position_type, DEAL_ENTRY_IN, magic, ticket, request['volume'], price, 0.0,
+                               request['symbol'], comment, order=ticket)
+    return _result(TRADE_RETCODE_DONE, request, deal.ticket, ticket, request['volume'], price, 'Request executed', bid, ask)
+
+
+def _close_position(request, bid, ask):
+    position = _terminal.positions.get(request['position'])
+    if position is None:
+        return _result(TRADE_RETCODE_POSITION_CLOSED, request, comment='Position doesn\'t exist')
+    volume = min(request['volume'], position.volume)
+    price = bid if position.type == POSITION_TYPE_BUY else ask
+    profit = _terminal.profit(position.type, position.symbol, volume, position.price_open, price)
+
+    remaining = round(position.volume - volume, 2)
+    if remaining > 0:
+        _terminal.positions[position.ticket] = position._replace(volume=remaining)
+    else:
+        del _terminal.positions[position.ticket]
+    _terminal.balance += profit
+
+    order = next(_terminal.tickets)
+    deal_type = DEAL_TYPE_SELL if position.type == POSITION_TYPE_BUY else DEAL_TYPE_BUY
+    deal = _terminal._add_deal(int(time.time()), deal_type, DEAL_ENTRY_OUT, request.get('magic', 0), position.ticket,
+                               volume, price, profit, position.symbol, request.get('comment', '')[:31], order=order)
+    return _result(TRADE_RETCODE_DONE, request, deal.ticket, order, volume, price, 'Request executed', bid, ask)
+
+
+def _place_order(request, bid, ask):
+    ticket = next(_terminal.tickets)
+    _terminal.orders[ticket] = TradeOrder(
+        ticket, int(time.time()), request['type'], request.get('magic', 0), request['symbol'], request['volume'],
+        request['volume'], request['price'], request.get('sl', 0.0), request.get('tp', 0.0),
+        request.get('comment', '')[:31]
+    )
+    return _result(TRADE_RETCODE_DONE, request, 0, ticket, request['volume'], request['price'], 'Request executed', bid, ask)
+
+
+def _modify_position(request):
+    position = _terminal.positions.get(request.get('position'))
+    if position is None:
+        return _result(TRADE_RETCODE_POSITION_CLOSED, request, comment='Position doesn\'t exist')
+    _terminal.positions[position.ticket] = position._replace(sl=request.get('sl', 0.0), tp=request.get('tp', 0.0))
+    return _result(TRADE_RETCODE_DONE, request, comment='Request executed')
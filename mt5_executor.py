@@ -0,0 +1,108 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Priorità delle chiamate al terminale: a parità di priorità l'ordine è quello di arrivo,
+# altrimenti gli ordini passano davanti alle letture e le letture davanti alla cronologia
+PRIORITY_TRADE = 0
+PRIORITY_READ = 1
+PRIORITY_HISTORY = 2
+
+PRIORITY_NAMES = {PRIORITY_TRADE: 'trade', PRIORITY_READ: 'read', PRIORITY_HISTORY: 'history'}
+
+# Attesa massima del risultato di una chiamata (coda più esecuzione), in secondi
+MT5_CALL_TIMEOUT = float(os.environ.get('MT5_CALL_TIMEOUT', 30.0))
+
+queue_wait_ms = registry.histogram(
+    'mrc_agent_mt5_queue_wait_ms', 'Attesa in coda delle chiamate al terminale, in millisecondi', ('executor', 'priority')
+)
+execution_ms = registry.histogram(
+    'mrc_agent_mt5_execution_ms', 'Durata delle chiamate al terminale, in millisecondi', ('executor', 'priority')
+)
+
+
+# Esegue tutte le chiamate a un terminale MT5 su un unico thread dedicato, prelevandole
+# da una coda con priorità. L'API MetaTrader5 è bloccante e non è sicura da più thread:
+# i thread delle richieste HTTP e il watcher delle posizioni attendono il risultato
+# invece di chiamare il terminale, e un ordine in arrivo viene eseguito appena termina
+# la chiamata in corso, davanti alle letture già in coda.
+class MT5Executor:
+    def __init__(self, name='mt5-executor'):
+        self.name = name
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Priorità della chiamata in esecuzione (None se il thread è libero)
+        self.running_priority = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            priority, _, enqueued_at, future, function, args = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            labels = {'executor': self.name, 'priority': PRIORITY_NAMES.get(priority, priority)}
+            start = time.perf_counter()
+            queue_wait_ms.observe((start - enqueued_at) * 1000, **labels)
+            self.running_priority = priority
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self.running_priority = None
+                execution_ms.observe((time.perf_counter() - start) * 1000, **labels)
+
+    # Accoda una chiamata e restituisce un Future con il suo risultato
+    def submit(self, priority, function, *args):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((priority, next(self._sequence), time.perf_counter(), future, function, args))
+        return future
+
+    # Esegue una chiamata sul thread del terminale e ne attende il risultato. Dal thread
+    # del terminale stesso (chiamate annidate) la funzione viene eseguita direttamente.
+    # Allo scadere del timeout una chiamata non ancora iniziata viene annullata.
+    def call(self, priority, function, *args, timeout=MT5_CALL_TIMEOUT):
+        if threading.current_thread() is self._thread:
+            return function(*args)
+
+        future = self.submit(priority, function, *args)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            if future.cancel():
+                logger.error(f"Chiamata {getattr(function, '__name__', function)} annullata: terminale occupato oltre {timeout} secondi")
+            else:
+                logger.error(f"Chiamata {getattr(function, '__name__', function)} ancora in esecuzione dopo {timeout} secondi")
+            raise
+
+    # True se il thread del terminale sta eseguendo un ordine
+    def is_trading(self):
+        return self.running_priority == PRIORITY_TRADE
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'queued': self._queue.qsize(),
+            'running': PRIORITY_NAMES.get(self.running_priority, self.running_priority)
+        }
+
+
+# Executor del terminale inizializzato nel processo (agente principale o worker)
+mt5_executor = MT5Executor()
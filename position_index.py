@@ -0,0 +1,96 @@
+import threading
+import time
+
+# Numero massimo di posizioni chiuse ricordate per le richieste incrementali
+MAX_TOMBSTONES = 10000
+
+
+# Indice in memoria delle posizioni aperte, per ticket, con numero di versione.
+# Le posizioni non cambiate rispetto all'ultimo snapshot non vengono riconvertite.
+class PositionIndex:
+    def __init__(self, to_dict):
+        self.to_dict = to_dict
+
+        # La versione iniziale dipende dall'orario di avvio, così un client che
+        # conserva una versione precedente a un riavvio riceve uno snapshot completo
+        self.version = int(time.time() * 1000)
+        self.updated_at = None
+
+        self._raw = {}
+        self._positions = {}
+        self._versions = {}
+        self._removed = {}
+        self._min_version = self.version
+        self._lock = threading.Lock()
+
+    # Aggiorna l'indice con le posizioni lette dal terminale e restituisce la lista corrente
+    def update(self, raw_positions):
+        with self._lock:
+            current = {position.ticket: position for position in raw_positions}
+            changed = []
+
+            for ticket, raw in current.items():
+                if self._raw.get(ticket) != raw:
+                    changed.append(ticket)
+
+            removed = [ticket for ticket in self._raw if ticket not in current]
+
+            if changed or removed:
+                self.version += 1
+                for ticket in changed:
+                    self._raw[ticket] = current[ticket]
+                    self._positions[ticket] = self.to_dict(current[ticket])
+                    self._versions[ticket] = self.version
+                    self._removed.pop(ticket, None)
+                for ticket in removed:
+                    del self._raw[ticket]
+                    del self._positions[ticket]
+                    del self._versions[ticket]
+                    self._removed[ticket] = self.version
+                self._prune_tombstones()
+
+            self.updated_at = time.monotonic()
+            return list(self._positions.values())
+
+    # Svuota l'indice (es. cambio di account): i client ricevono uno snapshot completo
+    def reset(self):
+        with self._lock:
+            self._raw.clear()
+            self._positions.clear()
+            self._versions.clear()
+            self._removed.clear()
+            self.version += 1
+            self._min_version = self.version
+            self.updated_at = None
+
+    # Elimina le posizioni chiuse più vecchie oltre il limite
+    def _prune_tombstones(self):
+        if len(self._removed) <= MAX_TOMBSTONES:
+            return
+        oldest = sorted(self._removed.items(), key=lambda item: item[1])
+        for ticket, version in oldest[:len(self._removed) - MAX_TOMBSTONES]:
+            del self._removed[ticket]
+            self._min_version = max(self._min_version, version)
+
+    # Restituisce le variazioni successive a una versione, o uno snapshot completo
+    # se la versione non è più ricostruibile
+    def changes_since(self, since):
+        with self._lock:
+            if since is None or since < self._min_version or since > self.version:
+                return {
+                    'version': self.version,
+                    'full': True,
+                    'changed': list(self._positions.values()),
+                    'removed': []
+                }
+
+            return {
+                'version': self.version,
+                'full': False,
+                'changed': [self._positions[ticket] for ticket, version in self._versions.items() if version > since],
+                'removed': [ticket for ticket, version in self._removed.items() if version > since]
+            }
+
+    # Indica se l'indice è stato aggiornato di recente (ad esempio dal watcher)
+    def is_fresh(self, max_age):
+        return self.updated_at is not None and time.monotonic() - self.updated_at <= max_age
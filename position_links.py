@@ -0,0 +1,190 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Per quanto tempo conservare le aperture del master inviate dal server centrale (secondi)
+MASTER_OPEN_RETENTION = float(os.environ.get('MASTER_OPEN_RETENTION', 86400))
+
+# Stati di un'apertura del master inviata dal server centrale: la replica sugli slave
+# viene presa in carico una sola volta, dalla risposta dell'agente o dallo stream
+MASTER_OPEN_PENDING = 'pending'
+MASTER_OPEN_REPLICATED = 'replicated'
+
+# Stati di un collegamento tra posizione del master e posizione dello slave
+LINK_OPEN = 'open'
+# Chiusura dello slave in corso: il collegamento è riservato a chi l'ha preso con take_open
+LINK_CLOSING = 'closing'
+LINK_CLOSED = 'closed'
+
+LINK_FIELDS = (
+    'id', 'group_id', 'master_server_id', 'master_account_id', 'master_ticket',
+    'slave_server_id', 'slave_account_id', 'slave_ticket', 'idempotency_key',
+    'volume', 'copy_sl_tp', 'status', 'created_at', 'updated_at'
+)
+
+
+# Mappatura persistente (SQLite, WAL) tra i ticket delle posizioni del master e quelli
+# delle posizioni aperte sugli slave, usata per propagare chiusure e modifiche
+# direttamente ai ticket giusti senza interrogare le posizioni degli slave.
+# I ticket degli slave vengono registrati quando arriva l'esito dell'ordine di apertura.
+class PositionLinks:
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS position_links (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_id TEXT NOT NULL,
+                master_server_id TEXT NOT NULL,
+                master_account_id TEXT NOT NULL,
+                master_ticket INTEGER,
+                slave_server_id TEXT NOT NULL,
+                slave_account_id TEXT NOT NULL,
+                slave_ticket INTEGER,
+                idempotency_key TEXT UNIQUE,
+                volume REAL,
+                copy_sl_tp INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS position_links_master "
+            "ON position_links (master_server_id, master_account_id, master_ticket, status)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS position_links_group ON position_links (group_id)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS master_opens (
+                idempotency_key TEXT PRIMARY KEY,
+                master_server_id TEXT NOT NULL,
+                master_account_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _to_dict(self, row):
+        link = dict(zip(LINK_FIELDS, row))
+        link['copy_sl_tp'] = bool(link['copy_sl_tp'])
+        return link
+
+    # Registra le posizioni degli slave di un'operazione del master. slaves è una lista di
+    # {'server_id', 'account_id', 'idempotency_key', 'volume', 'copy_sl_tp'}.
+    def add(self, group_id, master_server_id, master_account_id, master_ticket, slaves):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT OR IGNORE INTO position_links
+                    (group_id, master_server_id, master_account_id, master_ticket, slave_server_id, slave_account_id,
+                     idempotency_key, volume, copy_sl_tp, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (group_id, master_server_id, master_account_id, master_ticket, slave['server_id'], slave['account_id'],
+                     slave['idempotency_key'], slave['volume'], int(slave['copy_sl_tp']), LINK_OPEN, now, now)
+                    for slave in slaves
+                ]
+            )
+
+    # Registra un'apertura del master prima di inviarla all'agente (le aperture più
+    # vecchie di MASTER_OPEN_RETENTION vengono eliminate al massimo una volta all'ora)
+    def add_master_open(self, idempotency_key, master_server_id, master_account_id):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO master_opens (idempotency_key, master_server_id, master_account_id, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (idempotency_key, master_server_id, master_account_id, MASTER_OPEN_PENDING, now)
+            )
+            if now - self._last_purge >= 3600:
+                self._last_purge = now
+                self._conn.execute("DELETE FROM master_opens WHERE created_at < ?", (now - MASTER_OPEN_RETENTION,))
+
+    # Prende in carico la replica di un'apertura del master: True solo per il primo
+    # chiamante (la risposta di open_position o, se questa è andata persa, lo stream)
+    def claim_master_open(self, idempotency_key, master_server_id, master_account_id):
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE master_opens SET status = ? "
+                "WHERE idempotency_key = ? AND master_server_id = ? AND master_account_id = ? AND status = ?",
+                (MASTER_OPEN_REPLICATED, idempotency_key, master_server_id, master_account_id, MASTER_OPEN_PENDING)
+            )
+        return cursor.rowcount == 1
+
+    # Registra il ticket della posizione aperta sullo slave dall'esito dell'ordine
+    # (chiamata dalla coda di replica per ogni ordine eseguito). Restituisce il
+    # collegamento aggiornato, None se l'ordine non apre una posizione collegata: se è
+    # già chiuso la posizione del master è stata chiusa prima dell'apertura dello slave.
+    def record_fill(self, idempotency_key, result):
+        if not result or result.get('order') is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                f"""
+                UPDATE position_links SET slave_ticket = ?, volume = COALESCE(?, volume), updated_at = ?
+                WHERE idempotency_key = ?
+                RETURNING {', '.join(LINK_FIELDS)}
+                """,
+                (result['order'], result.get('volume'), time.time(), idempotency_key)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    # Posizioni degli slave ancora aperte collegate a una posizione del master
+    def find(self, master_server_id, master_account_id, master_ticket):
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT {', '.join(LINK_FIELDS)} FROM position_links
+                WHERE master_server_id = ? AND master_account_id = ? AND master_ticket = ?
+                  AND status = ? AND slave_ticket IS NOT NULL
+                ORDER BY id
+                """,
+                (master_server_id, master_account_id, master_ticket, LINK_OPEN)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    # Riserva per la chiusura i collegamenti aperti di una posizione del master con un
+    # unico UPDATE atomico: se più processi gestiscono la chiusura della stessa posizione
+    # (es. worker API e worker di replica), solo uno ottiene i collegamenti. Quelli con
+    # lo slave già aperto passano a closing e dopo l'invio vanno segnati come chiusi o
+    # restituiti con set_status; quelli in attesa dell'apertura dello slave (senza
+    # ticket) vengono chiusi subito, e record_fill li segnala se l'apertura arriva dopo.
+    def take_open(self, master_server_id, master_account_id, master_ticket):
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                UPDATE position_links
+                SET status = CASE WHEN slave_ticket IS NULL THEN ? ELSE ? END, updated_at = ?
+                WHERE master_server_id = ? AND master_account_id = ? AND master_ticket = ? AND status = ?
+                RETURNING {', '.join(LINK_FIELDS)}
+                """,
+                (LINK_CLOSED, LINK_CLOSING, time.time(), master_server_id, master_account_id, master_ticket, LINK_OPEN)
+            ).fetchall()
+        return sorted((self._to_dict(row) for row in rows), key=lambda link: link['id'])
+
+    def set_status(self, link_ids, status):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE position_links SET status = ?, updated_at = ? WHERE id = ?",
+                [(status, now, link_id) for link_id in link_ids]
+            )
+
+    # Aggiorna il volume residuo della posizione dello slave dopo una chiusura parziale
+    def reduce_volume(self, link_id, closed_volume):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE position_links SET volume = MAX(volume - ?, 0), updated_at = ? WHERE id = ?",
+                (closed_volume, time.time(), link_id)
+            )
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import threading
+
+import requests
+
+from agent_client import agent_clients, AGENT_CONNECT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Configurazione degli stream di eventi dagli agenti
+POSITION_STREAM_ENABLED = os.environ.get('POSITION_STREAM_ENABLED', '1') == '1'
+# Gli agenti inviano un keep-alive ogni 15 secondi: oltre questo tempo la connessione è morta
+POSITION_STREAM_READ_TIMEOUT = float(os.environ.get('POSITION_STREAM_READ_TIMEOUT', 45.0))
+POSITION_STREAM_MAX_BACKOFF = float(os.environ.get('POSITION_STREAM_MAX_BACKOFF', 30.0))
+
+
+# Legge uno stream Server-Sent Events e restituisce le coppie (evento, dati)
+def parse_sse(lines):
+    event_type = 'message'
+    data_lines = []
+    for line in lines:
+        if line is None:
+            continue
+        if line == '':
+            if data_lines:
+                yield event_type, '\n'.join(data_lines)
+            event_type = 'message'
+            data_lines = []
+        elif line.startswith(':'):
+            continue
+        elif line.startswith('event:'):
+            event_type = line[6:].strip()
+        elif line.startswith('data:'):
+            data_lines.append(line[5:].lstrip())
+
+
+# Connessione persistente verso lo stream di eventi di un agente
+class PositionStreamListener:
+    def __init__(self, server_id, url, on_event):
+        self.server_id = server_id
+        self.url = url.rstrip('/')
+        self.on_event = on_event
+        self.connected = False
+
+        self._stop = threading.Event()
+        self._response = None
+        self._thread = threading.Thread(target=self._run, name=f'position-stream-{server_id}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self._listen()
+                backoff = 1.0
+            except requests.RequestException as e:
+                logger.debug(f"Stream eventi di {self.url} non disponibile: {e}")
+            except Exception as e:
+                logger.error(f"Errore nello stream eventi di {self.url}: {e}")
+            finally:
+                self.connected = False
+
+            if self._stop.wait(backoff):
+                break
+            backoff = min(backoff * 2, POSITION_STREAM_MAX_BACKOFF)
+
+    def _listen(self):
+        client = agent_clients.get(self.server_id, self.url)
+        self._response = client.session.get(
+            f"{self.url}/api/events",
+            stream=True,
+            timeout=(AGENT_CONNECT_TIMEOUT, POSITION_STREAM_READ_TIMEOUT)
+        )
+        with self._response as response:
+            response.raise_for_status()
+            self.connected = True
+            logger.info(f"Stream eventi connesso: {self.url}")
+
+            for event_type, data in parse_sse(response.iter_lines(decode_unicode=True)):
+                if self._stop.is_set():
+                    break
+                try:
+                    event = json.loads(data)
+                except ValueError:
+                    logger.warning(f"Evento non valido da {self.url}: {data}")
+                    continue
+                try:
+                    self.on_event(self.server_id, event)
+                except Exception as e:
+                    logger.error(f"Errore nella gestione dell'evento {event_type} da {self.url}: {e}")
+
+
+# Gestisce un listener per ogni server registrato
+class PositionStreamManager:
+    def __init__(self):
+        self._listeners = {}
+        self._lock = threading.Lock()
+
+    # Allinea i listener ai server registrati ({server_id: url})
+    def sync(self, server_urls, on_event):
+        if not POSITION_STREAM_ENABLED:
+            return
+
+        with self._lock:
+            for server_id in list(self._listeners):
+                listener = self._listeners[server_id]
+                if server_urls.get(server_id, '').rstrip('/') != listener.url:
+                    listener.stop()
+                    del self._listeners[server_id]
+
+            for server_id, url in server_urls.items():
+                if server_id not in self._listeners:
+                    listener = PositionStreamListener(server_id, url, on_event)
+                    self._listeners[server_id] = listener
+                    listener.start()
+
+    def status(self):
+        with self._lock:
+            return {server_id: listener.connected for server_id, listener in self._listeners.items()}
+
+
+position_streams = PositionStreamManager()
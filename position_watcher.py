@@ -0,0 +1,125 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Campi che, se cambiano, generano un evento di modifica
+# (prezzo corrente e profitto cambiano a ogni tick e non vengono notificati)
+WATCHED_FIELDS = ('volume', 'sl', 'tp')
+
+# Massimo numero di eventi in attesa per un sottoscrittore lento
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+# Confronta due snapshot {ticket: posizione} e restituisce gli eventi open/close/modify
+def diff_positions(previous, current):
+    events = []
+
+    for ticket, position in current.items():
+        old = previous.get(ticket)
+        if old is None:
+            events.append({'event': 'open', 'position': position})
+        elif any(old.get(field) != position.get(field) for field in WATCHED_FIELDS):
+            events.append({'event': 'modify', 'position': position, 'previous': old})
+
+    for ticket, position in previous.items():
+        if ticket not in current:
+            events.append({'event': 'close', 'position': position})
+
+    return events
+
+
+# Thread che interroga il terminale ad alta frequenza e notifica le variazioni delle posizioni
+class PositionWatcher:
+    def __init__(self, fetch_positions, fetch_login, interval):
+        self.fetch_positions = fetch_positions
+        self.fetch_login = fetch_login
+        self.interval = interval
+
+        self._snapshot = None
+        # Incrementato da reset(): un polling iniziato prima del reset viene scartato
+        self._generation = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='position-watcher', daemon=True)
+            self._thread.start()
+        logger.info(f"Watcher delle posizioni avviato (intervallo {self.interval * 1000:.0f} ms)")
+
+    def stop(self):
+        self._stop.set()
+
+    # Registra un nuovo sottoscrittore e restituisce la sua coda di eventi
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        self.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    # Inoltra un evento a tutti i sottoscrittori
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                logger.warning("Coda eventi di un sottoscrittore piena, evento scartato")
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Errore nel watcher delle posizioni: {e}")
+            elapsed = time.monotonic() - started
+            self._stop.wait(max(0.0, self.interval - elapsed))
+
+    # Dimentica lo snapshot (es. cambio di account): il polling successivo fa solo da
+    # riferimento, senza notificare le posizioni del nuovo account come aperture
+    def reset(self):
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+
+    # Esegue un singolo ciclo di polling e pubblica gli eventi rilevati
+    def poll(self):
+        generation = self._generation
+        success, message, positions = self.fetch_positions()
+        if not success or generation != self._generation:
+            return []
+
+        current = {position['ticket']: position for position in positions}
+
+        # Il primo snapshot fa solo da riferimento: le posizioni già aperte non vengono notificate
+        if self._snapshot is None:
+            self._snapshot = current
+            return []
+
+        events = diff_positions(self._snapshot, current)
+        self._snapshot = current
+
+        if events:
+            login = self.fetch_login()
+            now = time.time()
+            for event in events:
+                event['login'] = login
+                event['time'] = now
+                self.publish(event)
+
+        return events
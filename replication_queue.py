@@ -0,0 +1,360 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fanout import dispatch_orders
+
+logger = logging.getLogger(__name__)
+
+# Configurazione della coda di replica degli ordini degli slave
+REPLICATION_DB = os.environ.get('REPLICATION_DB', 'replication.db')
+REPLICATION_MAX_WORKERS = int(os.environ.get('REPLICATION_MAX_WORKERS', 16))
+REPLICATION_RETRY_INTERVAL = float(os.environ.get('REPLICATION_RETRY_INTERVAL', 1.0))
+REPLICATION_MAX_BACKOFF = float(os.environ.get('REPLICATION_MAX_BACKOFF', 30.0))
+REPLICATION_BATCH_SIZE = int(os.environ.get('REPLICATION_BATCH_SIZE', 20))
+# Un ordine più vecchio di così non viene più inviato: il mercato nel frattempo è cambiato
+REPLICATION_MAX_AGE = float(os.environ.get('REPLICATION_MAX_AGE', 300.0))
+# Un ordine "in invio" da più di così è considerato perso (es. processo terminato)
+REPLICATION_SENDING_TIMEOUT = float(os.environ.get('REPLICATION_SENDING_TIMEOUT', 60.0))
+# Conservazione degli ordini completati, in secondi
+REPLICATION_RETENTION = float(os.environ.get('REPLICATION_RETENTION', 7 * 24 * 3600))
+
+# Stati di un ordine in coda
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_EXPIRED = 'expired'
+STATUS_CANCELLED = 'cancelled'
+
+
+# Coda persistente (SQLite, WAL) degli ordini destinati agli slave. Gli ordini di ogni
+# slave vengono consegnati nell'ordine di inserimento; quelli non consegnati perché
+# l'agente non risponde restano in coda e vengono ritentati in background, con la
+# stessa chiave di idempotenza: l'agente scarta gli ordini già eseguiti.
+class ReplicationQueue:
+    def __init__(self, path, resolve_url):
+        # resolve_url(server_id) restituisce l'URL attuale dell'agente o None
+        self.path = path
+        self.resolve_url = resolve_url
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS replication_orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                server_id TEXT NOT NULL,
+                account_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                next_attempt_at REAL NOT NULL,
+                message TEXT,
+                result TEXT
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS replication_orders_lane ON replication_orders (status, server_id, account_id, id)"
+        )
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=REPLICATION_MAX_WORKERS, thread_name_prefix='replication')
+        self._draining = set()
+        self._draining_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_purge = 0.0
+        self._listeners = []
+
+    # Registra una funzione chiamata con (idempotency_key, risultato) per ogni ordine
+    # eseguito con successo dall'agente
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    # Avvia il thread che consegna gli ordini rimasti in coda
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='replication-queue', daemon=True)
+            self._thread.start()
+
+    def _execute_in_transaction(self, work):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    # Accoda in modo persistente gli ordini degli slave ({'server_id', 'account_id',
+    # 'url', 'payload'} ed eventualmente 'idempotency_key') e li invia subito, in
+    # parallelo. Gli ordini di uno slave che ha ancora ordini precedenti in coda
+    # restano in coda per non superarli.
+    # Restituisce i risultati nell'ordine degli ordini.
+    def submit(self, orders):
+        now = time.time()
+
+        def insert():
+            entries = []
+            for order in orders:
+                key = order.get('idempotency_key') or uuid.uuid4().hex[:16]
+                busy = self._conn.execute(
+                    "SELECT 1 FROM replication_orders WHERE status IN (?, ?) AND server_id = ? AND account_id = ? LIMIT 1",
+                    (STATUS_PENDING, STATUS_SENDING, order['server_id'], order['account_id'])
+                ).fetchone() is not None
+                payload = dict(order['payload'], idempotency_key=key, delivery_attempt=1)
+                cursor = self._conn.execute(
+                    """
+                    INSERT INTO replication_orders
+                        (idempotency_key, server_id, account_id, payload, status, attempts, created_at, updated_at, next_attempt_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (key, order['server_id'], order['account_id'], json.dumps(payload),
+                     STATUS_PENDING if busy else STATUS_SENDING, 0 if busy else 1, now, now, now)
+                )
+                entries.append({
+                    'id': cursor.lastrowid,
+                    'key': key,
+                    'attempts': 1,
+                    'ready': not busy,
+                    'order': dict(order, payload=payload)
+                })
+            return entries
+
+        entries = self._execute_in_transaction(insert) if orders else []
+        ready = [entry for entry in entries if entry['ready']]
+
+        ready_results = dispatch_orders([entry['order'] for entry in ready])
+        if ready:
+            self._complete(list(zip(ready, ready_results)))
+
+        ready_results = iter(ready_results)
+        order_results = []
+        for entry in entries:
+            if entry['ready']:
+                result = next(ready_results)
+                if not result['delivered']:
+                    result = dict(result, queued=True, message=f"{result['message']} (nuovo tentativo in background)")
+            else:
+                result = {
+                    "success": False,
+                    "message": "Ordine in coda dietro ordini precedenti dello slave",
+                    "result": None,
+                    "latency_ms": 0,
+                    "delivered": False,
+                    "queued": True
+                }
+            order_results.append(dict(result, idempotency_key=entry['key']))
+
+        return order_results
+
+    # Annulla gli ordini in coda mai inviati con le chiavi indicate. Quelli già inviati
+    # almeno una volta (esito incerto) o in invio non vengono toccati: il loro esito
+    # arriva comunque ai listener. Restituisce le chiavi annullate.
+    def cancel(self, idempotency_keys):
+        if not idempotency_keys:
+            return []
+        now = time.time()
+
+        def update():
+            return [
+                row[0] for row in self._conn.execute(
+                    f"""
+                    UPDATE replication_orders SET status = ?, message = ?, updated_at = ?
+                    WHERE status = ? AND attempts = 0 AND idempotency_key IN ({', '.join('?' * len(idempotency_keys))})
+                    RETURNING idempotency_key
+                    """,
+                    (STATUS_CANCELLED, "Ordine annullato prima della consegna", now, STATUS_PENDING, *idempotency_keys)
+                ).fetchall()
+            ]
+
+        return self._execute_in_transaction(update)
+
+    # Registra l'esito degli invii: gli ordini consegnati sono completati (anche se
+    # rifiutati dal broker), gli altri tornano in coda con un'attesa crescente
+    def _complete(self, pairs):
+        now = time.time()
+
+        def update():
+            for entry, result in pairs:
+                if result['delivered']:
+                    self._conn.execute(
+                        "UPDATE replication_orders SET status = ?, message = ?, result = ?, updated_at = ? WHERE id = ?",
+                        (STATUS_DONE if result['success'] else STATUS_FAILED, result['message'],
+                         json.dumps(result['result']), now, entry['id'])
+                    )
+                else:
+                    backoff = min(REPLICATION_RETRY_INTERVAL * 2 ** (entry['attempts'] - 1), REPLICATION_MAX_BACKOFF)
+                    self._conn.execute(
+                        "UPDATE replication_orders SET status = ?, message = ?, updated_at = ?, next_attempt_at = ? WHERE id = ?",
+                        (STATUS_PENDING, result['message'], now, now + backoff, entry['id'])
+                    )
+
+        self._execute_in_transaction(update)
+        # Gli ordini in attesa dietro a questi possono ora essere consegnati
+        self._wake.set()
+
+        for entry, result in pairs:
+            if result['delivered'] and result['success']:
+                for listener in self._listeners:
+                    try:
+                        listener(entry['key'], result['result'])
+                    except Exception as e:
+                        logger.error(f"Errore nel listener della coda di replica: {e}")
+
+    def _run(self):
+        logger.info("Coda di replica avviata")
+        while True:
+            self._wake.wait(REPLICATION_RETRY_INTERVAL)
+            self._wake.clear()
+            try:
+                self._schedule()
+            except Exception as e:
+                logger.error(f"Errore nella coda di replica: {e}")
+
+    # Avvia in parallelo lo svuotamento di ogni slave con ordini pronti da consegnare
+    def _schedule(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE replication_orders SET status = ?, next_attempt_at = ? WHERE status = ? AND updated_at < ?",
+                (STATUS_PENDING, now, STATUS_SENDING, now - REPLICATION_SENDING_TIMEOUT)
+            )
+            if now - self._last_purge > 3600:
+                self._conn.execute(
+                    "DELETE FROM replication_orders WHERE status IN (?, ?, ?, ?) AND updated_at < ?",
+                    (STATUS_DONE, STATUS_FAILED, STATUS_EXPIRED, STATUS_CANCELLED, now - REPLICATION_RETENTION)
+                )
+                self._last_purge = now
+
+            # Primo ordine ancora aperto di ogni slave: lo slave è pronto se non è già in
+            # invio e l'attesa prima del nuovo tentativo è trascorsa
+            heads = self._conn.execute(
+                """
+                SELECT server_id, account_id FROM replication_orders
+                WHERE id IN (
+                    SELECT MIN(id) FROM replication_orders
+                    WHERE status IN (?, ?) GROUP BY server_id, account_id
+                ) AND status = ? AND next_attempt_at <= ?
+                """,
+                (STATUS_PENDING, STATUS_SENDING, STATUS_PENDING, now)
+            ).fetchall()
+
+        for lane in heads:
+            with self._draining_lock:
+                if lane in self._draining:
+                    continue
+                self._draining.add(lane)
+            self._executor.submit(self._drain_lane, lane)
+
+    # Consegna in ordine gli ordini in coda di uno slave, a gruppi in un'unica richiesta
+    # batch, finché la coda è vuota o l'agente non risponde
+    def _drain_lane(self, lane):
+        server_id, account_id = lane
+        try:
+            while True:
+                entries = self._claim(server_id, account_id)
+                if not entries:
+                    break
+
+                url = self.resolve_url(server_id)
+                if url is None:
+                    self._complete([
+                        (entry, {"success": False, "message": "Server non trovato", "result": None, "delivered": True})
+                        for entry in entries
+                    ])
+                    continue
+
+                results = dispatch_orders([
+                    {
+                        "server_id": server_id,
+                        "url": url,
+                        "payload": dict(entry['payload'], delivery_attempt=entry['attempts'])
+                    }
+                    for entry in entries
+                ])
+                self._complete(list(zip(entries, results)))
+
+                delivered = sum(1 for r in results if r['delivered'])
+                logger.info(f"Coda di replica: {delivered}/{len(entries)} ordini consegnati a {server_id}/{account_id}")
+                if delivered < len(entries):
+                    break
+        except Exception as e:
+            logger.error(f"Errore nella consegna degli ordini in coda per {server_id}/{account_id}: {e}")
+        finally:
+            with self._draining_lock:
+                self._draining.discard(lane)
+
+    # Prende in carico i primi ordini in coda di uno slave, scartando quelli scaduti
+    def _claim(self, server_id, account_id):
+        now = time.time()
+
+        def claim():
+            rows = self._conn.execute(
+                """
+                SELECT id, idempotency_key, payload, status, attempts, created_at, next_attempt_at
+                FROM replication_orders
+                WHERE status IN (?, ?) AND server_id = ? AND account_id = ?
+                ORDER BY id LIMIT ?
+                """,
+                (STATUS_PENDING, STATUS_SENDING, server_id, account_id, REPLICATION_BATCH_SIZE)
+            ).fetchall()
+            if not rows or rows[0][3] != STATUS_PENDING or rows[0][6] > now:
+                return []
+
+            entries = []
+            for order_id, key, payload, status, attempts, created_at, next_attempt_at in rows:
+                if status != STATUS_PENDING:
+                    break
+                if now - created_at > REPLICATION_MAX_AGE:
+                    self._conn.execute(
+                        "UPDATE replication_orders SET status = ?, message = ?, updated_at = ? WHERE id = ?",
+                        (STATUS_EXPIRED, "Ordine scaduto prima della consegna", now, order_id)
+                    )
+                    logger.warning(f"Ordine {key} per {server_id}/{account_id} scaduto prima della consegna")
+                    continue
+                self._conn.execute(
+                    "UPDATE replication_orders SET status = ?, attempts = ?, updated_at = ? WHERE id = ?",
+                    (STATUS_SENDING, attempts + 1, now, order_id)
+                )
+                entries.append({'id': order_id, 'key': key, 'attempts': attempts + 1, 'payload': json.loads(payload)})
+            return entries
+
+        return self._execute_in_transaction(claim)
+
+    # Ordini per stato e slave con ordini ancora da consegnare
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM replication_orders GROUP BY status"
+            ).fetchall())
+            backlog = [
+                {
+                    'server_id': server_id,
+                    'account_id': account_id,
+                    'pending': pending,
+                    'oldest_at': oldest_at,
+                    'last_message': message
+                }
+                for server_id, account_id, pending, oldest_at, message in self._conn.execute(
+                    """
+                    SELECT server_id, account_id, COUNT(*), MIN(created_at), MAX(message)
+                    FROM replication_orders WHERE status IN (?, ?)
+                    GROUP BY server_id, account_id
+                    """,
+                    (STATUS_PENDING, STATUS_SENDING)
+                )
+            ]
+        return {'counts': counts, 'backlog': backlog}
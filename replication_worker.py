@@ -0,0 +1,12 @@
+import os
+
+# Worker di replica del server centrale: riceve gli eventi dagli agenti e replica le
+# operazioni dei master, consegna la coda di replica ed esegue l'heartbeat degli agenti,
+# in un processo separato dai worker API. Di norma viene avviato da gunicorn.conf.py;
+# REPLICATION_WORKERS e REPLICATION_WORKER_INDEX ripartiscono i server tra più worker.
+os.environ['HUB_ROLE'] = 'replication'
+
+import app
+
+if __name__ == '__main__':
+    app.run_replication_worker()
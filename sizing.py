@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from agent_client import agent_clients
+
+logger = logging.getLogger(__name__)
+
+# Modalità di calcolo del volume degli slave
+SIZE_MODE_FIXED = 'fixed'
+SIZE_MODE_PROPORTIONAL = 'proportional'
+SIZE_MODE_EQUITY_RATIO = 'equity_ratio'
+SIZE_MODES = (SIZE_MODE_FIXED, SIZE_MODE_PROPORTIONAL, SIZE_MODE_EQUITY_RATIO)
+
+# Validità dei limiti di volume dei simboli in cache, in secondi
+SIZING_CONSTRAINTS_TTL = float(os.environ.get('SIZING_CONSTRAINTS_TTL', 3600))
+
+# Limiti usati finché quelli reali del simbolo non sono noti
+DEFAULT_VOLUME_STEP = 0.01
+DEFAULT_VOLUME_MIN = 0.01
+DEFAULT_VOLUME_MAX = np.inf
+
+
+# Cache dei limiti di volume (minimo, massimo, passo) per account e simbolo. Un simbolo
+# non ancora noto viene richiesto all'agente in background, senza rallentare l'ordine
+# in corso: l'agente arrotonda comunque il volume prima dell'invio.
+class SymbolConstraintCache:
+    def __init__(self, ttl=SIZING_CONSTRAINTS_TTL):
+        self.ttl = ttl
+        self._constraints = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sizing')
+
+    # Restituisce (volume_min, volume_max, volume_step) oppure None se non ancora noto
+    def get(self, server_id, url, account_number, symbol):
+        key = (server_id, str(account_number), symbol)
+        entry = self._constraints.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+
+        with self._lock:
+            if key not in self._pending:
+                self._pending.add(key)
+                self._executor.submit(self._fetch, key, url)
+        return entry[1] if entry is not None else None
+
+    def _fetch(self, key, url):
+        server_id, account_number, symbol = key
+        try:
+            success, message, data = agent_clients.get(server_id, url).get_symbol(symbol, account_number)
+            if success:
+                constraints = (data['volume_min'], data['volume_max'], data['volume_step'])
+                with self._lock:
+                    self._constraints[key] = (time.monotonic(), constraints)
+            else:
+                logger.warning(f"Limiti di volume di {symbol} non disponibili per l'account {account_number}: {message}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    # Rimuove i limiti in cache di un server
+    def invalidate(self, server_id):
+        with self._lock:
+            for key in [k for k in self._constraints if k[0] == server_id]:
+                del self._constraints[key]
+
+
+# Calcola in un unico passaggio vettoriale i volumi di tutti gli slave di un'operazione
+# del master, limitati al volume massimo dello slave, arrotondati per difetto al passo
+# del simbolo di ogni slave e limitati al lotto massimo. Un volume inferiore al lotto
+# minimo diventa 0 (ordine da non inviare), come quello di uno slave con size_ratio
+# non positivo.
+#
+# slaves è una lista di dizionari con 'size_mode', 'size_ratio', 'fixed_volume',
+# 'max_volume' (facoltativo), 'equity' e 'constraints' ((volume_min, volume_max,
+# volume_step) oppure None).
+def compute_slave_volumes(master_volume, master_equity, slaves):
+    if not slaves:
+        return []
+
+    modes = np.array([s.get('size_mode') or SIZE_MODE_PROPORTIONAL for s in slaves])
+    ratios = np.array([1.0 if s.get('size_ratio') is None else float(s['size_ratio']) for s in slaves])
+    fixed = np.array([float(s.get('fixed_volume') or 0.0) for s in slaves])
+    max_volumes = np.array([float(s.get('max_volume') or np.inf) for s in slaves])
+    equities = np.array([s.get('equity') or np.nan for s in slaves], dtype=float)
+
+    constraints = np.array([
+        s['constraints'] if s.get('constraints') else (DEFAULT_VOLUME_MIN, DEFAULT_VOLUME_MAX, DEFAULT_VOLUME_STEP)
+        for s in slaves
+    ], dtype=float)
+    volume_min, volume_max, volume_step = constraints.T
+
+    # Un rapporto nullo o negativo non copia l'operazione (volume 0)
+    volumes = float(master_volume) * np.where(ratios > 0, ratios, 0.0)
+
+    # Equity ratio: il volume segue il rapporto tra l'equity dello slave e quella del
+    # master. Se una delle due non è nota il volume è 0: copiare con il volume del
+    # master sovradimensionerebbe gli slave più piccoli.
+    if master_equity:
+        equity_ratio = np.where(np.isnan(equities), 0.0, equities / float(master_equity))
+    else:
+        equity_ratio = np.zeros(len(slaves))
+    volumes = np.where(modes == SIZE_MODE_EQUITY_RATIO, volumes * equity_ratio, volumes)
+    volumes = np.where(modes == SIZE_MODE_FIXED, fixed, volumes)
+    volumes = np.minimum(volumes, max_volumes)
+
+    volumes = np.floor(volumes / volume_step + 1e-9) * volume_step
+    volumes = np.minimum(volumes, volume_max)
+    volumes = np.where(volumes < volume_min - 1e-9, 0.0, volumes)
+
+    # Elimina gli errori di rappresentazione (es. 0.30000000000000004)
+    decimals = np.maximum(0, -np.floor(np.log10(volume_step))).astype(int)
+    return [round(float(v), int(d)) for v, d in zip(volumes, decimals)]
+
+
+symbol_constraints = SymbolConstraintCache()
@@ -0,0 +1,138 @@
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Validità dell'ultimo tick letto per un simbolo, in millisecondi
+SYMBOL_TICK_TTL_MS = float(os.environ.get('SYMBOL_TICK_TTL_MS', 5))
+
+# Flag di symbol_info().filling_mode
+SYMBOL_FILLING_FOK = 1
+SYMBOL_FILLING_IOC = 2
+
+
+# Arrotonda un volume per difetto al passo del simbolo e lo limita al lotto massimo.
+# Restituisce None se il volume è inferiore al lotto minimo.
+def normalize_volume(volume, info):
+    step = getattr(info, 'volume_step', 0)
+    if not step:
+        return float(volume)
+
+    steps = math.floor(float(volume) / step + 1e-9)
+    decimals = max(0, -math.floor(math.log10(step)))
+    volume = round(min(steps * step, info.volume_max), decimals)
+    if volume < info.volume_min:
+        return None
+    return volume
+
+
+# Cache dei simboli del terminale connesso: le informazioni statiche (digits, lotti,
+# modalità di riempimento...) restano valide per tutta la sessione, l'ultimo tick solo
+# per pochi millisecondi
+class SymbolCache:
+    def __init__(self, tick_ttl_ms=SYMBOL_TICK_TTL_MS):
+        self.tick_ttl = tick_ttl_ms / 1000
+        self._info = {}
+        self._ticks = {}
+        self._filling_modes = {}
+        self._lock = threading.Lock()
+
+    # Svuota la cache, ad esempio dopo il collegamento a un altro account
+    def clear(self):
+        with self._lock:
+            self._info.clear()
+            self._ticks.clear()
+            self._filling_modes.clear()
+
+    # Informazioni statiche del simbolo, selezionandolo nel Market Watch se necessario.
+    # Restituisce None se il simbolo non esiste.
+    def info(self, symbol):
+        info = self._info.get(symbol)
+        if info is not None:
+            return info
+
+        import MetaTrader5 as mt5
+
+        info = mt5.symbol_info(symbol)
+        if info is None:
+            return None
+
+        if not info.visible:
+            if not mt5.symbol_select(symbol, True):
+                logger.warning(f"Impossibile selezionare il simbolo {symbol}: {mt5.last_error()}")
+                return info
+
+        with self._lock:
+            self._info[symbol] = info
+        return info
+
+    # Ultimo tick del simbolo, riletto dal terminale solo se più vecchio del TTL
+    # (o sempre, con fresh=True)
+    def tick(self, symbol, fresh=False):
+        now = time.monotonic()
+        cached = self._ticks.get(symbol)
+        if not fresh and cached is not None and now - cached[0] <= self.tick_ttl:
+            return cached[1]
+
+        import MetaTrader5 as mt5
+
+        tick = mt5.symbol_info_tick(symbol)
+        if tick is not None:
+            with self._lock:
+                self._ticks[symbol] = (now, tick)
+        return tick
+
+    # Modalità di riempimento (ORDER_FILLING_*) supportate dal simbolo, in ordine di
+    # preferenza: la prima è quella che ha funzionato per ultima
+    def filling_modes(self, symbol):
+        modes = self._filling_modes.get(symbol)
+        if modes is not None:
+            return list(modes)
+
+        import MetaTrader5 as mt5
+
+        info = self.info(symbol)
+        flags = getattr(info, 'filling_mode', 0) if info is not None else 0
+        modes = []
+        if flags & SYMBOL_FILLING_IOC:
+            modes.append(mt5.ORDER_FILLING_IOC)
+        if flags & SYMBOL_FILLING_FOK:
+            modes.append(mt5.ORDER_FILLING_FOK)
+        modes.append(mt5.ORDER_FILLING_RETURN)
+
+        with self._lock:
+            self._filling_modes[symbol] = modes
+        return list(modes)
+
+    # Ricorda la modalità di riempimento accettata dal broker per il simbolo
+    def prefer_filling_mode(self, symbol, mode):
+        modes = self.filling_modes(symbol)
+        if modes[0] != mode:
+            modes.remove(mode)
+            with self._lock:
+                self._filling_modes[symbol] = [mode] + modes
+
+    # Sposta in fondo una modalità di riempimento rifiutata dal broker per il simbolo
+    def reject_filling_mode(self, symbol, mode):
+        modes = self.filling_modes(symbol)
+        if modes[-1] != mode:
+            modes.remove(mode)
+            with self._lock:
+                self._filling_modes[symbol] = modes + [mode]
+
+    # Seleziona in anticipo i simboli indicati, così il primo ordine non paga la ricerca
+    def preload(self, symbols):
+        loaded = 0
+        for symbol in set(symbols):
+            if self.info(symbol) is not None:
+                loaded += 1
+            else:
+                logger.warning(f"Simbolo non trovato: {symbol}")
+        logger.info(f"Simboli preselezionati: {loaded}")
+        return loaded
+
+
+symbol_cache = SymbolCache()
@@ -0,0 +1,264 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, TimeoutError
+
+from mt5_executor import PRIORITY_READ, PRIORITY_TRADE
+
+logger = logging.getLogger(__name__)
+
+# Configurazione dei processi worker
+WORKER_CALL_TIMEOUT = float(os.environ.get('WORKER_CALL_TIMEOUT', 30.0))
+WORKER_START_TIMEOUT = float(os.environ.get('WORKER_START_TIMEOUT', 60.0))
+
+# Funzioni dell'agente che possono essere eseguite in un worker
+WORKER_FUNCTIONS = {
+    'get_account_info',
+    'get_positions',
+    'get_position_changes',
+    'get_history',
+    'query_history',
+    'export_history_page',
+    'get_analytics',
+    'open_position',
+    'close_position',
+    'modify_position',
+    'execute_batch',
+    'get_symbol_info'
+}
+
+
+# Inoltra gli eventi del watcher del worker al processo principale
+def _forward_events(subscriber, event_queue):
+    while True:
+        event_queue.put(subscriber.get())
+
+
+# Esegue una chiamata nel worker e invia la risposta con il suo id
+def _serve_call(conn, send_lock, call_id, name, args):
+    import agent
+
+    if name not in WORKER_FUNCTIONS:
+        result = (False, f"Funzione non supportata: {name}", None)
+    else:
+        try:
+            result = agent.run_local(name, *args)
+        except Exception as e:
+            result = (False, f"Errore: {e}", None)
+
+    with send_lock:
+        conn.send((call_id, result))
+
+
+# Corpo del processo worker: si collega al proprio terminale una sola volta ed esegue
+# le chiamate ricevute dal processo principale. Ogni chiamata ha un proprio thread e
+# passa dal thread del terminale del worker con la sua priorità: un ordine arrivato
+# durante il download della cronologia viene eseguito tra un blocco e il successivo.
+def _worker_main(account, conn, event_queue):
+    import agent
+
+    success, message = agent.mt5_executor.call(
+        PRIORITY_READ,
+        agent.initialize_mt5,
+        account['account_number'],
+        account.get('password'),
+        account.get('server'),
+        account['mt5_path']
+    )
+    conn.send((success, message))
+    if not success:
+        return
+
+    subscriber = agent.position_watcher.subscribe()
+    threading.Thread(target=_forward_events, args=(subscriber, event_queue), daemon=True).start()
+
+    send_lock = threading.Lock()
+    while True:
+        try:
+            call_id, name, args = conn.recv()
+        except EOFError:
+            break
+        threading.Thread(target=_serve_call, args=(conn, send_lock, call_id, name, args), daemon=True).start()
+
+
+# Processo dedicato a un singolo account/terminale. Le chiamate viaggiano sulla pipe con
+# un id e le risposte, che possono arrivare in un ordine diverso, vengono consegnate
+# alla chiamata corrispondente dal thread di lettura.
+class TerminalWorker:
+    def __init__(self, account, event_queue):
+        self.account = account
+        self.account_number = str(account['account_number'])
+        self.event_queue = event_queue
+        self.status = 'stopped'
+        self.message = None
+
+        self._process = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._call_ids = itertools.count(1)
+        # Chiamate in attesa di risposta: {id: Future}
+        self._pending = {}
+
+    def start(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_worker_main,
+            args=(self.account, child_conn, self.event_queue),
+            name=f'mt5-worker-{self.account_number}',
+            daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+
+        if not parent_conn.poll(WORKER_START_TIMEOUT):
+            self.stop()
+            parent_conn.close()
+            self.status, self.message = 'error', "Timeout nell'avvio del worker"
+            return False, self.message
+
+        try:
+            success, message = parent_conn.recv()
+        except EOFError:
+            success, message = False, "Worker terminato durante l'avvio"
+        self.status = 'online' if success else 'error'
+        self.message = message
+        if success:
+            threading.Thread(
+                target=self._read_responses, args=(parent_conn,), name=f'mt5-worker-{self.account_number}-reader', daemon=True
+            ).start()
+            logger.info(f"Worker avviato per l'account {self.account_number} (pid {self._process.pid})")
+        else:
+            parent_conn.close()
+            logger.error(f"Avvio del worker per l'account {self.account_number} fallito: {message}")
+        return success, message
+
+    def stop(self):
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+            self._process.join(5)
+        self.status = 'stopped'
+
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    # Consegna le risposte del worker alle chiamate in attesa; quando la pipe si chiude
+    # (worker terminato o riavviato) le chiamate ancora aperte falliscono
+    def _read_responses(self, conn):
+        while True:
+            try:
+                call_id, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(call_id, None)
+            if future is not None:
+                future.set_result(result)
+
+        conn.close()
+        for call_id, future in list(self._pending.items()):
+            if self._pending.pop(call_id, None) is not None:
+                future.set_result((False, "Worker del terminale terminato", None))
+
+    # Esegue una funzione dell'agente nel processo del worker, dove viene accodata sul
+    # thread del terminale con la priorità indicata. Allo scadere del timeout un ordine
+    # (terminale bloccato) riavvia il worker; una lettura o la cronologia no, e la sua
+    # risposta tardiva viene scartata.
+    def call(self, name, args, priority=PRIORITY_READ, timeout=WORKER_CALL_TIMEOUT):
+        with self._lock:
+            if not self.is_alive() or self.status != 'online':
+                logger.warning(f"Worker dell'account {self.account_number} non attivo, riavvio")
+                self.stop()
+                success, message = self.start()
+                if not success:
+                    return False, message, None
+            conn = self._conn
+
+        call_id = next(self._call_ids)
+        future = Future()
+        self._pending[call_id] = future
+        try:
+            with self._send_lock:
+                conn.send((call_id, name, args))
+        except OSError as e:
+            self._pending.pop(call_id, None)
+            return False, f"Errore nella comunicazione con il worker: {e}", None
+
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            self._pending.pop(call_id, None)
+            logger.error(f"Timeout della chiamata {name} sul worker dell'account {self.account_number}")
+            if priority == PRIORITY_TRADE:
+                with self._lock:
+                    if self._conn is conn:
+                        self.stop()
+            return False, "Timeout nella comunicazione con il terminale", None
+
+    def info(self):
+        return {
+            'account_number': self.account_number,
+            'mt5_path': self.account['mt5_path'],
+            'pid': self._process.pid if self._process is not None else None,
+            'alive': self.is_alive(),
+            'status': self.status,
+            'message': self.message,
+            'pending_calls': len(self._pending)
+        }
+
+
+# Pool di worker, uno per ogni account con un terminale dedicato in agent_config.json
+class TerminalWorkerPool:
+    def __init__(self):
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._event_queue = None
+        self._on_event = None
+
+    # Avvia un worker per ogni account configurato con 'mt5_path'
+    def start(self, accounts, on_event):
+        self._on_event = on_event
+        for account in accounts:
+            if account.get('mt5_path'):
+                self.start_worker(account)
+
+    # Avvia (o riavvia) il worker di un account
+    def start_worker(self, account):
+        with self._lock:
+            if self._event_queue is None:
+                self._event_queue = multiprocessing.Queue()
+                threading.Thread(target=self._relay_events, name='worker-events', daemon=True).start()
+
+            account_number = str(account['account_number'])
+            old = self._workers.pop(account_number, None)
+            if old is not None:
+                old.stop()
+
+            worker = TerminalWorker(account, self._event_queue)
+            self._workers[account_number] = worker
+
+        return worker.start()
+
+    def has(self, account_number):
+        return account_number is not None and str(account_number) in self._workers
+
+    def call(self, account_number, name, *args, priority=PRIORITY_READ):
+        worker = self._workers.get(str(account_number))
+        if worker is None:
+            return False, f"Nessun worker per l'account {account_number}", None
+        return worker.call(name, args, priority)
+
+    def info(self):
+        return [worker.info() for worker in list(self._workers.values())]
+
+    # Inoltra ai sottoscrittori del processo principale gli eventi dei worker
+    def _relay_events(self):
+        while True:
+            event = self._event_queue.get()
+            if self._on_event is not None:
+                self._on_event(event)
+
+
+terminal_workers = TerminalWorkerPool()
@@ -0,0 +1,169 @@
+import gzip
+import io
+import json
+import os
+
+import numpy as np
+from flask import Response, request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Formati delle risposte con molte righe (cronologia e posizioni):
+# - rows: lista di oggetti, uno per riga (formato storico)
+# - columns: JSON colonnare, un array per campo
+# - npz: array NumPy impacchettati in un archivio .npz, senza pickle
+FORMAT_ROWS = 'rows'
+FORMAT_COLUMNS = 'columns'
+FORMAT_NPZ = 'npz'
+
+# Content-Type di ogni formato, usati anche per la negoziazione tramite Accept
+MEDIA_TYPES = {
+    FORMAT_ROWS: 'application/json',
+    FORMAT_COLUMNS: 'application/vnd.mrc.columns+json',
+    FORMAT_NPZ: 'application/x-npz'
+}
+
+# Dimensione minima del corpo della risposta da comprimere, in byte
+WIRE_COMPRESS_MIN_BYTES = int(os.environ.get('WIRE_COMPRESS_MIN_BYTES', 1024))
+WIRE_GZIP_LEVEL = int(os.environ.get('WIRE_GZIP_LEVEL', 5))
+WIRE_ZSTD_LEVEL = int(os.environ.get('WIRE_ZSTD_LEVEL', 3))
+
+# Nome dell'array con la busta della risposta (success, message, campi non colonnari)
+NPZ_META_KEY = '__meta__'
+NPZ_COLUMN_PREFIX = 'col.'
+
+
+# Formato richiesto dal client: il parametro format ha precedenza sull'header Accept.
+# Restituisce None se il parametro format indica un formato non supportato.
+def negotiate_format(args, headers):
+    requested = args.get('format')
+    if requested:
+        return requested if requested in MEDIA_TYPES else None
+
+    accepted = headers.get('Accept', '')
+    for media_range in accepted.split(','):
+        media_type = media_range.split(';')[0].strip()
+        for wire_format, format_media_type in MEDIA_TYPES.items():
+            if wire_format != FORMAT_ROWS and media_type == format_media_type:
+                return wire_format
+    return FORMAT_ROWS
+
+
+# Compressione accettata dal client (zstd solo se il modulo zstandard è installato)
+def negotiate_encoding(headers):
+    accepted = {
+        coding.split(';')[0].strip().lower()
+        for coding in headers.get('Accept-Encoding', '').split(',')
+        if not coding.strip().endswith('q=0')
+    }
+    if zstandard is not None and 'zstd' in accepted:
+        return 'zstd'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+# Converte una lista di righe (dizionari con gli stessi campi) in colonne {campo: valori}.
+# Dati già colonnari vengono restituiti invariati.
+def to_columns(rows, fields=None):
+    if isinstance(rows, dict):
+        return rows
+    if fields is None:
+        fields = list(rows[0]) if rows else []
+    return {field: [row.get(field) for row in rows] for field in fields}
+
+
+# Converte colonne {campo: valori} in una lista di righe. Una lista di righe viene
+# restituita invariata (es. risposta di un agente che non supporta il formato colonnare).
+def from_columns(columns):
+    if not isinstance(columns, dict):
+        return columns
+    fields = list(columns)
+    return [dict(zip(fields, values)) for values in zip(*columns.values())]
+
+
+# Array NumPy di una colonna: i valori mancanti dei campi numerici diventano NaN e le
+# colonne miste diventano stringhe, così l'archivio si legge senza pickle
+def _column_array(values):
+    array = np.array(values)
+    if array.dtype == object:
+        try:
+            array = np.array(values, dtype=float)
+        except (TypeError, ValueError):
+            array = np.array(['' if value is None else str(value) for value in values])
+    return array
+
+
+# Serializza la risposta in un archivio .npz: una colonna per array e la busta in JSON
+def to_npz(envelope, columns):
+    buffer = io.BytesIO()
+    arrays = {NPZ_COLUMN_PREFIX + field: _column_array(values) for field, values in columns.items()}
+    arrays[NPZ_META_KEY] = np.array(json.dumps(envelope))
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+# Legge un archivio .npz prodotto da to_npz: restituisce la busta e le colonne
+def from_npz(content):
+    with np.load(io.BytesIO(content), allow_pickle=False) as archive:
+        envelope = json.loads(str(archive[NPZ_META_KEY]))
+        columns = {
+            name[len(NPZ_COLUMN_PREFIX):]: archive[name]
+            for name in archive.files if name.startswith(NPZ_COLUMN_PREFIX)
+        }
+    return envelope, columns
+
+
+def _compress(body, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=WIRE_ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=WIRE_GZIP_LEVEL)
+
+
+# Risposta di errore per un parametro format non supportato
+def unsupported_format_response():
+    return Response(
+        json.dumps({"error": f"Formato non supportato (formati disponibili: {', '.join(MEDIA_TYPES)})"}),
+        status=400, mimetype='application/json'
+    )
+
+
+# Risposta di successo nel formato e con la compressione negoziati col client.
+# rows_key indica il campo di data che contiene le righe (None se data è la lista stessa).
+def wire_response(data, rows_key=None, wire_format=None):
+    if wire_format is None:
+        wire_format = negotiate_format(request.args, request.headers)
+        if wire_format is None:
+            return unsupported_format_response()
+
+    rows = data if rows_key is None else data[rows_key]
+    if wire_format == FORMAT_ROWS:
+        rows = from_columns(rows)
+    else:
+        rows = to_columns(rows)
+
+    if wire_format == FORMAT_NPZ:
+        envelope = {"success": True, "format": wire_format}
+        if rows_key is not None:
+            envelope["data"] = {key: value for key, value in data.items() if key != rows_key}
+            envelope["rows_key"] = rows_key
+        body = to_npz(envelope, rows)
+    else:
+        if rows_key is not None:
+            rows = dict(data, **{rows_key: rows})
+        envelope = {"success": True, "data": rows}
+        if wire_format != FORMAT_ROWS:
+            envelope["format"] = wire_format
+        body = json.dumps(envelope, separators=(',', ':')).encode()
+
+    response = Response(body, mimetype=MEDIA_TYPES[wire_format])
+    response.vary.update(('Accept', 'Accept-Encoding'))
+
+    encoding = negotiate_encoding(request.headers)
+    if encoding is not None and len(body) >= WIRE_COMPRESS_MIN_BYTES:
+        response.set_data(_compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response